@@ -1,10 +1,19 @@
-from fastapi import APIRouter, UploadFile, HTTPException
-from typing import List
-from ..core.services.documentprocessor import DocumentProcessor
+import os
+import json
+import shutil
+import uuid
+from fastapi import APIRouter, UploadFile, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
+from typing import List, Literal, Optional
+from ..config import DATA_DIR
+from ..core.services.collection_manager import DEFAULT_COLLECTION, collection_manager
+from ..core.services.documentprocessor import DocumentProcessor, save_upload
+from ..core.services.index_factory import recall_report
+from ..core.services.jobs import IngestionJob, job_manager
+from ..core.services.metrics import render_metrics
 from ..core.services.queryprocessor import QueryProcessor
-from pydantic import BaseModel
-
-from ..core.services.in_memory_store import db_store
+from pydantic import BaseModel, Field
 
 router = APIRouter()
 
@@ -12,39 +21,174 @@ router = APIRouter()
 doc_processor = DocumentProcessor()
 query_processor = QueryProcessor()
 
-@router.post("/upload/")
-async def upload_documents(files: List[UploadFile]):
+def _check_collection_name(collection: str):
+    try:
+        collection_manager.validate_name(collection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _require_collection(collection: str):
+    """Returns the store for an existing collection, or the matching 400/404 error."""
+    _check_collection_name(collection)
+    if not collection_manager.exists(collection):
+        raise HTTPException(status_code=404, detail=f"No collection named '{collection}'.")
+    return collection_manager.get(collection)
+
+async def _start_ingestion_job(files: List[UploadFile], replace: bool, collection: str) -> IngestionJob:
+    """Streams the uploads to disk and queues them for background ingestion."""
+    work_dir = os.path.join(DATA_DIR, "uploads", uuid.uuid4().hex)
+    os.makedirs(work_dir)
+    try:
+        saved_files = [await save_upload(file, work_dir) for file in files]
+    except Exception:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise
+    job = IngestionJob([filename for _, filename in saved_files], work_dir=work_dir, collection=collection)
+    # The heavy lifting happens on the job manager's thread. Each finished job swaps the
+    # updated index in as a whole, so queries keep running against the previous one
+    # until the new one is completely ready.
+    return job_manager.submit(job, lambda job: doc_processor.process_and_store(
+        saved_files, replace=replace, progress=job.update_file, collection=collection
+    ))
+
+@router.post("/upload/", status_code=202)
+async def upload_documents(files: List[UploadFile], replace: bool = False, collection: str = DEFAULT_COLLECTION):
     if not files:
         raise HTTPException(status_code=400, detail="No files were uploaded.")
+    # Uploading to a collection that doesn't exist yet creates it.
+    _check_collection_name(collection)
 
     try:
-        # We'll hand off the heavy lifting of parsing and vectorizing to our dedicated document processor.
-        vector_store = doc_processor.process_and_store(files)
-        # If the processor couldn't get any usable text, there's nothing to store.
-        if vector_store is None:
-            raise HTTPException(status_code=400, detail="Could not extract any text from the uploaded documents.")
-        # Here's the key part: we're storing the processed knowledge base
-        # in a shared, in-memory object. This allows the /query endpoint to use it instantly.
-        # Note: This state will be lost if the server ever restarts.
-        db_store.vector_store = vector_store
-
-        return {"message": f"Successfully uploaded and processed {len(files)} documents."}
+        # We'll hand off the heavy lifting of parsing and vectorizing to our dedicated document processor,
+        # running in the background so this request (and every /query/) returns right away.
+        # New chunks are appended to the shared, in-memory knowledge base. Passing replace=true
+        # swaps out any chunks we already had for these file names instead of keeping both versions.
+        # Every change is also snapshotted to disk, so it survives a restart.
+        job = await _start_ingestion_job(files, replace, collection)
+        return {
+            "message": f"Accepted {len(files)} documents for processing.",
+            "job_id": job.id,
+            "status_url": f"/jobs/{job.id}"
+        }
     except Exception as e:
-        print(f"Error during document processing: {e}")
+        print(f"Error during document upload: {e}")
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    # Clients poll this to follow an upload: overall status plus each file's stage,
+    # chunk count and any error.
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No job found with id '{job_id}'.")
+    return job.to_dict()
+
+@router.get("/collections/")
+async def list_collections():
+    # Every collection with its size, whether it's loaded, how much memory it holds and
+    # when it was last used, plus the overall budget.
+    return await run_in_threadpool(collection_manager.memory_report)
+
+@router.get("/documents/")
+async def list_documents(collection: str = DEFAULT_COLLECTION):
+    # A quick look at what's in the knowledge base right now, one entry per source file.
+    store = await run_in_threadpool(_require_collection, collection)
+    return {"collection": collection, "documents": store.list_sources()}
+
+@router.get("/index/report")
+async def index_report(k: int = 10, sample_size: int = 100, nprobe: List[int] = Query(default=[]), ef_search: List[int] = Query(default=[]),
+                       collection: str = DEFAULT_COLLECTION):
+    # Benchmarks the live index against an exact search over the same vectors, so
+    # operators can pick nprobe/efSearch (or an index type) based on real numbers.
+    store = await run_in_threadpool(_require_collection, collection)
+    vector_store = store.vector_store
+    if vector_store is None:
+        raise HTTPException(status_code=404, detail="The knowledge base is empty.")
+    try:
+        report = await run_in_threadpool(
+            recall_report, vector_store, store.index_spec, k=k, sample_size=sample_size,
+            nprobe_values=nprobe or None, ef_search_values=ef_search or None
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"collection": collection, "configured": store.index_spec.to_dict(), **report}
+
+@router.put("/documents/{source}", status_code=202)
+async def replace_document(source: str, file: UploadFile, collection: str = DEFAULT_COLLECTION):
+    # The uploaded file takes over the given source name, and every chunk we had for it
+    # is swapped for the new version's chunks.
+    file.filename = source
+    _check_collection_name(collection)
+    try:
+        job = await _start_ingestion_job([file], replace=True, collection=collection)
+        return {"message": f"Accepted a replacement for '{source}'.", "job_id": job.id, "status_url": f"/jobs/{job.id}"}
+    except Exception as e:
+        print(f"Error during document upload: {e}")
+        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+
+@router.delete("/documents/{source}")
+async def delete_document(source: str, collection: str = DEFAULT_COLLECTION):
+    # Deleting rewrites the on-disk snapshot, so we keep it off the event loop.
+    store = await run_in_threadpool(_require_collection, collection)
+    removed = await run_in_threadpool(store.delete_source, source)
+    if not removed:
+        raise HTTPException(status_code=404, detail=f"No indexed chunks found for '{source}'.")
+    return {"message": f"Removed {removed} chunks for '{source}'.", "chunks_removed": removed}
+
 class QueryRequest(BaseModel):
     # Using Pydantic gives us nice, automatic validation for our request body.
     question: str
+    # Leave this out to use the server's default pipeline mode.
+    mode: Optional[Literal["per_document", "batched"]] = None
+    # Optional per-query search tuning for IVF (nprobe) and HNSW (ef_search) indexes.
+    nprobe: Optional[int] = Field(default=None, ge=1)
+    ef_search: Optional[int] = Field(default=None, ge=1)
+    # Which knowledge base to search.
+    collection: str = DEFAULT_COLLECTION
 
 @router.post("/query/")
 async def process_query(request: QueryRequest):
+    await run_in_threadpool(_require_collection, request.collection)
     try:
         # Now, we pass the user's question to the query processor, which will use the
-        # vector store we saved in memory from the /upload step.
-        result = query_processor.handle_query(request.question)
+        # vector store we saved in memory from the /upload step. The async mode sends
+        # the per-document LLM calls concurrently instead of one after another.
+        result = await query_processor.handle_query_async(
+            request.question, mode=request.mode, nprobe=request.nprobe, ef_search=request.ef_search,
+            collection=request.collection
+        )
         return result
     except Exception as e:
         print(f"Error during query processing: {e}")
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
     
+
+
+@router.post("/query/stream")
+async def stream_query(request: QueryRequest):
+    # Same pipeline as /query/, but the response is newline-delimited JSON: one "answer"
+    # event per document as soon as it's ready, "theme_token" events while the themes
+    # are being written, and a final "result" event with the full structured payload.
+    # A missing collection is worth a proper 404, which we can only send before streaming starts.
+    await run_in_threadpool(_require_collection, request.collection)
+
+    async def event_stream():
+        try:
+            async for event in query_processor.stream_query(
+                request.question, mode=request.mode, nprobe=request.nprobe, ef_search=request.ef_search,
+                collection=request.collection
+            ):
+                yield json.dumps(event) + "\n"
+        except Exception as e:
+            # The status code has already gone out by now, so errors travel as an event.
+            print(f"Error during query processing: {e}")
+            yield json.dumps({"event": "error", "detail": f"An error occurred: {str(e)}"}) + "\n"
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+@router.get("/metrics")
+async def metrics():
+    # Prometheus scrapes this: per-stage latency histograms, LLM call/token/retry
+    # counters, ingestion counts and the size of the index.
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
@@ -4,6 +4,15 @@ from pydantic_settings import BaseSettings
 
 env_path = 'backend/.env'
 
+DATA_DIR = "backend/data"
+VECTOR_STORE_PATH = os.path.join(DATA_DIR, "faiss_index")
+# Named collections other than "default" each get their own directory under here.
+COLLECTIONS_PATH = os.path.join(DATA_DIR, "collections")
+EMBEDDING_CACHE_PATH = os.path.join(DATA_DIR, "embedding_cache.sqlite3")
+OCR_CACHE_PATH = os.path.join(DATA_DIR, "ocr_cache.sqlite3")
+# Ingestion job state lives on disk, so any server process can answer a status poll.
+JOBS_PATH = os.path.join(DATA_DIR, "jobs")
+
 load_dotenv(dotenv_path=env_path)
 
 print("--- Running config.py ---")
@@ -15,4 +24,114 @@ class Settings(BaseSettings):
     """Defines the application's settings."""
     GOOGLE_API_KEY: str
 
+    # Stage 1 of a query fans out one LLM call per retrieved document. These knobs
+    # control how many of those calls can be in flight at once and how fast we're
+    # allowed to spend our Gemini quota. A rate of 0 means no limit of that kind.
+    LLM_MAX_CONCURRENCY: int = 5
+    LLM_REQUESTS_PER_SECOND: float = 4.0
+    LLM_TOKENS_PER_MINUTE: int = 1_000_000
+    LLM_MAX_RETRIES: int = 4
+    LLM_RETRY_BASE_DELAY: float = 1.0
+
+    # Embeddings are cached on disk by (model, text hash); only misses reach the API,
+    # in batches of this size. Old entries are evicted once the cache outgrows its budget.
+    EMBEDDING_BATCH_SIZE: int = 100
+    EMBEDDING_CACHE_MAX_BYTES: int = 512 * 1024 * 1024
+
+    # Which model turns text into vectors: "google" (the Gemini API), "sentence_transformers"
+    # (a local model on the CPU) or "hashing" (a dependency-free feature hasher for tests
+    # and offline use). EMBEDDING_MODEL overrides the backend's default model, and
+    # EMBEDDING_DIMENSION only applies to hashing. Local backends use EMBEDDING_THREADS
+    # threads (0 means one per core). Each index remembers the model that built it and
+    # won't load under a different one, so switching means re-indexing.
+    EMBEDDING_BACKEND: str = "google"
+    EMBEDDING_MODEL: str = ""
+    EMBEDDING_DIMENSION: int = 1024
+    EMBEDDING_THREADS: int = 0
+
+    # How many uvicorn worker processes serve the API. Procfile and start.sh pass it to
+    # --workers. Each worker has its own ingestion pool and loaded collections, so the
+    # defaults below are shared out between them rather than given to each in full.
+    WEB_CONCURRENCY: int = 1
+
+    # PDF parsing and OCR are CPU-bound, so ingestion fans out over a process pool.
+    # 0 means an equal share of the cores for each web worker; 1 keeps everything in the API process. Big PDFs are
+    # split into page ranges of this size so a single file can use several cores too.
+    INGEST_MAX_WORKERS: int = 0
+    INGEST_PDF_PAGES_PER_TASK: int = 8
+
+    # Images, and PDF pages with fewer than OCR_MIN_PAGE_CHARS characters of real text
+    # (i.e. scans), go through Tesseract. They're grayscaled and shrunk to OCR_MAX_DPI
+    # first, and the text is cached by image content so a repeated scan is never OCR'd
+    # twice. OCR_MIN_PAGE_CHARS=0 turns OCR of PDF pages off. TESSERACT_CMD is only
+    # needed when the tesseract binary isn't on PATH.
+    OCR_MAX_DPI: int = 300
+    OCR_MIN_PAGE_CHARS: int = 20
+    OCR_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    TESSERACT_CMD: str = ""
+
+    # Finished query results are cached by normalized question (LRU + TTL) and dropped
+    # whenever the corpus changes. A threshold above 0 also lets a question reuse the
+    # result of an earlier one whose embedding is at least that cosine-similar.
+    QUERY_CACHE_MAX_ENTRIES: int = 256
+    QUERY_CACHE_TTL_SECONDS: float = 3600
+    QUERY_CACHE_SIMILARITY_THRESHOLD: float = 0.0
+
+    # "per_document" makes one LLM call per retrieved chunk plus a synthesis call;
+    # "batched" sends every chunk in a single call and gets structured JSON back.
+    # Requests can override this per query.
+    QUERY_PIPELINE_MODE: str = "per_document"
+
+    # Retrieval fetches RETRIEVAL_FETCH_K candidates (0 means RETRIEVAL_MAX_K) and trims
+    # them before any LLM call: chunks scoring under RETRIEVAL_RELATIVE_CUTOFF times the
+    # best match are dropped (keeping at least RETRIEVAL_MIN_K), so are chunks at least
+    # RETRIEVAL_DUPLICATE_THRESHOLD cosine-similar to a better one, then up to
+    # RETRIEVAL_MAX_K are picked (by MMR when RETRIEVAL_MMR_LAMBDA is above 0) and
+    # neighbouring chunks from the same page are merged into one.
+    RETRIEVAL_MAX_K: int = 5
+    RETRIEVAL_MIN_K: int = 1
+    RETRIEVAL_FETCH_K: int = 0
+    RETRIEVAL_RELATIVE_CUTOFF: float = 0.7
+    RETRIEVAL_DUPLICATE_THRESHOLD: float = 0.95
+    RETRIEVAL_MMR_LAMBDA: float = 0.0
+    RETRIEVAL_MERGE_ADJACENT: bool = True
+
+    # Which FAISS index to use: "flat" (exact), "ivf_flat", "ivf_pq", "hnsw", or the
+    # reduced-precision "sq_fp16" (half the memory, near-identical results) and "sq8" (a
+    # quarter). Stores start exact and switch to IVF or sq8 once they hold
+    # FAISS_TRAIN_MIN_VECTORS vectors (0 means 39 per IVF cell). nprobe/efSearch are
+    # defaults that queries can override.
+    FAISS_INDEX_TYPE: str = "flat"
+    FAISS_IVF_NLIST: int = 1024
+    FAISS_PQ_M: int = 16
+    FAISS_PQ_NBITS: int = 8
+    FAISS_HNSW_M: int = 32
+    FAISS_HNSW_EF_CONSTRUCTION: int = 200
+    FAISS_NPROBE: int = 16
+    FAISS_EF_SEARCH: int = 64
+    FAISS_TRAIN_MIN_VECTORS: int = 0
+
+    # Uploads add a small segment to the index and deletes only mark rows as gone, so a
+    # write never has to copy or rewrite the whole corpus. Small segments are merged as
+    # they pile up (all of them once there are more than INDEX_MAX_SEGMENTS), and once
+    # the rows added or deleted since the last compaction pass INDEX_COMPACT_RATIO of
+    # the compacted ones, the next write compacts the index back into one segment.
+    INDEX_MAX_SEGMENTS: int = 16
+    INDEX_COMPACT_RATIO: float = 0.25
+
+    # Every collection has its own index. Once the loaded ones add up to more than this
+    # many bytes, the least recently used are dropped from memory and reloaded from
+    # disk the next time they're needed. 0 keeps everything loaded. The budget is for
+    # the whole server: each of the WEB_CONCURRENCY workers gets an equal share. It
+    # bounds what each worker holds on its own (IVF centroids, HNSW levels, id lookups
+    # and anything FAISS couldn't map), not the snapshot files mapped into every worker,
+    # which the page cache keeps once and the kernel can reclaim under pressure.
+    COLLECTION_MEMORY_BUDGET_BYTES: int = 2 * 1024 * 1024 * 1024
+
+    # Requests slower than PROFILE_SLOW_REQUEST_MS get a sampling profile saved under
+    # DATA_DIR/profiles (0 turns this off, and it needs pyinstrument installed). Only a
+    # PROFILE_SAMPLE_RATE share of requests is profiled, since profiling isn't free.
+    PROFILE_SLOW_REQUEST_MS: float = 0
+    PROFILE_SAMPLE_RATE: float = 0.1
+
 settings = Settings()
\ No newline at end of file
@@ -0,0 +1,18 @@
+from typing import List
+from pydantic import BaseModel, Field
+
+# These models describe the JSON we ask the LLM for in the "batched" pipeline mode,
+# where a single call returns every per-document answer plus the themes.
+
+class ChunkAnswer(BaseModel):
+    chunk_id: int = Field(description="The number of the chunk this answer is based on.")
+    answer: str = Field(min_length=1)
+
+class Theme(BaseModel):
+    theme: str = Field(min_length=1)
+    supporting_documents: List[str]
+    highlight: str = Field(min_length=1)
+
+class BatchedAnswer(BaseModel):
+    answers: List[ChunkAnswer]
+    themes: List[Theme]
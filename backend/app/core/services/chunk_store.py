@@ -0,0 +1,310 @@
+import json
+import os
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+import numpy as np
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain.schema import Document
+
+# Chunk metadata is almost always just source, page and paragraph, so those get columns
+# of their own. Anything else a chunk carries is kept as-is in a small side table.
+MISSING = -1
+
+CHUNK_FILES = {
+    "ids": "chunk_ids.npy",
+    "text": "chunk_text.npy",
+    "offsets": "chunk_offsets.npy",
+    "source_index": "chunk_source_index.npy",
+    "pages": "chunk_pages.npy",
+    "paragraphs": "chunk_paragraphs.npy"
+}
+CHUNK_META_FILE = "chunk_meta.json"
+
+def _as_int(value) -> Optional[int]:
+    # bool is an int subclass, but True isn't a page number.
+    return value if isinstance(value, int) and not isinstance(value, bool) else None
+
+class ChunkStore(Docstore, AddableMixin):
+    """A columnar docstore: one UTF-8 text blob plus flat arrays, instead of a Document per chunk.
+
+    Chunk i's text is text[offsets[i]:offsets[i + 1]], its source is
+    sources[source_index[i]], and its page and paragraph are plain int32s. Every source
+    name is stored once however many chunks it has. Documents are only built when
+    search() asks for one, which happens for a handful of chunks per query.
+
+    The arrays are never modified in place: add() and delete() build new ones. That
+    makes copy() cheap (it shares them) and lets the arrays be memory-mapped straight
+    from a snapshot.
+    """
+    def __init__(self, ids: Optional[np.ndarray] = None, text: Optional[np.ndarray] = None, offsets: Optional[np.ndarray] = None,
+                 source_index: Optional[np.ndarray] = None, pages: Optional[np.ndarray] = None, paragraphs: Optional[np.ndarray] = None,
+                 sources: Optional[List[str]] = None, extras: Optional[Dict[str, dict]] = None):
+        self.ids = ids if ids is not None else np.zeros(0, dtype="S1")
+        self.text = text if text is not None else np.zeros(0, dtype=np.uint8)
+        self.offsets = offsets if offsets is not None else np.zeros(1, dtype=np.int64)
+        self.source_index = source_index if source_index is not None else np.zeros(0, dtype=np.int32)
+        self.pages = pages if pages is not None else np.zeros(0, dtype=np.int32)
+        self.paragraphs = paragraphs if paragraphs is not None else np.zeros(0, dtype=np.int32)
+        self.sources = sources if sources is not None else []
+        # Metadata that doesn't fit the columns, keyed by chunk id. Normally empty.
+        self.extras = extras if extras is not None else {}
+        self._source_lookup = {name: i for i, name in enumerate(self.sources)}
+        self._sorted = None
+
+    @classmethod
+    def from_documents(cls, documents: Dict[str, Document]) -> "ChunkStore":
+        store = cls()
+        store.add(documents)
+        return store
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def copy(self) -> "ChunkStore":
+        """A copy that can be changed without affecting this one. The arrays are shared, since they're never changed in place."""
+        return ChunkStore(self.ids, self.text, self.offsets, self.source_index, self.pages, self.paragraphs,
+                          list(self.sources), dict(self.extras))
+
+    @property
+    def private_bytes(self) -> int:
+        """Roughly how much memory the store holds in this process alone.
+
+        Memory-mapped columns live in the page cache, shared with every other process
+        that maps the same snapshot, so they don't count. Source names, extras and the
+        sorted copy of the ids made for lookups always do.
+        """
+        arrays = [array for array in (self.ids, self.text, self.offsets, self.source_index, self.pages, self.paragraphs)
+                  if not isinstance(array, np.memmap)]
+        if self._sorted is not None:
+            arrays.extend(self._sorted)
+        return (sum(array.nbytes for array in arrays) + sum(len(name) for name in self.sources)
+                + len(json.dumps(self.extras, default=str)))
+
+    def _rows(self, ids: Iterable[str]) -> np.ndarray:
+        """Row numbers for the given ids, with -1 for ids we don't have."""
+        queries = np.array([doc_id.encode("utf-8") for doc_id in ids])
+        if len(self.ids) == 0 or len(queries) == 0:
+            return np.full(len(queries), -1, dtype=np.int64)
+        if self._sorted is None:
+            # A sorted copy of the ids and a binary search beats a dict of n Python strings
+            # on memory, and a query only ever looks up a handful of chunks.
+            order = np.argsort(self.ids, kind="stable")
+            self._sorted = (self.ids[order], order)
+        sorted_ids, order = self._sorted
+        positions = np.minimum(np.searchsorted(sorted_ids, queries), len(sorted_ids) - 1)
+        found = sorted_ids[positions] == queries
+        return np.where(found, order[positions], -1)
+
+    def rows(self, ids: Iterable[str], missing_ok: bool = False) -> np.ndarray:
+        """Row numbers for the given ids, in the same order.
+
+        Raises KeyError if any of them isn't stored, unless missing_ok is set, in which
+        case those get -1.
+        """
+        ids = list(ids)
+        rows = self._rows(ids)
+        if not missing_ok and (rows == -1).any():
+            missing = [doc_id for doc_id, row in zip(ids, rows) if row == -1]
+            raise KeyError(f"Ids not found in the docstore: {missing}")
+        return rows
+
+    def document(self, row: int) -> Document:
+        """The chunk at a row number, built on the spot."""
+        return self._document(row)
+
+    def _document(self, row: int) -> Document:
+        doc_id = self.ids[row].decode("utf-8")
+        metadata = {}
+        if self.source_index[row] != MISSING:
+            metadata["source"] = self.sources[self.source_index[row]]
+        if self.pages[row] != MISSING:
+            metadata["page"] = int(self.pages[row])
+        if self.paragraphs[row] != MISSING:
+            metadata["paragraph"] = int(self.paragraphs[row])
+        metadata.update(self.extras.get(doc_id, {}))
+        text = bytes(self.text[self.offsets[row]:self.offsets[row + 1]]).decode("utf-8")
+        return Document(id=doc_id, page_content=text, metadata=metadata)
+
+    def search(self, search: str) -> Union[str, Document]:
+        row = int(self._rows([search])[0])
+        if row == -1:
+            # Same answer as LangChain's InMemoryDocstore, which FAISS checks for.
+            return f"ID {search} not found."
+        return self._document(row)
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        if not texts:
+            return
+        new_ids = list(texts)
+        overlapping = [doc_id for doc_id, row in zip(new_ids, self._rows(new_ids)) if row != -1]
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {set(overlapping)}")
+
+        encoded, source_index, pages, paragraphs = [], [], [], []
+        for doc_id, doc in texts.items():
+            encoded.append(doc.page_content.encode("utf-8"))
+            metadata = dict(doc.metadata)
+            source = metadata.pop("source", None)
+            if isinstance(source, str):
+                if source not in self._source_lookup:
+                    self._source_lookup[source] = len(self.sources)
+                    self.sources.append(source)
+                source_index.append(self._source_lookup[source])
+            else:
+                source_index.append(MISSING)
+                if source is not None:
+                    metadata["source"] = source
+            for field, column in (("page", pages), ("paragraph", paragraphs)):
+                value = _as_int(metadata.get(field))
+                column.append(MISSING if value is None else value)
+                if value is not None:
+                    del metadata[field]
+            if metadata:
+                self.extras[doc_id] = metadata
+
+        lengths = np.fromiter((len(chunk) for chunk in encoded), dtype=np.int64, count=len(encoded))
+        self.ids = np.concatenate([self.ids, np.array([doc_id.encode("utf-8") for doc_id in new_ids])])
+        self.text = np.concatenate([self.text, np.frombuffer(b"".join(encoded), dtype=np.uint8)])
+        self.offsets = np.concatenate([self.offsets, self.offsets[-1] + np.cumsum(lengths)])
+        self.source_index = np.concatenate([self.source_index, np.array(source_index, dtype=np.int32)])
+        self.pages = np.concatenate([self.pages, np.array(pages, dtype=np.int32)])
+        self.paragraphs = np.concatenate([self.paragraphs, np.array(paragraphs, dtype=np.int32)])
+        self._sorted = None
+
+    def take(self, rows: np.ndarray) -> "ChunkStore":
+        """A new store holding just the given rows, in the given order."""
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = self.offsets[:-1][rows]
+        lengths = self.offsets[1:][rows] - starts
+        new_offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        # Gathers every kept byte in one go: for each output byte, where it came from.
+        byte_positions = np.repeat(starts - new_offsets[:-1], lengths) + np.arange(new_offsets[-1])
+        kept_ids = self.ids[rows]
+        kept = {doc_id.decode("utf-8") for doc_id in kept_ids} if self.extras else set()
+        return ChunkStore(
+            ids=kept_ids,
+            text=self.text[byte_positions],
+            offsets=new_offsets,
+            source_index=self.source_index[rows],
+            pages=self.pages[rows],
+            paragraphs=self.paragraphs[rows],
+            sources=list(self.sources),
+            extras={doc_id: meta for doc_id, meta in self.extras.items() if doc_id in kept}
+        )
+
+    def delete(self, ids: List) -> None:
+        rows = self._rows(ids)
+        if (rows == -1).any():
+            missing = [doc_id for doc_id, row in zip(ids, rows) if row == -1]
+            raise ValueError(f"Ids not found in the docstore: {missing}")
+        keep = np.ones(len(self.ids), dtype=bool)
+        keep[rows] = False
+        compacted = self.take(np.flatnonzero(keep))
+        # Sources with no chunks left are left in the table; it's one string each.
+        self.ids, self.text, self.offsets = compacted.ids, compacted.text, compacted.offsets
+        self.source_index, self.pages, self.paragraphs = compacted.source_index, compacted.pages, compacted.paragraphs
+        self.extras = compacted.extras
+        self._sorted = None
+
+    def _source_of(self, row: int):
+        # Only rows whose source wasn't a plain string get here, so this is rare.
+        return self.extras.get(self.ids[row].decode("utf-8"), {}).get("source", "N/A")
+
+    def source_counts(self, rows: np.ndarray) -> Dict[str, int]:
+        """How many of the given rows came from each source, counted straight from the source column."""
+        source_index = self.source_index[rows]
+        named = source_index != MISSING
+        counts = np.bincount(source_index[named], minlength=len(self.sources))
+        grouped = {self.sources[i]: int(count) for i, count in enumerate(counts) if count}
+        for row in np.asarray(rows)[~named]:
+            source = self._source_of(row)
+            grouped[source] = grouped.get(source, 0) + 1
+        return grouped
+
+    def rows_of_source(self, source: str) -> np.ndarray:
+        """The row numbers of every chunk from the given source, in row order."""
+        index = self._source_lookup.get(source)
+        rows = np.flatnonzero(self.source_index == index) if index is not None else np.zeros(0, dtype=np.int64)
+        unnamed = np.flatnonzero(self.source_index == MISSING)
+        if len(unnamed):
+            rows = np.union1d(rows, [row for row in unnamed if self._source_of(row) == source]).astype(np.int64)
+        return rows
+
+    def ids_by_source(self) -> Dict[str, List[str]]:
+        """Groups chunk ids by source name, in row order. Chunks without a source go under "N/A"."""
+        grouped = {}
+        for doc_id, index in zip(self.ids, self.source_index):
+            source = self.sources[index] if index != MISSING else self.extras.get(doc_id.decode("utf-8"), {}).get("source", "N/A")
+            grouped.setdefault(source, []).append(doc_id.decode("utf-8"))
+        return grouped
+
+class RowIds(Mapping):
+    """index_to_docstore_id for a segment whose docstore rows are in index order.
+
+    Position i's id is ids[i], decoded when asked for, so a loaded segment doesn't keep
+    a dict with a Python string per chunk alive in every worker.
+    """
+    def __init__(self, ids: np.ndarray):
+        self.ids = ids
+
+    def __getitem__(self, position: int) -> str:
+        if not 0 <= position < len(self.ids):
+            raise KeyError(position)
+        return self.ids[position].decode("utf-8")
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(len(self.ids)))
+
+def concatenate(stores: List[ChunkStore]) -> ChunkStore:
+    """One store holding every row of the given stores, in order. Their ids must not overlap."""
+    if not stores:
+        return ChunkStore()
+    sources, lookup, extras = [], {}, {}
+    ids, text, offsets = [], [], [np.zeros(1, dtype=np.int64)]
+    source_index, pages, paragraphs = [], [], []
+    text_end = 0
+    for store in stores:
+        for name in store.sources:
+            if name not in lookup:
+                lookup[name] = len(sources)
+                sources.append(name)
+        # The extra MISSING on the end means a MISSING source index maps to itself.
+        remap = np.array([lookup[name] for name in store.sources] + [MISSING], dtype=np.int32)
+        start, end = store.offsets[0], store.offsets[-1]
+        ids.append(store.ids)
+        text.append(store.text[start:end])
+        offsets.append(store.offsets[1:] - start + text_end)
+        source_index.append(remap[store.source_index])
+        pages.append(store.pages)
+        paragraphs.append(store.paragraphs)
+        extras.update(store.extras)
+        text_end += end - start
+    return ChunkStore(
+        ids=np.concatenate(ids),
+        text=np.concatenate(text),
+        offsets=np.concatenate(offsets).astype(np.int64),
+        source_index=np.concatenate(source_index).astype(np.int32),
+        pages=np.concatenate(pages).astype(np.int32),
+        paragraphs=np.concatenate(paragraphs).astype(np.int32),
+        sources=sources,
+        extras=extras
+    )
+
+def save_chunk_store(store: ChunkStore, directory: str) -> List[str]:
+    """Writes the store's columns as .npy files (so they can be memory-mapped later). Returns the file names."""
+    for field, name in CHUNK_FILES.items():
+        np.save(os.path.join(directory, name), np.ascontiguousarray(getattr(store, field)), allow_pickle=False)
+    with open(os.path.join(directory, CHUNK_META_FILE), "w") as f:
+        json.dump({"sources": store.sources, "extras": store.extras}, f, default=str)
+    return [*CHUNK_FILES.values(), CHUNK_META_FILE]
+
+def load_chunk_store(directory: str, mmap: bool = True) -> ChunkStore:
+    """Loads a store written by save_chunk_store, memory-mapping the arrays unless told not to."""
+    mode = "r" if mmap else None
+    arrays = {field: np.load(os.path.join(directory, name), mmap_mode=mode, allow_pickle=False) for field, name in CHUNK_FILES.items()}
+    with open(os.path.join(directory, CHUNK_META_FILE)) as f:
+        meta = json.load(f)
+    return ChunkStore(sources=meta["sources"], extras=meta["extras"], **arrays)
@@ -0,0 +1,149 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from ...config import COLLECTIONS_PATH, VECTOR_STORE_PATH, settings
+from .in_memory_store import InMemoryVectorStore
+from .index_snapshot import read_current_manifest
+from .metrics import COLLECTION_EVICTIONS
+
+DEFAULT_COLLECTION = "default"
+
+# Collection names become directory names, so we keep them to a safe, boring alphabet.
+COLLECTION_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$")
+
+class CollectionNotFound(KeyError):
+    """Raised when a collection is looked up that nobody has uploaded anything to yet."""
+
+class CollectionManager:
+    """Hands out one vector store per named collection and keeps their memory use bounded.
+
+    Each collection has its own index and snapshot directory. The store objects
+    themselves are cheap to keep around; what costs memory is a loaded index. After
+    every access we check the total against the budget and unload the least recently
+    used collections until we're back under it. An unloaded collection comes back from
+    its snapshot on the next access, so callers never have to care whether it's resident.
+    """
+    def __init__(self, base_path: str = COLLECTIONS_PATH, memory_budget_bytes: int = 0, default_path: Optional[str] = VECTOR_STORE_PATH):
+        self.base_path = base_path
+        self.memory_budget_bytes = memory_budget_bytes
+        # The default collection lives where the single shared index always did, so
+        # existing deployments keep their data.
+        self.default_path = default_path
+        self._stores: "OrderedDict[str, InMemoryVectorStore]" = OrderedDict()
+        self._last_access: Dict[str, float] = {}
+        # Reentrant, since get() checks exists() while it already holds the lock.
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def validate_name(name: str) -> str:
+        if not COLLECTION_NAME_PATTERN.match(name or ""):
+            raise ValueError(
+                f"Invalid collection name '{name}'. Use up to 64 letters, digits, '-' or '_', starting with a letter or digit."
+            )
+        return name
+
+    def _path_for(self, name: str) -> str:
+        return self.default_path if name == DEFAULT_COLLECTION else os.path.join(self.base_path, name)
+
+    def exists(self, name: str) -> bool:
+        with self._lock:
+            if name == DEFAULT_COLLECTION or name in self._stores:
+                return True
+        return os.path.isdir(self._path_for(name))
+
+    def get(self, name: str = DEFAULT_COLLECTION, create: bool = False) -> InMemoryVectorStore:
+        """Returns the store for a collection and marks it as just used.
+
+        Reads pass create=False, so a typo'd name is an error instead of a silently empty
+        collection; uploads pass create=True.
+        """
+        self.validate_name(name)
+        with self._lock:
+            store = self._stores.get(name)
+            if store is None:
+                if not create and not self.exists(name):
+                    raise CollectionNotFound(name)
+                store = InMemoryVectorStore(path=self._path_for(name), name=name)
+                self._stores[name] = store
+            self._stores.move_to_end(name)
+            self._last_access[name] = time.time()
+        # We load it now so its size counts before we decide what else has to make room.
+        store.ensure_loaded()
+        self.enforce_budget(keep=name)
+        return store
+
+    def enforce_budget(self, keep: Optional[str] = None) -> List[str]:
+        """Unloads least recently used collections until the loaded ones fit the budget.
+
+        The collection named by keep (the one a request is about to use) is never
+        evicted, even if it's bigger than the whole budget on its own. Returns the
+        names of the collections that were unloaded.
+        """
+        if self.memory_budget_bytes <= 0:
+            return []
+        with self._lock:
+            resident = [(name, store) for name, store in self._stores.items() if store.is_resident]
+        total = sum(store.resident_bytes for _, store in resident)
+        evicted = []
+        # We unload outside our own lock: unload() waits for any write in progress on
+        # that store, and lookups for other collections shouldn't queue up behind it.
+        for name, store in resident:
+            if total <= self.memory_budget_bytes:
+                break
+            if name == keep:
+                continue
+            size = store.resident_bytes
+            if store.unload():
+                total -= size
+                evicted.append(name)
+                COLLECTION_EVICTIONS.inc()
+                print(f"Unloaded collection '{name}' ({size} bytes) to stay within the memory budget.")
+        return evicted
+
+    def list_names(self) -> List[str]:
+        with self._lock:
+            names = {DEFAULT_COLLECTION, *self._stores}
+        if os.path.isdir(self.base_path):
+            names.update(name for name in os.listdir(self.base_path) if COLLECTION_NAME_PATTERN.match(name))
+        return sorted(names)
+
+    def stats(self) -> List[dict]:
+        """Per-collection numbers, read from the snapshot manifest for collections that aren't loaded."""
+        with self._lock:
+            stores = dict(self._stores)
+            last_access = dict(self._last_access)
+        results = []
+        for name in self.list_names():
+            store = stores.get(name)
+            resident_vectors = store.resident_vector_count if store is not None else None
+            if resident_vectors is not None:
+                vectors = resident_vectors
+                version = store.snapshot_version
+            else:
+                # We don't want a stats call to drag every collection into memory.
+                manifest = read_current_manifest(self._path_for(name))
+                vectors = manifest["vectors"] if manifest else 0
+                version = manifest["version"] if manifest else 0
+            results.append({
+                "collection": name,
+                "resident": resident_vectors is not None,
+                "vectors": vectors,
+                "bytes_resident": store.resident_bytes if store is not None else 0,
+                "snapshot_version": version,
+                "last_access": last_access.get(name)
+            })
+        return results
+
+    def memory_report(self) -> dict:
+        collections = self.stats()
+        return {
+            "memory_budget_bytes": self.memory_budget_bytes,
+            "bytes_resident": sum(entry["bytes_resident"] for entry in collections),
+            "collections": collections
+        }
+
+# Each web worker loads collections on its own, so each gets its share of the budget.
+collection_manager = CollectionManager(memory_budget_bytes=settings.COLLECTION_MEMORY_BUDGET_BYTES // max(1, settings.WEB_CONCURRENCY))
@@ -1,132 +1,219 @@
 import os
-import pytesseract
-from PIL import Image
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain.schema import Document
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from fastapi import UploadFile
-from typing import List
-from ...config import settings
+from typing import Callable, List, Optional, Tuple
+from ...config import DATA_DIR, OCR_CACHE_PATH, settings
+from .embeddings import get_embeddings
+from .extraction import (
+    PDF_EXTENSIONS, IMAGE_EXTENSIONS, count_pdf_pages,
+    extract_text_from_pdf_pages, extract_text_from_image, run_timed
+)
+from .collection_manager import DEFAULT_COLLECTION, collection_manager
+from .ocr import OcrOptions
+from .metrics import INGESTED_CHUNKS, INGESTED_FILES, record_span, span
 
-try:
-    pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
-except Exception as e:
-    print(f"Tesseract configuration skipped, assuming it's in PATH. Error: {e}")
+# Uploads are copied to disk in pieces of this size, so memory use stays flat no matter how big the file is.
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 
-DATA_DIR = "backend/data"
-VECTOR_STORE_PATH = os.path.join(DATA_DIR, "faiss_index")
+async def save_upload(file: UploadFile, dest_dir: str) -> Tuple[str, str]:
+    """Streams an uploaded file to disk chunk by chunk and returns (file_path, filename)."""
+    # We only keep the base name, so a crafted filename can't write outside dest_dir.
+    filename = os.path.basename(file.filename or "") or "upload"
+    file_path = os.path.join(dest_dir, filename)
+    with span("ingest", "file_write"), open(file_path, "wb") as f:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            f.write(chunk)
+    await file.close()
+    return file_path, filename
 
 class DocumentProcessor:
     def __init__(self):
-        # We configure our text splitter once here. The goal is to break down large
-        # documents into smaller, more manageable chunks for the AI model.
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000, 
-            chunk_overlap=200,
-            separators=["\n\n", "\n", ". ", " ", ""]
-        )
         # This sets up the Google service that will convert our text chunks into
         # numerical vectors (embeddings), which is how the computer can find similarities.
-        self.embeddings = GoogleGenerativeAIEmbeddings(
-            model="models/embedding-001",
-            google_api_key=settings.GOOGLE_API_KEY
+        self.embeddings = get_embeddings()
+        # Parsing and OCR run in worker processes so a big upload can use every core.
+        # The pool is started on first use, since spinning it up isn't free. Every web
+        # worker has a pool of its own, so by default they split the cores between them.
+        self.max_workers = settings.INGEST_MAX_WORKERS or max(1, (os.cpu_count() or 1) // max(1, settings.WEB_CONCURRENCY))
+        self.pdf_pages_per_task = max(1, settings.INGEST_PDF_PAGES_PER_TASK)
+        # Workers don't load the app's settings, so the OCR ones travel with each task.
+        self.ocr_options = OcrOptions(
+            max_dpi=settings.OCR_MAX_DPI,
+            min_page_chars=settings.OCR_MIN_PAGE_CHARS,
+            cache_path=OCR_CACHE_PATH,
+            cache_max_bytes=settings.OCR_CACHE_MAX_BYTES,
+            tesseract_cmd=settings.TESSERACT_CMD
         )
+        self._executor = None
         if not os.path.exists(DATA_DIR):
             os.makedirs(DATA_DIR)
 
-    def _create_documents_with_paragraph_metadata(self, text_chunks, source, page_number):
-        """Helper function to create Document objects with paragraph metadata."""
-        documents = []
-        for i, chunk in enumerate(text_chunks):
-            # We're creating a LangChain 'Document' object here. The metadata is key,
-            # as it allows us to trace an answer back to its exact source later on.
-            documents.append(Document(
-                page_content=chunk,
-                metadata={
-                    'source': source, 
-                    'page': page_number,
-                    'paragraph': i + 1 
-                }
-            ))
-        return documents
-
-    def _extract_text_from_pdf(self, file_path: str, filename: str):
-        """Extracts text from a PDF, splits by paragraph, and adds metadata."""
-        print(f"Processing PDF: {filename}")
-        loader = PyPDFLoader(file_path)
-        pages = loader.load()
-        
-        all_page_chunks = []
-        for page in pages:
-            text_chunks = self.text_splitter.split_text(page.page_content)
-            docs = self._create_documents_with_paragraph_metadata(
-                text_chunks, 
-                filename, 
-                page.metadata.get('page', 0) + 1
+    def _get_executor(self):
+        if self._executor is None:
+            # We use 'spawn' rather than fork, because the API process has threads running
+            # and forking those is asking for deadlocks.
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
             )
-            all_page_chunks.extend(docs)
-        return all_page_chunks
+        return self._executor
 
-    def _extract_text_from_image(self, file_path: str, filename: str):
-        """Extracts text from an image, splits by paragraph, and adds metadata."""
-        print(f"Processing Image: {filename}")
-        try:
-            # Pytesseract does the heavy lifting of 'reading' the image.
-            text = pytesseract.image_to_string(Image.open(file_path))
-            if not text:
-                return []
-            
-            text_chunks = self.text_splitter.split_text(text)
-            return self._create_documents_with_paragraph_metadata(
-                text_chunks, 
-                filename, 
-                1 # Images don't have multiple pages, so we just use 1.
-            )
-        except Exception as e:
-            print(f"Error processing image {filename}: {e}")
-            return []
+    def _discard_executor(self, executor):
+        """Shuts a broken pool down and forgets it, so the next upload starts a fresh one."""
+        # Every future still pending on a broken pool fails the same way, so we only
+        # have to shut it down once, without waiting on workers that are already gone.
+        if self._executor is executor:
+            self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
 
-    def process_and_store(self, files: List[UploadFile]):
-        """Processes uploaded files and returns an in-memory FAISS vector store."""
-        all_chunks = []
-        temp_dir = os.path.join(DATA_DIR, "temp_files")
-        if not os.path.exists(temp_dir):
-            os.makedirs(temp_dir)
+    def _plan_tasks(self, file_path: str, filename: str):
+        """Breaks one file into independent extraction tasks, in page order."""
+        file_ext = os.path.splitext(filename)[1].lower()
+        if file_ext in PDF_EXTENSIONS:
+            print(f"Processing PDF: {filename}")
+            page_count = count_pdf_pages(file_path)
+            return [
+                (extract_text_from_pdf_pages, file_path, filename, first, min(first + self.pdf_pages_per_task, page_count), self.ocr_options)
+                for first in range(0, page_count, self.pdf_pages_per_task)
+            ]
+        if file_ext in IMAGE_EXTENSIONS:
+            print(f"Processing Image: {filename}")
+            return [(extract_text_from_image, file_path, filename, self.ocr_options)]
+        print(f"Unsupported file type: {filename}, skipping.")
+        return []
 
-        try:
-            for file in files:
-                file_path = os.path.join(temp_dir, file.filename)
-                with open(file_path, "wb") as f:
-                    f.write(file.file.read())
+    @staticmethod
+    def _collect(timed_result):
+        """Records the stage timings a task reported and returns its documents."""
+        documents, stage_seconds = timed_result
+        for stage, seconds in stage_seconds.items():
+            record_span("ingest", stage, seconds)
+        return documents
 
-                chunks = []
-                file_ext = os.path.splitext(file.filename)[1].lower()
+    def _run_tasks(self, tasks_per_file):
+        """Runs every task and returns one list of Documents per file (None if it failed)."""
+        results = [[None] * len(tasks) for tasks in tasks_per_file]
+        failed = set()
+        if self.max_workers <= 1:
+            for file_index, tasks in enumerate(tasks_per_file):
+                for task_index, (func, *args) in enumerate(tasks):
+                    try:
+                        results[file_index][task_index] = self._collect(run_timed(func, *args))
+                    except Exception as e:
+                        print(f"Error processing {args[1]}, skipping it: {e}")
+                        failed.add(file_index)
+                        break
+        else:
+            executor = self._get_executor()
+            futures = {}
+            for file_index, tasks in enumerate(tasks_per_file):
+                for task_index, (func, *args) in enumerate(tasks):
+                    futures[executor.submit(run_timed, func, *args)] = (file_index, task_index, args[1])
+            for future, (file_index, task_index, filename) in futures.items():
+                try:
+                    results[file_index][task_index] = self._collect(future.result())
+                except BrokenProcessPool as e:
+                    # A worker died outright (e.g. killed for memory). We start a fresh pool
+                    # next time instead of failing every upload from here on.
+                    print(f"Ingestion worker crashed while processing {filename}, skipping it: {e}")
+                    self._discard_executor(executor)
+                    failed.add(file_index)
+                except Exception as e:
+                    print(f"Error processing {filename}, skipping it: {e}")
+                    failed.add(file_index)
+        # We stitch the pieces back together by (file, page range) rather than by the
+        # order they finished in, so the output is the same on every run.
+        return [
+            None if file_index in failed else [doc for part in parts for doc in part]
+            for file_index, parts in enumerate(results)
+        ]
+
+    def extract_documents(self, files: List[Tuple[str, str]], progress: Optional[Callable] = None):
+        """Parses saved (file_path, filename) pairs into chunked Document objects, without embedding them."""
+        progress = progress or (lambda *args, **kwargs: None)
+        all_chunks = []
+        tasks_per_file = []
+        for file_path, filename in files:
+            progress(filename, "extracting")
+            try:
+                tasks = self._plan_tasks(file_path, filename)
+            except Exception as e:
+                # A file we can't even open shouldn't take the rest of the upload down with it.
+                print(f"Error processing {filename}, skipping it: {e}")
+                INGESTED_FILES.labels("failed").inc()
+                progress(filename, "failed", error=str(e))
+                tasks = []
+            tasks_per_file.append(tasks)
 
-                if file_ext == '.pdf':
-                    chunks = self._extract_text_from_pdf(file_path, file.filename)
-                elif file_ext in ['.png', '.jpg', '.jpeg', '.tiff', '.bmp']:
-                    chunks = self._extract_text_from_image(file_path, file.filename)
-                else:
-                    print(f"Unsupported file type: {file.filename}, skipping.")
+        for (file_path, filename), tasks, chunks in zip(files, tasks_per_file, self._run_tasks(tasks_per_file)):
+            if not tasks:
+                if os.path.splitext(filename)[1].lower() not in PDF_EXTENSIONS + IMAGE_EXTENSIONS:
+                    INGESTED_FILES.labels("unsupported").inc()
+                    progress(filename, "skipped", error="Unsupported file type.")
+                continue
+            if chunks is None:
+                INGESTED_FILES.labels("failed").inc()
+                progress(filename, "failed", error="Text extraction failed.")
+            elif not chunks:
+                INGESTED_FILES.labels("empty").inc()
+                progress(filename, "skipped", chunks=0, error="No text could be extracted.")
+            else:
+                INGESTED_FILES.labels("extracted").inc()
+                progress(filename, "extracted", chunks=len(chunks))
+                all_chunks.extend(chunks)
+        return all_chunks
 
-                if chunks:
-                    all_chunks.extend(chunks)
-        finally:
-            # This 'finally' block is important. It ensures that we clean up all the
-            # temporary files and remove the directory, even if an error happened during processing.
-            for file in os.listdir(temp_dir):
-                os.remove(os.path.join(temp_dir, file))
-            os.rmdir(temp_dir)
+    def process_and_store(self, files: List[Tuple[str, str]], replace: bool = False, progress: Optional[Callable] = None,
+                          collection: str = DEFAULT_COLLECTION):
+        """Processes saved files and adds their new chunks to the shared vector store.
 
+        files is a list of (file_path, filename) pairs; the filename becomes each chunk's
+        source. With replace=True, chunks previously indexed for those filenames are
+        dropped once the new ones are in, so a re-upload swaps in the new version.
+        progress, if given, is called as progress(filename, stage, chunks=..., error=...).
+        Chunks go into the named collection, which is created if it doesn't exist yet.
+        """
+        progress = progress or (lambda *args, **kwargs: None)
+        all_chunks = self.extract_documents(files, progress)
         if not all_chunks:
             print("No text could be extracted from the documents.")
             return None
-        # This is the final, crucial step. FAISS takes all our text chunks, uses the
-        # Google embedding service to turn them into vectors, and organizes them
-        # into a searchable in-memory database.
-        print("Creating in-memory vector store...")
-        vector_store = FAISS.from_documents(all_chunks, self.embeddings)
-        print("In-memory vector store created.")
-        return vector_store
\ No newline at end of file
+
+        sources = list(dict.fromkeys(doc.metadata["source"] for doc in all_chunks))
+        for filename in sources:
+            progress(filename, "embedding")
+        replace_sources = list(dict.fromkeys(filename for _, filename in files)) if replace else []
+        # This is the final, crucial step. Only chunks that aren't already in the index
+        # get sent to the Google embedding service and appended to the FAISS store, so
+        # the cost of an upload grows with what's new rather than with the whole corpus.
+        print("Adding new chunks to the vector store...")
+        before = self.embeddings.stats()
+        try:
+            store = collection_manager.get(collection, create=True)
+            added, skipped, removed = store.add_documents(all_chunks, self.embeddings, replace_sources=replace_sources)
+            # The collection just grew, which may push the loaded ones over the memory budget.
+            collection_manager.enforce_budget(keep=collection)
+        except Exception as e:
+            for filename in sources:
+                progress(filename, "failed", error=str(e))
+            raise
+        after = self.embeddings.stats()
+        # Texts we'd embedded before (from earlier uploads or overlapping documents) come
+        # straight out of the cache, so we report how much that saved on this upload.
+        hits = after["hits"] - before["hits"]
+        misses = after["misses"] - before["misses"]
+        cache_report = {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            "bytes_saved": after["bytes_saved"] - before["bytes_saved"]
+        }
+        INGESTED_CHUNKS.labels("added").inc(added)
+        INGESTED_CHUNKS.labels("skipped").inc(skipped)
+        INGESTED_CHUNKS.labels("removed").inc(removed)
+        print(f"Vector store updated: {added} chunks added, {skipped} already indexed, {removed} removed. Embedding cache: {cache_report}")
+        for filename in sources:
+            progress(filename, "indexed")
+        return {"chunks_added": added, "chunks_skipped": skipped, "chunks_removed": removed, "embedding_cache": cache_report}
\ No newline at end of file
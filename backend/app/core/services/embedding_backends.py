@@ -0,0 +1,104 @@
+import os
+import re
+import zlib
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+class LocalEmbeddings(Embeddings, ABC):
+    """Base class for embedding models that run on this machine instead of behind an API.
+
+    Subclasses only need to embed one batch of texts into a float32 matrix. We split
+    bigger calls into batches and spread them over a thread pool, and every backend
+    exposes a model_id that gets recorded with the index it was used to build.
+    """
+    model_id = "local"
+
+    def __init__(self, batch_size: int = 256, num_threads: int = 0):
+        self.batch_size = max(1, batch_size)
+        self.num_threads = num_threads or os.cpu_count() or 1
+        self._executor = None
+
+    @abstractmethod
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        """Embeds one batch of texts into a (len(texts), dimension) float32 matrix."""
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.num_threads, thread_name_prefix="embedding")
+        return self._executor
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        batches = [texts[start:start + self.batch_size] for start in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1 or self.num_threads == 1:
+            matrices = [self._embed_batch(batch) for batch in batches]
+        else:
+            matrices = list(self._get_executor().map(self._embed_batch, batches))
+        return np.vstack(matrices).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        # A single question is far too small to be worth handing to another thread.
+        return self._embed_batch([text])[0].tolist()
+
+class HashingEmbeddings(LocalEmbeddings):
+    """A dependency-free bag-of-words embedding built with the hashing trick.
+
+    Words and word pairs are hashed into a fixed number of buckets with a random sign,
+    and the result is normalized to unit length. It knows nothing about meaning, so it's
+    no match for a trained model, but it's instant, deterministic across processes and
+    machines, and good enough for tests, benchmarks and keyword-heavy corpora.
+    """
+    def __init__(self, dimension: int = 1024, batch_size: int = 256, num_threads: int = 0):
+        super().__init__(batch_size=batch_size, num_threads=num_threads)
+        self.dimension = dimension
+        self.model_id = f"hashing-v1-{dimension}"
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = _TOKEN_PATTERN.findall(text.lower())
+            features = tokens + [f"{first} {second}" for first, second in zip(tokens, tokens[1:])]
+            if not features:
+                continue
+            # crc32 rather than hash(), because Python salts hash() per process and the
+            # vectors have to come out the same after a restart.
+            hashes = np.fromiter((zlib.crc32(feature.encode("utf-8")) for feature in features), dtype=np.uint32, count=len(features))
+            signs = np.where(hashes >> 31, -1.0, 1.0).astype(np.float32)
+            np.add.at(matrix[row], hashes % self.dimension, signs)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+class SentenceTransformerEmbeddings(LocalEmbeddings):
+    """Runs a sentence-transformers model (e.g. all-MiniLM-L6-v2) locally on the CPU."""
+    def __init__(self, model_name: str, batch_size: int = 64, num_threads: int = 0):
+        super().__init__(batch_size=batch_size, num_threads=num_threads)
+        # sentence-transformers pulls in torch, so it's only needed if this backend is picked.
+        try:
+            import torch
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError(
+                "EMBEDDING_BACKEND=sentence_transformers needs the sentence-transformers package. "
+                "Install it with 'pip install sentence-transformers'."
+            ) from e
+        # Torch already spreads each batch over its own threads, so we let it have the
+        # cores instead of running several batches side by side.
+        torch.set_num_threads(self.num_threads)
+        self.num_threads = 1
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.model_id = f"sentence-transformers:{model_name}"
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True
+        ).astype(np.float32)
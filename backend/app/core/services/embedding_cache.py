@@ -0,0 +1,180 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import List
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """A size-bounded SQLite table of embedding vectors keyed by (model, text hash)."""
+    def __init__(self, path: str, max_bytes: int):
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # One connection shared behind a lock is plenty within a process; the expensive
+        # part is the embedding API, not SQLite. Every server worker writes to the same
+        # file, so we wait for another worker's write rather than fail with "database is locked".
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Workers can open a fresh file at the same time, so the schema goes in as one
+        # write transaction and the size row can't miss a row inserted halfway through.
+        self._conn.execute("BEGIN IMMEDIATE")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL,"
+            " last_access REAL NOT NULL, PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)")
+        # The total size lives in a one-row table that triggers keep up to date, so it
+        # changes in the same transaction as the rows themselves, whichever worker writes
+        # them. A cache from before this table existed is summed up once, here.
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings_size (id INTEGER PRIMARY KEY CHECK (id = 0), total INTEGER NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO embeddings_size SELECT 0, COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings")
+        self._conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS embeddings_added AFTER INSERT ON embeddings"
+            " BEGIN UPDATE embeddings_size SET total = total + LENGTH(NEW.vector); END"
+        )
+        self._conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS embeddings_removed AFTER DELETE ON embeddings"
+            " BEGIN UPDATE embeddings_size SET total = total - LENGTH(OLD.vector); END"
+        )
+        self._conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS embeddings_replaced AFTER UPDATE OF vector ON embeddings"
+            " BEGIN UPDATE embeddings_size SET total = total + LENGTH(NEW.vector) - LENGTH(OLD.vector); END"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def get_many(self, model: str, hashes: List[str]) -> dict:
+        """Returns {hash: vector} for every hash we have, and marks those entries as recently used."""
+        found = {}
+        now = time.time()
+        with self._lock:
+            # SQLite caps the number of bound parameters, so we look keys up in slices.
+            for start in range(0, len(hashes), 500):
+                batch = hashes[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch]
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if found:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, key) for key in found]
+                )
+                self._conn.commit()
+        return found
+
+    def put_many(self, model: str, items: dict):
+        """Stores {hash: vector} and evicts the least recently used entries if we're over budget."""
+        now = time.time()
+        rows = [(model, key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items.items()]
+        with self._lock:
+            # An upsert rather than INSERT OR REPLACE: REPLACE deletes the old row without
+            # firing the delete trigger, which would leave the old vector in the total.
+            self._conn.executemany(
+                "INSERT INTO embeddings VALUES (?, ?, ?, ?) ON CONFLICT (model, text_hash)"
+                " DO UPDATE SET vector = excluded.vector, last_access = excluded.last_access",
+                rows
+            )
+            # The insert already holds the write lock, so no other worker can move the total
+            # between here and the commit.
+            total = self.total_bytes()
+            if total > self.max_bytes:
+                self._evict(total)
+            self._conn.commit()
+
+    def total_bytes(self) -> int:
+        """How many bytes of vectors the cache holds, across every worker."""
+        return self._conn.execute("SELECT total FROM embeddings_size").fetchone()[0]
+
+    def _evict(self, total: int):
+        # We trim down to 90% of the budget so we're not evicting again on the very next insert.
+        target = int(self.max_bytes * 0.9)
+        cursor = self._conn.execute("SELECT model, text_hash, LENGTH(vector) FROM embeddings ORDER BY last_access")
+        doomed = []
+        for model, key, size in cursor:
+            if total <= target:
+                break
+            doomed.append((model, key))
+            total -= size
+        cursor.close()
+        self._conn.executemany("DELETE FROM embeddings WHERE model = ? AND text_hash = ?", doomed)
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an embedding model so repeated texts are served from the cache instead of the API."""
+    def __init__(self, base: Embeddings, model_name: str, cache: EmbeddingCache, batch_size: int = 100):
+        self.base = base
+        self.model_name = model_name
+        self.cache = cache
+        self.batch_size = max(1, batch_size)
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        # Question lookups are counted separately so they don't blur the per-upload numbers.
+        self.query_hits = 0
+        self.query_misses = 0
+
+    def stats(self) -> dict:
+        """A snapshot of the running counters, handy for diffing before and after an upload."""
+        with self._stats_lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "bytes_saved": self.bytes_saved,
+                "query_hits": self.query_hits,
+                "query_misses": self.query_misses
+            }
+
+    def _record(self, texts: List[str], hit_hashes: set, hashes: List[str]):
+        with self._stats_lock:
+            for text, key in zip(texts, hashes):
+                if key in hit_hashes:
+                    self.hits += 1
+                    self.bytes_saved += len(text.encode("utf-8"))
+                else:
+                    self.misses += 1
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [text_hash(text) for text in texts]
+        vectors = self.cache.get_many(self.model_name, list(dict.fromkeys(hashes)))
+        self._record(texts, set(vectors), hashes)
+
+        # Each distinct missing text goes to the backend once, in batches, no matter how
+        # many times it shows up in this call.
+        missing = {}
+        for text, key in zip(texts, hashes):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        missing_keys = list(missing)
+        for start in range(0, len(missing_keys), self.batch_size):
+            batch_keys = missing_keys[start:start + self.batch_size]
+            batch_vectors = self.base.embed_documents([missing[key] for key in batch_keys])
+            fresh = dict(zip(batch_keys, batch_vectors))
+            self.cache.put_many(self.model_name, fresh)
+            vectors.update(fresh)
+        return [vectors[key] for key in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        # Some models embed questions differently from documents, so queries get their own key space.
+        model = f"{self.model_name}#query"
+        key = text_hash(text)
+        cached = self.cache.get_many(model, [key])
+        with self._stats_lock:
+            if key in cached:
+                self.query_hits += 1
+            else:
+                self.query_misses += 1
+        if key in cached:
+            return cached[key]
+        vector = self.base.embed_query(text)
+        self.cache.put_many(model, {key: vector})
+        return vector
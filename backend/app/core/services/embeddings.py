@@ -0,0 +1,50 @@
+from functools import lru_cache
+from ...config import settings, EMBEDDING_CACHE_PATH
+from .embedding_cache import CachedEmbeddings, EmbeddingCache
+
+EMBEDDING_BACKENDS = ("google", "sentence_transformers", "hashing")
+
+EMBEDDING_MODEL = "models/embedding-001"
+DEFAULT_SENTENCE_TRANSFORMER_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+def create_embedding_backend():
+    """Builds the configured embedding model. Returns (model, model_id)."""
+    backend = settings.EMBEDDING_BACKEND
+    if backend == "google":
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        model_name = settings.EMBEDDING_MODEL or EMBEDDING_MODEL
+        base = GoogleGenerativeAIEmbeddings(model=model_name, google_api_key=settings.GOOGLE_API_KEY)
+        # The Gemini model's id is just its name, which is what the cache and the
+        # snapshots have always used, so existing data stays valid.
+        return base, model_name
+    if backend == "sentence_transformers":
+        from .embedding_backends import SentenceTransformerEmbeddings
+        base = SentenceTransformerEmbeddings(
+            settings.EMBEDDING_MODEL or DEFAULT_SENTENCE_TRANSFORMER_MODEL,
+            batch_size=settings.EMBEDDING_BATCH_SIZE,
+            num_threads=settings.EMBEDDING_THREADS
+        )
+        return base, base.model_id
+    if backend == "hashing":
+        from .embedding_backends import HashingEmbeddings
+        base = HashingEmbeddings(
+            dimension=settings.EMBEDDING_DIMENSION,
+            batch_size=settings.EMBEDDING_BATCH_SIZE,
+            num_threads=settings.EMBEDDING_THREADS
+        )
+        return base, base.model_id
+    raise ValueError(f"Unknown embedding backend '{backend}'. Expected one of {', '.join(EMBEDDING_BACKENDS)}.")
+
+@lru_cache(maxsize=None)
+def get_embeddings():
+    """Returns the embedding model shared by ingestion, querying and index loading."""
+    # Everything that touches the index has to embed text the same way, so we build
+    # the model once and hand out the same instance everywhere. It sits behind the
+    # on-disk cache, so a chunk or question we've seen before is never embedded twice.
+    base, model_id = create_embedding_backend()
+    return CachedEmbeddings(
+        base,
+        model_name=model_id,
+        cache=EmbeddingCache(EMBEDDING_CACHE_PATH, settings.EMBEDDING_CACHE_MAX_BYTES),
+        batch_size=settings.EMBEDDING_BATCH_SIZE
+    )
@@ -0,0 +1,137 @@
+# Text extraction helpers that run inside the ingestion worker processes. Everything
+# here is a plain module-level function so it can be shipped to a ProcessPoolExecutor,
+# and the module stays away from the app's config and API clients so workers start fast.
+import time
+from contextlib import contextmanager
+from typing import Optional
+import pypdfium2
+from PIL import Image
+from pypdf import PdfReader
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.schema import Document
+from .ocr import OCR_ERRORS, OcrOptions, content_hash, image_content_key, ocr_image, render_pdf_page, tesseract_available
+
+PDF_EXTENSIONS = ['.pdf']
+IMAGE_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.tiff', '.bmp']
+
+_text_splitter = None
+
+# Seconds spent in each extraction stage by the task this process is running. Workers
+# can't report to the app's metrics directly, so run_timed hands these back instead.
+_stage_seconds = {}
+
+@contextmanager
+def _timed(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _stage_seconds[stage] = _stage_seconds.get(stage, 0.0) + time.perf_counter() - start
+
+def run_timed(func, *args):
+    """Runs one extraction task and returns (documents, {stage: seconds})."""
+    _stage_seconds.clear()
+    documents = func(*args)
+    return documents, dict(_stage_seconds)
+
+def get_text_splitter():
+    """Builds the text splitter once per process and reuses it afterwards."""
+    global _text_splitter
+    if _text_splitter is None:
+        # The goal is to break down large documents into smaller, more manageable
+        # chunks for the AI model.
+        _text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=1000,
+            chunk_overlap=200,
+            separators=["\n\n", "\n", ". ", " ", ""]
+        )
+    return _text_splitter
+
+def create_documents_with_paragraph_metadata(text_chunks, source, page_number):
+    """Helper function to create Document objects with paragraph metadata."""
+    documents = []
+    for i, chunk in enumerate(text_chunks):
+        # We're creating a LangChain 'Document' object here. The metadata is key,
+        # as it allows us to trace an answer back to its exact source later on.
+        documents.append(Document(
+            page_content=chunk,
+            metadata={
+                'source': source,
+                'page': page_number,
+                'paragraph': i + 1
+            }
+        ))
+    return documents
+
+def count_pdf_pages(file_path: str) -> int:
+    return len(PdfReader(file_path).pages)
+
+def extract_text_from_pdf_pages(file_path: str, filename: str, first_page: int, last_page: int,
+                                ocr_options: Optional[OcrOptions] = None):
+    """Extracts text from a range of PDF pages, splits by paragraph, and adds metadata.
+
+    Scanned pages have no text layer, so pypdf hands back nothing for them. With
+    ocr_options set, any page with fewer than min_page_chars characters is rendered and
+    OCR'd instead; pages that do have text never go near Tesseract. If Tesseract isn't
+    installed, or fails on a page, that page keeps the text pypdf found.
+    """
+    with _timed("pdf_load"):
+        reader = PdfReader(file_path)
+    all_page_chunks = []
+    rendered_pdf = None
+    ocr_pages = cached_pages = 0
+    try:
+        for page_index in range(first_page, last_page):
+            with _timed("pdf_text"):
+                text = reader.pages[page_index].extract_text() or ""
+            if (ocr_options is not None and ocr_options.min_page_chars and len(text.strip()) < ocr_options.min_page_chars
+                    and tesseract_available(ocr_options)):
+                if rendered_pdf is None:
+                    rendered_pdf = pypdfium2.PdfDocument(file_path)
+                with _timed("pdf_render"):
+                    image = render_pdf_page(rendered_pdf, page_index, ocr_options.max_dpi)
+                # Rendering is deterministic, so the same scanned page hashes the same
+                # way whichever PDF it turns up in.
+                try:
+                    ocr_text, cached = ocr_image(lambda: image, ocr_options, image_content_key(image), _timed)
+                    text = ocr_text or text
+                    ocr_pages += 1
+                    cached_pages += cached
+                except OCR_ERRORS as e:
+                    print(f"OCR failed on page {page_index + 1} of {filename}, keeping its text layer: {e}")
+            with _timed("split"):
+                text_chunks = get_text_splitter().split_text(text)
+            all_page_chunks.extend(create_documents_with_paragraph_metadata(
+                text_chunks,
+                filename,
+                page_index + 1
+            ))
+    finally:
+        if rendered_pdf is not None:
+            rendered_pdf.close()
+    if ocr_pages:
+        print(f"OCR'd {ocr_pages} scanned page(s) of {filename} ({cached_pages} from the OCR cache).")
+    return all_page_chunks
+
+def extract_text_from_image(file_path: str, filename: str, ocr_options: Optional[OcrOptions] = None):
+    """Extracts text from an image, splits by paragraph, and adds metadata."""
+    ocr_options = ocr_options or OcrOptions()
+    # We key the cache on the file's bytes, so a repeat upload is answered without even
+    # decoding the image.
+    with _timed("ocr_cache"):
+        with open(file_path, "rb") as f:
+            key = content_hash(f.read())
+    # Pytesseract does the heavy lifting of 'reading' the image.
+    text, cached = ocr_image(lambda: Image.open(file_path), ocr_options, key, _timed)
+    if cached:
+        print(f"Reused cached OCR text for {filename}.")
+    if not text:
+        return []
+
+    with _timed("split"):
+        text_chunks = get_text_splitter().split_text(text)
+    return create_documents_with_paragraph_metadata(
+        text_chunks,
+        filename,
+        1 # Images don't have multiple pages, so we just use 1.
+    )
@@ -1,9 +1,314 @@
-from typing import Optional
-from langchain_community.vectorstores import FAISS
+import hashlib
+import json
+import threading
+from contextlib import nullcontext
+from typing import List, Optional
+import faiss
+import numpy as np
+from langchain.schema import Document
+from ...config import VECTOR_STORE_PATH, settings
+from .embeddings import get_embeddings
+from .index_factory import IndexSpec
+from .metrics import COLLECTION_RESIDENT_BYTES, INDEX_SOURCES, INDEX_VECTORS, span
+from .segments import SegmentedStore, build_segment
+from .index_snapshot import (
+    EmbeddingModelMismatch, current_generation, load_segment, load_snapshot, read_current_version, read_index_copy,
+    save_snapshot, writer_lock
+)
+
+def chunk_id(doc: Document) -> str:
+    """A content hash over the chunk text plus its metadata, used as its id in the index."""
+    payload = json.dumps({"text": doc.page_content, "metadata": doc.metadata}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
 class InMemoryVectorStore:
-    """A simple class to hold the vector store in memory."""
-    def __init__(self):
-        self.vector_store: Optional[FAISS] = None
+    """Holds the vector store in memory and keeps an on-disk snapshot of it up to date.
+
+    With a path, the store is really a view of the latest published snapshot, which is
+    memory-mapped. Several server processes can each have one for the same path and
+    share a single copy of the vectors (plus HNSW's graph and IVF's lists) and the
+    chunk columns in the page cache (see read_mapped_index). What each worker still
+    holds on its own is small: IVF centroids and direct maps, a few arrays per segment,
+    and, in a worker that writes, a sorted copy of the ids for dedupe. An index type
+    FAISS can't map is read into every worker in full, and we log when that happens.
+    Whenever one process publishes, the others notice on their next access and remap.
+
+    The index is a SegmentedStore, so a write only builds and saves the chunks it adds
+    plus a list of deleted positions. Small segments are merged as they pile up, and
+    once the rows added and deleted since the last compaction add up to more than
+    compact_ratio of the base segment, the write compacts the store into one segment.
+    """
+    def __init__(self, path: Optional[str] = VECTOR_STORE_PATH, index_spec: Optional[IndexSpec] = None, name: str = "default",
+                 max_segments: Optional[int] = None, compact_ratio: Optional[float] = None):
+        self.name = name
+        self.path = path
+        self.index_spec = index_spec or IndexSpec.from_settings()
+        self.max_segments = max_segments or settings.INDEX_MAX_SEGMENTS
+        self.compact_ratio = compact_ratio if compact_ratio is not None else settings.INDEX_COMPACT_RATIO
+        self._vector_store: Optional[SegmentedStore] = None
+        # Only writers take this lock. Readers just grab the current vector_store
+        # reference, which writers never modify in place (see SegmentedStore).
+        self._lock = threading.RLock()
+        self._loaded = path is None
+        self.snapshot_version = 0
+        # Which publish of CURRENT our mapping came from (see current_generation).
+        self._generation = None
+        # Roughly how much memory the loaded index and docstore take up in this process
+        # alone, not counting what's mapped from the snapshot (0 when unloaded).
+        self.resident_bytes = 0
+
+    @property
+    def corpus_version(self) -> int:
+        """A counter that moves forward every time the indexed corpus changes."""
+        self._load()
+        return self.snapshot_version
+
+    @property
+    def vector_store(self) -> Optional[SegmentedStore]:
+        # We don't touch the disk until someone actually needs the index, so the app
+        # starts instantly and the first query or upload pays for the (mmap'd) load.
+        self._load()
+        return self._vector_store
+
+    def ensure_loaded(self):
+        """Loads the index now (or remaps a newer snapshot) instead of waiting for the first access."""
+        self._load()
+
+    def _load(self):
+        if self._loaded:
+            self._refresh()
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            vector_store, version = None, 0
+            for attempt in range(2):
+                generation = current_generation(self.path)
+                try:
+                    vector_store, version = load_snapshot(self.path, get_embeddings())
+                    break
+                except EmbeddingModelMismatch:
+                    # Starting empty here would let the next upload publish over the old
+                    # index, so a model mismatch is an error every caller gets to see.
+                    raise
+                except Exception as e:
+                    # Another process may have published and pruned the snapshot we were
+                    # in the middle of reading, which is worth one more try.
+                    if attempt == 0 and current_generation(self.path) != generation:
+                        continue
+                    print(f"Could not load the saved index from {self.path}, starting empty. Error: {e}")
+                    break
+            self._generation = generation
+            self._install(vector_store, version)
+            self._loaded = True
+
+    def _install(self, vector_store: Optional[SegmentedStore], version: int):
+        self._vector_store = vector_store
+        self.snapshot_version = version
+        self.resident_bytes = self._measure_resident_bytes()
+        COLLECTION_RESIDENT_BYTES.labels(self.name).set(self.resident_bytes)
+        self._update_gauges()
+
+    def _refresh(self, wait: bool = False):
+        """Remaps the latest snapshot if another process has published since we mapped ours.
+
+        Readers pass wait=False: if this process is busy writing, they carry on with the
+        current store rather than queue behind the write. Queries already running keep
+        the reference they grabbed, so nobody sees the swap halfway through.
+        """
+        if self.path is None or current_generation(self.path) == self._generation:
+            return
+        if not self._lock.acquire(blocking=wait):
+            return
+        try:
+            generation = current_generation(self.path)
+            if not self._loaded or generation == self._generation:
+                return
+            if read_current_version(self.path) == self.snapshot_version:
+                self._generation = generation
+                return
+            try:
+                # Segments we already have mapped are kept, so we only map what's new.
+                vector_store, version = load_snapshot(self.path, get_embeddings(), reuse=self._vector_store)
+            except EmbeddingModelMismatch:
+                raise
+            except Exception as e:
+                # We keep serving what we have and try again on the next access.
+                print(f"Could not map the newer index snapshot from {self.path}, keeping v{self.snapshot_version}. Error: {e}")
+                return
+            self._generation = generation
+            self._install(vector_store, version)
+        finally:
+            self._lock.release()
+
+    @property
+    def is_resident(self) -> bool:
+        return self._loaded and self._vector_store is not None
+
+    @property
+    def resident_vector_count(self) -> Optional[int]:
+        """How many vectors the loaded index holds, or None if it isn't loaded. Never triggers a load."""
+        vector_store = self._vector_store
+        return vector_store.ntotal if vector_store is not None else None
+
+    def unload(self) -> bool:
+        """Drops the index from memory; the next access loads it back from its snapshot.
+
+        Every change is already snapshotted when it's published, so there's nothing to
+        write out first. Queries that grabbed the old reference keep using it until they
+        finish. Returns False for stores that have no snapshot to come back from.
+        """
+        if self.path is None:
+            return False
+        with self._lock:
+            self._vector_store = None
+            self._loaded = False
+            self.resident_bytes = 0
+            COLLECTION_RESIDENT_BYTES.labels(self.name).set(0)
+        return True
+
+    def _measure_resident_bytes(self) -> int:
+        # Only what this worker holds on its own. The mapped vectors and chunk columns
+        # sit in the page cache once for every worker, and the kernel can drop those
+        # pages whenever it needs the room, so unloading us wouldn't free them anyway.
+        return self._vector_store.private_bytes if self._vector_store is not None else 0
+
+    def _update_gauges(self):
+        INDEX_VECTORS.labels(self.name).set(self._vector_store.ntotal if self._vector_store is not None else 0)
+        INDEX_SOURCES.labels(self.name).set(len(self._vector_store.source_counts()) if self._vector_store is not None else 0)
+
+    def _save(self, vector_store: Optional[SegmentedStore]):
+        """Publishes a new snapshot so the change survives a restart.
+
+        Returns the store to serve from then on and its version.
+        """
+        if self.path is None:
+            return vector_store, self.snapshot_version + 1
+        with span("ingest", "snapshot"):
+            unsaved = [i for i, location in enumerate(vector_store.locations) if location is None] if vector_store else []
+            version = save_snapshot(self.path, vector_store, get_embeddings().model_name)
+        self._generation = current_generation(self.path)
+        return self._map_published(vector_store, unsaved), version
+
+    def _map_published(self, vector_store: Optional[SegmentedStore], unsaved: List[int]) -> Optional[SegmentedStore]:
+        """Swaps the segments we just wrote out for mappings of their files.
+
+        New segments sit in this process's own memory. A mapping shares its vectors and
+        chunk columns with every other process that maps the same snapshot, so only
+        one copy of them stays in RAM however many workers there are (see the class
+        docstring for what isn't shared). Nobody is reading vector_store yet, so we
+        can swap its segments in place.
+        """
+        try:
+            for i in unsaved:
+                vector_store.segments[i] = load_segment(self.path, vector_store.locations[i], get_embeddings())
+        except Exception as e:
+            print(f"Could not map the snapshot just written to {self.path}, keeping the copy in memory. Error: {e}")
+        return vector_store
+
+    def _writer_lock(self):
+        # In-memory stores have nothing on disk for another process to change.
+        return writer_lock(self.path) if self.path is not None else nullcontext()
+
+    def _copy_base_index(self, vector_store: SegmentedStore):
+        """A private copy of the base segment's index, which compaction can empty and refill."""
+        location = vector_store.locations[0]
+        if location is None:
+            # Only in this process's memory so far, so an ordinary copy will do.
+            return faiss.clone_index(vector_store.segments[0].index)
+        # A mapped index shares its vectors with the file, and a clone would share them
+        # too (emptying it would take FAISS down), but it's exactly what was saved, so
+        # we read that back instead.
+        return read_index_copy(self.path, location)
+
+    def _write(self, segment, ids: List[str]) -> Optional[SegmentedStore]:
+        """Builds the store that adds `segment` and deletes `ids`, compacting it if it's time.
+
+        The current store is never changed: queries keep searching it while this runs,
+        and we swap the reference in one step afterwards, so nobody ever sees a
+        half-updated index.
+        """
+        current = self._vector_store
+        deleted = current.positions_of(ids) if ids else None
+        if current is None:
+            updated = SegmentedStore([segment])
+        else:
+            updated = current.with_changes(segment, deleted)
+        # An empty index is no use to anyone, so we fall back to "no knowledge base".
+        if updated.ntotal == 0:
+            return None
+        if updated.needs_compaction(self.index_spec, self.compact_ratio):
+            with span("ingest", "compact"):
+                return updated.compact(self.index_spec, lambda: self._copy_base_index(updated))
+        count = updated.segments_to_merge(self.max_segments)
+        return updated.merge_newest(count) if count else updated
+
+    def _publish(self, vector_store: Optional[SegmentedStore]):
+        # We save before swapping anything in, so if the save fails, what we serve
+        # still matches what's on disk.
+        vector_store, version = self._save(vector_store)
+        # The store goes in before the version moves on, so nothing cached against the
+        # new version can have come from the old store.
+        self._vector_store = vector_store
+        self.snapshot_version = version
+        self._update_gauges()
+        self.resident_bytes = self._measure_resident_bytes()
+        COLLECTION_RESIDENT_BYTES.labels(self.name).set(self.resident_bytes)
+
+    def add_documents(self, documents: List[Document], embeddings, replace_sources: List[str] = ()):
+        """Embeds and appends only the chunks that aren't indexed yet.
+
+        Any source listed in replace_sources has its old chunks dropped once the new ones
+        are in, except for chunks that are identical in both versions, which are kept and
+        never re-embedded. Returns (added, skipped, removed).
+        """
+        with self._lock, self._writer_lock():
+            # Another process may have published since we last looked. We build on
+            # its snapshot, not ours, or its changes would be lost when we publish.
+            self._load()
+            self._refresh(wait=True)
+            current = self._vector_store
+            # Repeats within this batch collapse here, and chunks from earlier uploads are
+            # looked up in the id columns rather than a set of every id we hold.
+            batch = {}
+            for doc in documents:
+                batch.setdefault(chunk_id(doc), doc)
+            indexed = current.contains(list(batch)) if current is not None else np.zeros(len(batch), dtype=bool)
+            new_ids = [doc_id for doc_id, known in zip(batch, indexed) if not known]
+            new_docs = [batch[doc_id] for doc_id in new_ids]
+            stale_ids = []
+            if current is not None:
+                stale_ids = [doc_id for source in replace_sources for doc_id in current.ids_of_source(source) if doc_id not in batch]
+            if not new_docs and not stale_ids:
+                return 0, len(documents), 0
+
+            # Only the new chunks go to the embedding service; the existing vectors stay as they are.
+            # We embed before copying anything, so a failed embedding call leaves the
+            # index exactly as it was and never leaves a document half replaced.
+            texts = [doc.page_content for doc in new_docs]
+            with span("ingest", "embed"):
+                text_embeddings = list(zip(texts, embeddings.embed_documents(texts))) if new_docs else []
+            metadatas = [doc.metadata for doc in new_docs]
+
+            with span("ingest", "index_update"):
+                segment = build_segment(embeddings, text_embeddings, metadatas, new_ids) if new_docs else None
+                updated = self._write(segment, stale_ids)
+            self._publish(updated)
+            return len(new_docs), len(documents) - len(new_docs), len(stale_ids)
+
+    def delete_source(self, source: str) -> int:
+        """Removes every chunk that came from the given source. Returns how many were removed."""
+        with self._lock, self._writer_lock():
+            self._load()
+            self._refresh(wait=True)
+            ids = self._vector_store.ids_of_source(source) if self._vector_store is not None else []
+            if not ids:
+                return 0
+            self._publish(self._write(None, ids))
+            return len(ids)
 
-db_store = InMemoryVectorStore()
\ No newline at end of file
+    def list_sources(self) -> List[dict]:
+        """Lists every indexed source along with how many chunks it contributed."""
+        vector_store = self.vector_store
+        counts = vector_store.source_counts() if vector_store is not None else {}
+        return [{"source": source, "chunks": count} for source, count in sorted(counts.items())]
@@ -0,0 +1,275 @@
+import math
+import time
+from typing import Callable, List, Optional
+import faiss
+import numpy as np
+from ...config import settings
+from .embedding_cache import text_hash
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw", "sq_fp16", "sq8")
+# These learn something from the data (cluster centroids, or per-dimension value
+# ranges for sq8), so a store only switches to them once it has a decent sample.
+TRAINED_INDEX_TYPES = ("ivf_flat", "ivf_pq", "sq8")
+# These only keep an approximation of each vector, so what they hand back isn't the original embedding.
+LOSSY_INDEX_TYPES = ("ivf_pq", "sq_fp16", "sq8")
+
+class IndexSpec:
+    """Describes which kind of FAISS index a vector store should use and how to tune it."""
+    def __init__(self, index_type: str = "flat", nlist: int = 1024, pq_m: int = 16, pq_nbits: int = 8,
+                 hnsw_m: int = 32, ef_construction: int = 200, nprobe: int = 16, ef_search: int = 64,
+                 train_min_vectors: int = 0):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type '{index_type}'. Expected one of {', '.join(INDEX_TYPES)}.")
+        self.index_type = index_type
+        self.nlist = nlist
+        self.pq_m = pq_m
+        self.pq_nbits = pq_nbits
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        # FAISS wants roughly 39 training points per IVF cell before k-means is reliable,
+        # so unless told otherwise we stay on the exact index until we have that many.
+        self.train_min_vectors = train_min_vectors or 39 * nlist
+
+    @classmethod
+    def from_settings(cls) -> "IndexSpec":
+        return cls(
+            index_type=settings.FAISS_INDEX_TYPE,
+            nlist=settings.FAISS_IVF_NLIST,
+            pq_m=settings.FAISS_PQ_M,
+            pq_nbits=settings.FAISS_PQ_NBITS,
+            hnsw_m=settings.FAISS_HNSW_M,
+            ef_construction=settings.FAISS_HNSW_EF_CONSTRUCTION,
+            nprobe=settings.FAISS_NPROBE,
+            ef_search=settings.FAISS_EF_SEARCH,
+            train_min_vectors=settings.FAISS_TRAIN_MIN_VECTORS
+        )
+
+    def factory_string(self) -> str:
+        if self.index_type == "ivf_flat":
+            return f"IVF{self.nlist},Flat"
+        if self.index_type == "ivf_pq":
+            return f"IVF{self.nlist},PQ{self.pq_m}x{self.pq_nbits}"
+        if self.index_type == "hnsw":
+            return f"HNSW{self.hnsw_m},Flat"
+        if self.index_type == "sq_fp16":
+            return "SQfp16"
+        if self.index_type == "sq8":
+            return "SQ8"
+        return "Flat"
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+def index_type_of(index) -> str:
+    """Works out which of our index types a FAISS index is."""
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return "sq_fp16" if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return "flat"
+    return "ivf_pq" if isinstance(faiss.downcast_index(ivf), faiss.IndexIVFPQ) else "ivf_flat"
+
+def ensure_direct_map(index):
+    """Gives an IVF index a position -> list entry map, so its vectors can be looked up by position.
+
+    Without one, IVF can search but not reconstruct, and retrieval needs the candidates'
+    vectors to refine them. The map costs 8 bytes per vector and is saved along with
+    the index. Other index types can always reconstruct, so they're left alone.
+    """
+    if index_type_of(index) in ("ivf_flat", "ivf_pq"):
+        ivf = faiss.extract_index_ivf(index)
+        if ivf.direct_map.type == faiss.DirectMap.NoMap:
+            ivf.make_direct_map()
+
+def _owned_bytes(vector) -> int:
+    # FAISS's MaybeOwnedVector either holds its data or views a mapped file.
+    return vector.byte_size() if vector.is_owned else 0
+
+def index_private_bytes(index) -> int:
+    """Roughly how much of an index sits in this process's own memory.
+
+    Whatever FAISS memory-mapped (see index_snapshot.read_mapped_index) lives in the
+    page cache, shared by every worker that maps the same file, so it isn't counted:
+    flat and SQ codes, HNSW's neighbour lists, IVF's inverted lists. IVF centroids and
+    direct maps and HNSW's level tables are always read into private memory.
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        hnsw = index.hnsw
+        return _owned_bytes(hnsw.neighbors) + hnsw.levels.size() * 4 + hnsw.offsets.size() * 8 + index_private_bytes(index.storage)
+    if index_type_of(index) in ("ivf_flat", "ivf_pq"):
+        ivf = faiss.extract_index_ivf(index)
+        lists = faiss.downcast_InvertedLists(ivf.invlists)
+        list_bytes = 0 if isinstance(lists, faiss.OnDiskInvertedLists) else lists.compute_ntotal() * (ivf.code_size + 8)
+        return index_private_bytes(ivf.quantizer) + list_bytes + ivf.direct_map.array.size() * 8
+    return _owned_bytes(index.codes)
+
+def build_index(spec: IndexSpec, vectors: np.ndarray):
+    """Builds, trains (if needed) and fills an index of the given kind."""
+    index = faiss.index_factory(vectors.shape[1], spec.factory_string())
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efConstruction = spec.ef_construction
+    if not index.is_trained:
+        index.train(vectors)
+    ensure_direct_map(index)
+    index.add(vectors)
+    return index
+
+def all_vectors(index) -> np.ndarray:
+    """Pulls every stored vector back out of an index, in position order (decoded, for PQ and SQ)."""
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    return index.reconstruct_n(0, index.ntotal)
+
+def should_rebuild(index, spec: IndexSpec, vector_count: int) -> bool:
+    """Whether an index should be built again as the configured type.
+
+    Every store starts on an exact flat index, since IVF needs a decent sample to learn
+    its clusters from (and sq8 its value ranges). Once the corpus reaches
+    train_min_vectors (straight away for HNSW, sq_fp16 and flat, which need no
+    training) the next compaction builds the configured index instead. The same goes
+    for a store whose configured type was changed after it was built.
+    """
+    if index_type_of(index) == spec.index_type:
+        return False
+    return spec.index_type not in TRAINED_INDEX_TYPES or vector_count >= spec.train_min_vectors
+
+def compacted_index(index, spec: IndexSpec, vectors: np.ndarray, copy_index: Callable[[], object]):
+    """Builds the index that replaces `index` when a store is compacted, filled with `vectors`.
+
+    If should_rebuild says so, we build the configured index. Otherwise the store keeps
+    its index type. IVF keeps its trained centroids, so compaction never retrains it:
+    copy_index() hands back a private copy of the old index, which we empty and refill.
+    HNSW can't remove vectors at all, so it's always built again from scratch.
+    """
+    if should_rebuild(index, spec, len(vectors)):
+        print(f"Rebuilding the vector index as {spec.factory_string()} over {len(vectors)} vectors...")
+        return build_index(spec, vectors)
+    index_type = index_type_of(index)
+    if index_type == "flat":
+        rebuilt = faiss.IndexFlatL2(index.d)
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        rebuilt = copy_index()
+        # reset() empties the direct map along with the lists; add() fills both again.
+        rebuilt.reset()
+        ensure_direct_map(rebuilt)
+    else:
+        return build_index(IndexSpec(**{**spec.to_dict(), "index_type": index_type}), vectors)
+    rebuilt.add(vectors)
+    return rebuilt
+
+def search_parameters(index, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """Builds per-call search parameters, so tuning one query never affects another."""
+    index_type = index_type_of(index)
+    if index_type in ("ivf_flat", "ivf_pq") and nprobe:
+        return faiss.SearchParametersIVF(nprobe=nprobe)
+    if index_type == "hnsw" and ef_search:
+        return faiss.SearchParametersHNSW(efSearch=ef_search)
+    return None
+
+def search(vector_store, embedding: List[float], k: int, spec: IndexSpec,
+           nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """Like FAISS.similarity_search_with_score_by_vector, but with nprobe/efSearch set for this call only.
+
+    Takes a SegmentedStore and returns (document, distance, position) triples, best match first.
+    """
+    query = np.asarray([embedding], dtype=np.float32)
+    hits = vector_store.search(query, k, nprobe or spec.nprobe, ef_search or spec.ef_search)
+    return [(vector_store.document(position), score, position) for score, position in hits]
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(pct / 100 * len(ordered))) - 1)]
+
+def _cached_originals(vector_store, positions: np.ndarray, decoded: np.ndarray):
+    """Swaps in the original embeddings the embedding cache still has for these positions.
+
+    Only the cache is asked, never the embedding service. Returns the vectors and how
+    many of them are originals; the rest stay as the index decoded them.
+    """
+    embeddings = vector_store.embedding_function
+    cache = getattr(embeddings, "cache", None)
+    if cache is None:
+        return decoded, 0
+    hashes = [text_hash(vector_store.document(int(position)).page_content) for position in positions]
+    found = cache.get_many(embeddings.model_name, list(dict.fromkeys(hashes)))
+    vectors = decoded.copy()
+    for row, key in enumerate(hashes):
+        if key in found:
+            vectors[row] = found[key]
+    return vectors, sum(key in found for key in hashes)
+
+def recall_report(vector_store, spec: IndexSpec, k: int = 10, sample_size: int = 100,
+                  nprobe_values: Optional[List[int]] = None, ef_search_values: Optional[List[int]] = None) -> dict:
+    """Measures recall@k and per-query latency of the live index against an exact search.
+
+    Queries are a random sample of the corpus's own vectors. Ground truth comes from an
+    exact flat index over the vectors the index hands back. Those are the original
+    embeddings for flat, HNSW and IVF-Flat. PQ and SQ only keep approximations, so for
+    them we take the sampled chunks' original embeddings from the embedding cache and
+    fall back to the decoded ones for chunks it no longer has ("query_vectors" counts
+    each). The corpus side of the ground truth stays decoded ("ground_truth" says so).
+    We never re-embed anything for this: it runs from a GET on the live server, and
+    with a cold embedding cache that would mean embedding everything again.
+    Small segments added since the last compaction are searched exactly, as they are in
+    live queries. Raises ValueError if the index can't hand its vectors back.
+    """
+    index = vector_store.segments[0].index
+    index_type = index_type_of(index)
+    try:
+        positions, exact_vectors = vector_store.live_vectors()
+    except RuntimeError as e:
+        raise ValueError(f"The {index_type} index can't read its vectors back for a recall report: {e}") from e
+    exact_index = faiss.IndexFlatL2(exact_vectors.shape[1])
+    exact_index.add(exact_vectors)
+
+    rng = np.random.default_rng(0)
+    rows = rng.choice(len(exact_vectors), size=min(sample_size, len(exact_vectors)), replace=False)
+    sample, originals = exact_vectors[rows], len(rows)
+    if index_type in LOSSY_INDEX_TYPES:
+        sample, originals = _cached_originals(vector_store, positions[rows], sample)
+    k = min(k, vector_store.ntotal)
+
+    def measure(run):
+        latencies, found = [], []
+        for query in sample:
+            start = time.perf_counter()
+            found.append(run(query[None, :]))
+            latencies.append((time.perf_counter() - start) * 1000)
+        return latencies, found
+
+    # The exact index numbers its rows 0..n-1, so we translate them back to store positions.
+    exact_latencies, truth = measure(lambda query: positions[exact_index.search(query, k)[1][0]])
+    report = {
+        "index_type": index_type,
+        "vectors": int(vector_store.ntotal),
+        "segments": len(vector_store.segments),
+        "k": k,
+        "queries": len(sample),
+        "ground_truth": "decoded vectors" if index_type in LOSSY_INDEX_TYPES else "stored vectors",
+        "query_vectors": {"original": originals, "decoded": len(sample) - originals},
+        "exact": {"latency_ms_p50": _percentile(exact_latencies, 50), "latency_ms_p95": _percentile(exact_latencies, 95)},
+        "settings": []
+    }
+    if index_type in ("ivf_flat", "ivf_pq"):
+        grid = [{"nprobe": value} for value in (nprobe_values or [1, 4, 16, 64])]
+    elif index_type == "hnsw":
+        grid = [{"ef_search": value} for value in (ef_search_values or [16, 32, 64, 128])]
+    else:
+        grid = [{}]
+    for setting in grid:
+        latencies, found = measure(lambda query: [position for _, position in vector_store.search(
+            query, k, setting.get("nprobe"), setting.get("ef_search"))])
+        recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)]) if k else 0.0
+        report["settings"].append({
+            **setting,
+            "recall_at_k": round(float(recall), 4),
+            "latency_ms_p50": _percentile(latencies, 50),
+            "latency_ms_p95": _percentile(latencies, 95)
+        })
+    return report
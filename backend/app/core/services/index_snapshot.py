@@ -0,0 +1,347 @@
+import json
+import os
+import pickle
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Optional, Tuple
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from .chunk_store import ChunkStore, RowIds, load_chunk_store, save_chunk_store
+from .index_factory import ensure_direct_map
+from .segments import SegmentedStore
+
+# fcntl is POSIX-only. Without it (on Windows) writers in different processes can't be
+# kept apart, which is fine as long as the server runs a single worker there.
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Bump this whenever the layout of a snapshot directory changes, so older builds
+# refuse to load something they don't understand.
+SNAPSHOT_FORMAT = 3
+# Format 1 kept the docstore as a pickle of Document objects, and format 2 kept the
+# whole corpus as a single segment in the version directory itself. We still read
+# both; the next save writes format 3.
+READABLE_FORMATS = (1, 2, 3)
+
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.pkl"
+DELETED_FILE = "deleted.npy"
+
+# Snapshots written before we started recording the embedding model were all built
+# with the Gemini embeddings, so that's what a manifest without one is assumed to use.
+LEGACY_EMBEDDING_MODEL = "models/embedding-001"
+
+# Every FAISS file starts with a four-byte tag naming its index type. IVF tags start
+# with "Iw" (or "Iv" in files from older FAISS releases).
+IVF_TAG_PREFIXES = (b"Iw", b"Iv")
+
+class EmbeddingModelMismatch(RuntimeError):
+    """Raised when a snapshot was built by a different embedding model than the one configured."""
+
+# On disk, the layout looks like this:
+#
+#   faiss_index/
+#     CURRENT              -> {"version": 9}
+#     v000007/
+#       segment-0/         -> the base segment, written when v7 compacted the store
+#         index.faiss
+#         chunk_*.npy      -> the chunk store's columns, in FAISS position order
+#         chunk_meta.json  -> source names and any unusual metadata
+#       manifest.json
+#     v000009/
+#       segment-1/         -> just the chunks v9 added
+#       deleted.npy        -> positions deleted since v7's compaction
+#       manifest.json      -> version, vector count, embedding model, file sizes, and
+#                             which version directory holds each segment
+#
+# A version only writes the segments that are new in it and refers back to the
+# directories of the older ones (see SegmentedStore), so an upload writes its own
+# chunks and not the whole corpus again. A snapshot is written into a scratch
+# directory, renamed into place, and only then does CURRENT get pointed at it. Each of
+# those renames is atomic, so a crash at any point leaves CURRENT naming a complete
+# snapshot (or nothing at all).
+#
+# Snapshots are never modified once published, so any number of server processes can
+# map the same one and share its pages. Writers take writer_lock() so only one
+# process publishes at a time. Readers notice a new publish through current_generation().
+# Old versions are deleted once nothing CURRENT refers to lives in them. On POSIX, a
+# process that still has one mapped keeps reading it until it remaps.
+
+def _version_dir(base_path: str, version: int) -> str:
+    return os.path.join(base_path, f"v{version:06d}")
+
+def _fsync_file(path: str):
+    with open(path, "rb") as f:
+        os.fsync(f.fileno())
+
+def _write_json_atomic(path: str, payload: dict):
+    tmp_path = f"{path}.tmp-{uuid.uuid4().hex}"
+    with open(tmp_path, "w") as f:
+        json.dump(payload, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def _list_versions(base_path: str):
+    versions = []
+    if os.path.isdir(base_path):
+        for name in os.listdir(base_path):
+            if name.startswith("v") and name[1:].isdigit():
+                versions.append(int(name[1:]))
+    return sorted(versions)
+
+def read_current_version(base_path: str) -> int:
+    """Returns the version CURRENT points at, or 0 if nothing has been published yet."""
+    try:
+        with open(os.path.join(base_path, CURRENT_FILE)) as f:
+            return int(json.load(f)["version"])
+    except (FileNotFoundError, ValueError, KeyError, TypeError):
+        return 0
+
+def current_generation(base_path: str) -> Optional[Tuple[int, int]]:
+    """A fingerprint of CURRENT that changes whenever any process publishes a snapshot.
+
+    It costs one stat call, so every request can afford to check it. CURRENT is always
+    replaced rather than rewritten, so each publish gives it a new inode and mtime.
+    """
+    try:
+        stat = os.stat(os.path.join(base_path, CURRENT_FILE))
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+@contextmanager
+def writer_lock(base_path: str):
+    """Holds an exclusive lock on a snapshot directory, so one process at a time can change it.
+
+    The lock file sits next to the directory rather than in it, so taking the lock
+    doesn't make an empty collection look like it exists.
+    """
+    parent = os.path.dirname(os.path.abspath(base_path))
+    os.makedirs(parent, exist_ok=True)
+    with open(f"{os.path.abspath(base_path)}.lock", "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def save_snapshot(base_path: str, vector_store: Optional[SegmentedStore], embedding_model: Optional[str] = None) -> int:
+    """Writes the store's new segments and deletions as a new snapshot version and publishes it.
+
+    Segments that were already saved are referred to, not written again. Records the
+    location of each segment it writes in vector_store.locations.
+    """
+    os.makedirs(base_path, exist_ok=True)
+    version = max([read_current_version(base_path), *_list_versions(base_path)]) + 1
+    tmp_dir = os.path.join(base_path, f".tmp-{uuid.uuid4().hex}")
+    os.makedirs(tmp_dir)
+    written = {}
+    try:
+        manifest = {
+            "format": SNAPSHOT_FORMAT,
+            "version": version,
+            "created_at": time.time(),
+            "vectors": 0,
+            "embedding_model": embedding_model,
+            "dimension": None,
+            "segments": [],
+            "files": {}
+        }
+        # An empty knowledge base is still worth recording, otherwise deleting the last
+        # document would quietly bring the previous snapshot back on the next restart.
+        if vector_store is not None:
+            for i, (segment, location) in enumerate(zip(vector_store.segments, vector_store.locations)):
+                if location is None:
+                    name = f"segment-{i}"
+                    location = {"version": version, "dir": name, "bytes": 0}
+                    for file_name in _write_segment(segment, os.path.join(tmp_dir, name)):
+                        path = os.path.join(tmp_dir, name, file_name)
+                        manifest["files"][f"{name}/{file_name}"] = {"size": os.path.getsize(path)}
+                        location["bytes"] += os.path.getsize(path)
+                    written[i] = location
+                manifest["segments"].append(location)
+            if len(vector_store.deleted):
+                np.save(os.path.join(tmp_dir, DELETED_FILE), vector_store.deleted, allow_pickle=False)
+                _fsync_file(os.path.join(tmp_dir, DELETED_FILE))
+                manifest["files"][DELETED_FILE] = {"size": os.path.getsize(os.path.join(tmp_dir, DELETED_FILE))}
+            manifest["vectors"] = vector_store.ntotal
+            manifest["dimension"] = vector_store.segments[0].index.d
+        # The manifest goes in last; a directory without one is never considered loadable.
+        _write_json_atomic(os.path.join(tmp_dir, MANIFEST_FILE), manifest)
+        os.rename(tmp_dir, _version_dir(base_path, version))
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    _write_json_atomic(os.path.join(base_path, CURRENT_FILE), {"version": version})
+    for i, location in written.items():
+        vector_store.locations[i] = location
+    _prune_old_versions(base_path, keep=version, referenced={location["version"] for location in manifest["segments"]})
+    return version
+
+def _write_segment(segment: FAISS, directory: str):
+    """Writes one segment's index and chunk columns, fsync'd. Returns the file names."""
+    os.makedirs(directory)
+    faiss.write_index(segment.index, os.path.join(directory, INDEX_FILE))
+    # Rows are written in FAISS position order, so the id column doubles as
+    # index_to_docstore_id and doesn't need saving separately. An id the docstore
+    # doesn't have raises here rather than publishing a snapshot that's off by one.
+    chunks = _as_chunk_store(segment.docstore)
+    index_to_docstore_id = segment.index_to_docstore_id
+    if not (isinstance(index_to_docstore_id, RowIds) and index_to_docstore_id.ids is chunks.ids):
+        ordered_ids = [index_to_docstore_id[i] for i in range(len(index_to_docstore_id))]
+        chunks = chunks.take(chunks.rows(ordered_ids))
+    names = [INDEX_FILE, *save_chunk_store(chunks, directory)]
+    for name in names:
+        _fsync_file(os.path.join(directory, name))
+    return names
+
+def _as_chunk_store(docstore) -> ChunkStore:
+    # Anything that still hands us a LangChain InMemoryDocstore gets converted on the way out.
+    return docstore if isinstance(docstore, ChunkStore) else ChunkStore.from_documents(docstore._dict)
+
+def _prune_old_versions(base_path: str, keep: int, referenced=()):
+    for version in _list_versions(base_path):
+        if version < keep and version not in referenced:
+            shutil.rmtree(_version_dir(base_path, version), ignore_errors=True)
+
+def _read_manifest(base_path: str, version: int) -> Optional[dict]:
+    """Returns the manifest for a version only if every file it lists is present and complete."""
+    version_dir = _version_dir(base_path, version)
+    try:
+        with open(os.path.join(version_dir, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if manifest.get("format") not in READABLE_FORMATS or manifest.get("version") != version:
+        return None
+    for name, info in manifest.get("files", {}).items():
+        path = os.path.join(version_dir, name)
+        if not os.path.exists(path) or os.path.getsize(path) != info["size"]:
+            return None
+    return manifest
+
+def _segment_locations(base_path: str, version: int, manifest: dict) -> Optional[list]:
+    """Where each of a snapshot's segments lives, or None if any of them is missing or incomplete."""
+    if manifest["format"] < 3:
+        # Older formats are a single segment in the version directory itself.
+        sizes = sum(info["size"] for info in manifest["files"].values())
+        return [{"version": version, "dir": "", "bytes": sizes, "format": manifest["format"]}] if manifest["files"] else []
+    for location in manifest["segments"]:
+        if location["version"] != version and _read_manifest(base_path, location["version"]) is None:
+            return None
+    return manifest["segments"]
+
+def read_current_manifest(base_path: str) -> Optional[dict]:
+    """Returns the manifest CURRENT points at, without loading the snapshot itself."""
+    version = read_current_version(base_path)
+    return _read_manifest(base_path, version) if version > 0 else None
+
+def _segment_dir(base_path: str, location: dict) -> str:
+    return os.path.join(_version_dir(base_path, location["version"]), location["dir"])
+
+def read_index_copy(base_path: str, location: dict):
+    """Reads a saved segment's FAISS index fully into private memory, so it can be changed.
+
+    A mapped index can't be: its vectors are shared with the file, and every other
+    worker reading it.
+    """
+    return faiss.read_index(os.path.join(_segment_dir(base_path, location), INDEX_FILE))
+
+def _mmap_flag(index_path: str) -> int:
+    """The read_index flag that maps this file's vectors rather than copying them.
+
+    IO_FLAG_MMAP maps only an IVF index's inverted lists; for flat, SQ and HNSW
+    indexes it still reads the codes into private memory. IO_FLAG_MMAP_IFC maps those
+    (and HNSW's graph), but doesn't work on IVF files, so we pick by index type.
+    """
+    with open(index_path, "rb") as f:
+        tag = f.read(4)
+    return faiss.IO_FLAG_MMAP if tag.startswith(IVF_TAG_PREFIXES) else faiss.IO_FLAG_MMAP_IFC
+
+def read_mapped_index(index_path: str):
+    """Reads an index with its vectors memory-mapped, falling back to a private copy for types FAISS can't map."""
+    try:
+        return faiss.read_index(index_path, _mmap_flag(index_path))
+    except RuntimeError as e:
+        print(f"Could not memory-map {index_path}, so this worker reads its own copy into memory. Error: {e}")
+        return faiss.read_index(index_path)
+
+def load_segment(base_path: str, location: dict, embeddings) -> FAISS:
+    directory = _segment_dir(base_path, location)
+    # A mapped index is paged in by the OS as searches touch it, so a cold start
+    # doesn't copy the whole index into memory, and every worker that maps the same
+    # file shares one copy of it in the page cache.
+    index = read_mapped_index(os.path.join(directory, INDEX_FILE))
+    # IVF snapshots written before we kept a direct map get one here, in this
+    # process's memory, so retrieval can read candidate vectors back.
+    ensure_direct_map(index)
+    if location.get("format") == 1:
+        with open(os.path.join(directory, DOCSTORE_FILE), "rb") as f:
+            docstore_dict, index_to_docstore_id = pickle.load(f)
+        docstore = ChunkStore.from_documents(docstore_dict)
+    else:
+        # The chunk columns are memory-mapped too, so the text is only paged in
+        # for the chunks a query actually returns.
+        docstore = load_chunk_store(directory)
+        index_to_docstore_id = RowIds(docstore.ids)
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+def load_snapshot(base_path: str, embeddings, reuse: Optional[SegmentedStore] = None) -> Tuple[Optional[SegmentedStore], int]:
+    """Loads the newest complete snapshot, memory-mapping its segments instead of reading them into RAM.
+
+    Segments that `reuse` already has mapped are shared with it rather than mapped
+    again, so picking up another process's upload only maps the segment it added.
+    """
+    current = read_current_version(base_path)
+    # CURRENT should always point at a good snapshot, but if it doesn't we fall back
+    # to the newest one that still checks out rather than starting from scratch.
+    candidates = [current] + [v for v in reversed(_list_versions(base_path)) if v != current]
+    for version in candidates:
+        if version <= 0:
+            continue
+        manifest = _read_manifest(base_path, version)
+        locations = _segment_locations(base_path, version, manifest) if manifest is not None else None
+        if locations is None:
+            print(f"Skipping incomplete index snapshot v{version}.")
+            continue
+        if not locations:
+            return None, version
+        # Vectors from two different models live in unrelated spaces (often with
+        # different sizes too), so searching one with the other returns nonsense.
+        # We refuse outright rather than fall back, since older snapshots were built
+        # by the same model and would be just as wrong.
+        expected_model = getattr(embeddings, "model_name", None)
+        index_model = manifest.get("embedding_model") or LEGACY_EMBEDDING_MODEL
+        if expected_model and index_model != expected_model:
+            raise EmbeddingModelMismatch(
+                f"The index at {base_path} was built with the embedding model '{index_model}', "
+                f"but '{expected_model}' is configured. Switch EMBEDDING_BACKEND/EMBEDDING_MODEL "
+                f"back, or remove the index and upload the documents again."
+            )
+        mapped = {}
+        if reuse is not None:
+            mapped = {(location["version"], location["dir"]): segment
+                      for segment, location in zip(reuse.segments, reuse.locations) if location is not None}
+        segments = [mapped.get((location["version"], location["dir"])) or load_segment(base_path, location, embeddings)
+                    for location in locations]
+        deleted = None
+        if DELETED_FILE in manifest["files"]:
+            deleted = np.load(os.path.join(_version_dir(base_path, version), DELETED_FILE), allow_pickle=False)
+        # Format 1 segments can't be referred to by later versions (they have no chunk
+        # columns), so they count as unsaved and the next save writes them out again.
+        locations = [None if location.get("format") == 1 else location for location in locations]
+        vector_store = SegmentedStore(segments, deleted, locations)
+        print(f"Loaded index snapshot v{version} with {vector_store.ntotal} vectors in {len(segments)} segment(s).")
+        return vector_store, version
+    return None, 0
@@ -0,0 +1,157 @@
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+from ...config import JOBS_PATH
+
+# Job ids become file names, so anything that isn't one of our uuid4 hex ids is turned away.
+JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+class IngestionJob:
+    """Tracks one background upload: its overall status plus the stage each file is at."""
+    def __init__(self, filenames: List[str], work_dir: Optional[str] = None, collection: str = "default"):
+        self.id = uuid.uuid4().hex
+        self.collection = collection
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.work_dir = work_dir
+        self.result = None
+        self.error = None
+        self.files = {name: {"stage": "queued", "chunks": 0, "error": None} for name in filenames}
+        # Where the job's state is written as it changes (set by the JobManager).
+        self.state_dir = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "IngestionJob":
+        """Rebuilds a job from its saved state, e.g. one that another server process is running."""
+        job = cls(list(data["files"]), collection=data.get("collection", "default"))
+        job.id = data["job_id"]
+        for field in ("status", "created_at", "started_at", "finished_at", "result", "error"):
+            setattr(job, field, data.get(field))
+        job.files = data["files"]
+        return job
+
+    def save(self):
+        """Writes the job's state to disk, replacing the old file in one step so readers never see half of it."""
+        if not self.state_dir:
+            return
+        path = os.path.join(self.state_dir, f"{self.id}.json")
+        tmp_path = f"{path}.tmp-{uuid.uuid4().hex}"
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    def update_file(self, filename: str, stage: str, chunks: Optional[int] = None, error: Optional[str] = None):
+        """Progress callback handed to the document processor."""
+        with self._lock:
+            entry = self.files.setdefault(filename, {"stage": "queued", "chunks": 0, "error": None})
+            entry["stage"] = stage
+            if chunks is not None:
+                entry["chunks"] = chunks
+            if error is not None:
+                entry["error"] = error
+        self.save()
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "collection": self.collection,
+                "status": self.status,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "files": {name: dict(entry) for name, entry in self.files.items()},
+                "result": self.result,
+                "error": self.error
+            }
+
+class JobManager:
+    """Runs ingestion jobs on a background thread so the API stays responsive.
+
+    A job runs in whichever server process accepted the upload, but its state is saved
+    under state_dir as it goes. A status poll that lands on a different process reads
+    it from there.
+    """
+    def __init__(self, max_jobs_kept: int = 100, state_dir: Optional[str] = JOBS_PATH):
+        # A single worker means jobs run one at a time in the order they arrived. That's
+        # what we want: each job already fans out across cores for parsing, and the
+        # index itself can only take one writer at a time anyway.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingestion")
+        self._jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+        self._max_jobs_kept = max_jobs_kept
+        self.state_dir = state_dir
+        self._lock = threading.Lock()
+
+    def submit(self, job: IngestionJob, work: Callable[[IngestionJob], Optional[dict]]) -> IngestionJob:
+        with self._lock:
+            self._jobs[job.id] = job
+            # We only remember the most recent jobs, so polling history can't grow forever.
+            while len(self._jobs) > self._max_jobs_kept:
+                self._jobs.popitem(last=False)
+        if self.state_dir:
+            os.makedirs(self.state_dir, exist_ok=True)
+            job.state_dir = self.state_dir
+            job.save()
+            self._prune_saved_jobs()
+        self._executor.submit(self._run, job, work)
+        return job
+
+    def _prune_saved_jobs(self):
+        # Every process writes here, so the files on disk are the history we trim.
+        saved = []
+        try:
+            for entry in os.scandir(self.state_dir):
+                if entry.name.endswith(".json"):
+                    saved.append((entry.stat().st_mtime, entry.path))
+        except FileNotFoundError:
+            # Another process got to the same file (or the directory) first.
+            pass
+        saved.sort()
+        for _, path in saved[:max(0, len(saved) - self._max_jobs_kept)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None or not self.state_dir or not JOB_ID_PATTERN.match(job_id):
+            return job
+        try:
+            with open(os.path.join(self.state_dir, f"{job_id}.json")) as f:
+                return IngestionJob.from_dict(json.load(f))
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+
+    def _run(self, job: IngestionJob, work: Callable[[IngestionJob], Optional[dict]]):
+        job.status = "running"
+        job.started_at = time.time()
+        job.save()
+        try:
+            job.result = work(job)
+            job.status = "completed" if job.result is not None else "failed"
+            if job.result is None:
+                job.error = "Could not extract any text from the uploaded documents."
+        except Exception as e:
+            print(f"Error during background ingestion job {job.id}: {e}")
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            job.save()
+            # The uploaded files were only ever needed for this job.
+            if job.work_dir:
+                shutil.rmtree(job.work_dir, ignore_errors=True)
+
+job_manager = JobManager()
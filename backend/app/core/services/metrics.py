@@ -0,0 +1,115 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+# Everything the service measures lives here, so /metrics has a single place to read
+# from and the rest of the code only has to say what it's timing.
+#
+# With several uvicorn workers, each one counts in its own memory and a scrape lands on
+# whichever worker happens to take it. So start.sh and the Procfile set
+# PROMETHEUS_MULTIPROC_DIR, where prometheus_client keeps every process's values in
+# files, and render_metrics adds them all up. It has to be set before
+# prometheus_client is first imported, which is why it's an environment variable and
+# not one of our settings.
+
+# Pipeline stages range from sub-millisecond (FAISS search) to tens of seconds (a big
+# OCR job), so the buckets span the whole range.
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+STAGE_SECONDS = Histogram(
+    "researchgpt_stage_seconds", "Time spent in each stage of the ingestion and query pipelines.",
+    ["pipeline", "stage"], buckets=STAGE_BUCKETS
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "researchgpt_http_request_seconds", "Time to produce each HTTP response, up to the headers.",
+    ["method", "route", "status"], buckets=STAGE_BUCKETS
+)
+LLM_CALLS = Counter("researchgpt_llm_calls_total", "LLM calls made, by pipeline stage and outcome.", ["stage", "outcome"])
+LLM_RETRIES = Counter("researchgpt_llm_retries_total", "LLM calls retried after hitting a quota error.", ["stage"])
+# Gemini doesn't hand token counts back through the chains we use, so these are the
+# same ~4 characters per token estimates the rate limiter budgets with.
+LLM_TOKENS = Counter("researchgpt_llm_tokens_total", "Estimated LLM tokens, by stage and direction.", ["stage", "direction"])
+QUERY_CACHE_LOOKUPS = Counter("researchgpt_query_cache_lookups_total", "Query result cache lookups.", ["result"])
+RETRIEVED_CHUNKS = Histogram(
+    "researchgpt_retrieved_chunks", "Chunks retrieved per query.", buckets=(0, 1, 2, 3, 4, 5, 10, 20)
+)
+RETRIEVAL_DROPPED_CHUNKS = Counter(
+    "researchgpt_retrieval_dropped_chunks_total", "Retrieved chunks not sent to the LLM, by reason.", ["reason"]
+)
+LLM_CALLS_SAVED = Counter(
+    "researchgpt_llm_calls_saved_total", "Per-chunk LLM calls avoided by trimming retrieval results, against the old fixed k of 5."
+)
+INGESTED_CHUNKS = Counter("researchgpt_ingested_chunks_total", "Chunks processed by ingestion, by outcome.", ["outcome"])
+INGESTED_FILES = Counter("researchgpt_ingested_files_total", "Files processed by ingestion, by outcome.", ["outcome"])
+# Every worker sets these when it publishes or maps a new snapshot, so the latest value
+# from a running worker is the current one. Memory, on the other hand, adds up.
+INDEX_VECTORS = Gauge(
+    "researchgpt_index_vectors", "Vectors in each collection's published index.", ["collection"], multiprocess_mode="livemostrecent"
+)
+INDEX_SOURCES = Gauge(
+    "researchgpt_index_sources", "Source documents in each collection's published index.", ["collection"], multiprocess_mode="livemostrecent"
+)
+COLLECTION_RESIDENT_BYTES = Gauge(
+    "researchgpt_collection_resident_bytes", "Approximate memory each loaded collection holds outside its mapped snapshot, summed over the workers.",
+    ["collection"], multiprocess_mode="livesum"
+)
+COLLECTION_EVICTIONS = Counter("researchgpt_collection_evictions_total", "Collections unloaded to stay within the memory budget.")
+
+# Each HTTP request gets its own list of (name, seconds) spans. Tasks and worker threads
+# started while handling the request inherit the context, so they add to the same list.
+_request_spans: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_spans", default=None)
+
+def start_request_spans() -> List[Tuple[str, float]]:
+    spans = []
+    _request_spans.set(spans)
+    return spans
+
+def record_span(pipeline: str, stage: str, seconds: float):
+    """Records a stage timing that was measured somewhere else (e.g. in a worker process)."""
+    STAGE_SECONDS.labels(pipeline, stage).observe(seconds)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append((f"{pipeline}_{stage}", seconds))
+
+@contextmanager
+def span(pipeline: str, stage: str):
+    """Times the enclosed block as one stage of a pipeline, whether or not it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(pipeline, stage, time.perf_counter() - start)
+
+def server_timing_header(spans: List[Tuple[str, float]], total_seconds: float) -> str:
+    """Formats spans for the Server-Timing header, adding up repeats of the same stage.
+
+    The stage-1 answer calls run side by side, so their durations can add up to more
+    than the request took. The description says how many calls went into each number.
+    """
+    totals: Dict[str, List[float]] = {}
+    for name, seconds in spans:
+        totals.setdefault(name, []).append(seconds)
+    entries = []
+    for name, durations in totals.items():
+        entry = f"{name};dur={sum(durations) * 1000:.1f}"
+        if len(durations) > 1:
+            entry += f';desc="{len(durations)} calls"'
+        entries.append(entry)
+    entries.append(f"total;dur={total_seconds * 1000:.1f}")
+    return ", ".join(entries)
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Returns the Prometheus text exposition and its content type, covering every worker when there are several."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+def mark_worker_exited():
+    """Drops this process's gauges from the totals once it shuts down. Its counters still count."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(os.getpid())
@@ -0,0 +1,203 @@
+# OCR helpers for the ingestion workers. Like extraction.py, nothing here touches the
+# app's config: the settings arrive in an OcrOptions that travels with each task.
+import hashlib
+import os
+import sqlite3
+import time
+from typing import Callable, Optional, Tuple
+import pytesseract
+from PIL import Image, ImageOps
+
+# The Windows installer puts Tesseract here and doesn't add it to PATH.
+WINDOWS_TESSERACT_CMD = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+
+# What pytesseract raises when the binary is missing or chokes on an image.
+OCR_ERRORS = (pytesseract.TesseractNotFoundError, pytesseract.TesseractError)
+
+# We cap images as if they were a scan of an A4 page (11.7in on the long side). Nothing
+# we ingest is bigger than that, and Tesseract reads no better above ~300 DPI.
+PAGE_LONG_SIDE_INCHES = 11.7
+
+class OcrOptions:
+    """The OCR settings a worker needs, bundled so they can be shipped along with a task."""
+    def __init__(self, max_dpi: int = 300, min_page_chars: int = 20, cache_path: Optional[str] = None,
+                 cache_max_bytes: int = 64 * 1024 * 1024, tesseract_cmd: str = ""):
+        self.max_dpi = max_dpi
+        self.min_page_chars = min_page_chars
+        self.cache_path = cache_path
+        self.cache_max_bytes = cache_max_bytes
+        self.tesseract_cmd = tesseract_cmd
+
+    def cache_variant(self) -> str:
+        # The same image at a different resolution can OCR differently, so the resize
+        # settings are part of the cache key.
+        return f"gray-{self.max_dpi}dpi"
+
+def configure_tesseract(tesseract_cmd: str = ""):
+    """Points pytesseract at the configured binary, or the Windows default if it's there, or PATH."""
+    if tesseract_cmd:
+        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    elif os.path.exists(WINDOWS_TESSERACT_CMD):
+        pytesseract.pytesseract.tesseract_cmd = WINDOWS_TESSERACT_CMD
+
+# Whether Tesseract could be run, per configured command, checked once per worker process.
+_tesseract_available = {}
+
+def tesseract_available(options: OcrOptions) -> bool:
+    """Checks (once per process) that the Tesseract binary can actually be run.
+
+    OCR'ing PDF pages is opportunistic: a blank or figure-only page in a normal PDF
+    looks just like a scan. Without Tesseract those pages keep whatever text they
+    have, instead of failing the whole file.
+    """
+    cmd = options.tesseract_cmd
+    if cmd not in _tesseract_available:
+        configure_tesseract(cmd)
+        try:
+            pytesseract.get_tesseract_version()
+            _tesseract_available[cmd] = True
+        except OCR_ERRORS + (OSError,) as e:
+            print(f"Tesseract isn't available, so PDF pages without a text layer won't be OCR'd: {e}")
+            _tesseract_available[cmd] = False
+    return _tesseract_available[cmd]
+
+def normalize_image(image: Image.Image, max_dpi: int) -> Image.Image:
+    """Grayscales an image and shrinks it to at most max_dpi, which is all Tesseract needs.
+
+    Phone photos come in at 12-50 megapixels, which costs Tesseract a lot of time for no
+    gain in accuracy. We scale down (never up) so the image is no denser than max_dpi,
+    going by its recorded DPI when it has one and by a page-sized long side otherwise.
+    """
+    # Phones store rotation in EXIF rather than in the pixels.
+    image = ImageOps.exif_transpose(image).convert("L")
+    scale = max_dpi * PAGE_LONG_SIDE_INCHES / max(image.size)
+    dpi = image.info.get("dpi")
+    if dpi and dpi[0]:
+        scale = min(scale, max_dpi / float(dpi[0]))
+    if scale < 1:
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(size, Image.LANCZOS)
+    return image
+
+class OcrCache:
+    """OCR output keyed by a hash of the image content, in a size-bounded SQLite table.
+
+    Each worker process opens its own connection. WAL mode and a busy timeout let them
+    read and write the same file side by side.
+    """
+    def __init__(self, path: str, max_bytes: int):
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Same layout as the embedding cache: the schema goes in as one write transaction,
+        # and triggers keep the total size in a one-row table as rows come and go.
+        self._conn.execute("BEGIN IMMEDIATE")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ocr_text ("
+            " key TEXT PRIMARY KEY, text TEXT NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ocr_text_last_access ON ocr_text (last_access)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS ocr_text_size (id INTEGER PRIMARY KEY CHECK (id = 0), total INTEGER NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO ocr_text_size SELECT 0, COALESCE(SUM(LENGTH(text)), 0) FROM ocr_text")
+        self._conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS ocr_text_added AFTER INSERT ON ocr_text"
+            " BEGIN UPDATE ocr_text_size SET total = total + LENGTH(NEW.text); END"
+        )
+        self._conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS ocr_text_removed AFTER DELETE ON ocr_text"
+            " BEGIN UPDATE ocr_text_size SET total = total - LENGTH(OLD.text); END"
+        )
+        self._conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS ocr_text_replaced AFTER UPDATE OF text ON ocr_text"
+            " BEGIN UPDATE ocr_text_size SET total = total + LENGTH(NEW.text) - LENGTH(OLD.text); END"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT text FROM ocr_text WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self._conn.execute("UPDATE ocr_text SET last_access = ? WHERE key = ?", (time.time(), key))
+        self._conn.commit()
+        return row[0]
+
+    def put(self, key: str, text: str):
+        # An upsert, since INSERT OR REPLACE wouldn't fire the delete trigger for the old text.
+        self._conn.execute(
+            "INSERT INTO ocr_text VALUES (?, ?, ?) ON CONFLICT (key)"
+            " DO UPDATE SET text = excluded.text, last_access = excluded.last_access",
+            (key, text, time.time())
+        )
+        # We hold the write lock from the insert on, so the total is exact until we commit.
+        total = self.total_bytes()
+        if total > self.max_bytes:
+            self._evict(total)
+        self._conn.commit()
+
+    def total_bytes(self) -> int:
+        """How much text the cache holds, across every worker."""
+        return self._conn.execute("SELECT total FROM ocr_text_size").fetchone()[0]
+
+    def _evict(self, total: int):
+        # Trim to 90% of the budget so we're not evicting again on the very next insert.
+        target = int(self.max_bytes * 0.9)
+        doomed = []
+        for key, size in self._conn.execute("SELECT key, LENGTH(text) FROM ocr_text ORDER BY last_access").fetchall():
+            if total <= target:
+                break
+            doomed.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM ocr_text WHERE key = ?", doomed)
+
+# One cache per worker process, opened the first time it's needed.
+_caches = {}
+
+def get_ocr_cache(options: OcrOptions) -> Optional[OcrCache]:
+    if not options.cache_path:
+        return None
+    if options.cache_path not in _caches:
+        _caches[options.cache_path] = OcrCache(options.cache_path, options.cache_max_bytes)
+    return _caches[options.cache_path]
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def image_content_key(image: Image.Image) -> str:
+    """A hash of the decoded pixels, for images we rendered ourselves rather than read from a file."""
+    return content_hash(f"{image.mode}:{image.size}:".encode("ascii") + image.tobytes())
+
+def render_pdf_page(pdf, page_index: int, dpi: int) -> Image.Image:
+    """Rasterizes one page of an open pypdfium2 document in grayscale at the given DPI.
+
+    Pages bigger than A4 (a photo saved as a PDF is often several feet across) are
+    rendered no bigger than an A4 page would be, the same cap normalize_image applies.
+    """
+    page = pdf[page_index]
+    # PDF user space is 72 units to the inch.
+    scale = min(dpi / 72, dpi * PAGE_LONG_SIDE_INCHES / max(page.get_size()))
+    return page.render(scale=scale, grayscale=True).to_pil()
+
+def ocr_image(load_image: Callable[[], Image.Image], options: OcrOptions, content_key: str, timed) -> Tuple[str, bool]:
+    """Returns (text, came_from_cache) for an image, skipping Tesseract for content we've seen before.
+
+    content_key identifies the image's content (a hash of the file bytes or the pixels),
+    and load_image is only called on a cache miss. timed is the caller's stage timer, so
+    the cost shows up in its stage breakdown.
+    """
+    cache = get_ocr_cache(options)
+    key = f"{options.cache_variant()}:{content_key}"
+    if cache is not None:
+        with timed("ocr_cache"):
+            cached = cache.get(key)
+        if cached is not None:
+            return cached, True
+    with timed("ocr_preprocess"):
+        prepared = normalize_image(load_image(), options.max_dpi)
+    configure_tesseract(options.tesseract_cmd)
+    with timed("ocr"):
+        text = pytesseract.image_to_string(prepared)
+    if cache is not None:
+        with timed("ocr_cache"):
+            cache.put(key, text)
+    return text, False
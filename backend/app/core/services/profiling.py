@@ -0,0 +1,51 @@
+import os
+import random
+import re
+import time
+from ...config import DATA_DIR, settings
+
+# pyinstrument is optional; it's only needed when slow-request profiling is turned on.
+try:
+    from pyinstrument import Profiler
+except ImportError:
+    Profiler = None
+
+PROFILES_DIR = os.path.join(DATA_DIR, "profiles")
+
+_profiling_active = False
+_warned_missing = False
+
+def start_profiler():
+    """Starts a sampling profiler for this request, or returns None if it shouldn't be profiled.
+
+    We don't know in advance which requests will be slow, so a random share of them is
+    profiled and the profile is only kept if the request turns out to be slow. Only one
+    request is profiled at a time, since they'd all be sampling the same event loop.
+    """
+    global _profiling_active, _warned_missing
+    if not settings.PROFILE_SLOW_REQUEST_MS or _profiling_active or random.random() >= settings.PROFILE_SAMPLE_RATE:
+        return None
+    if Profiler is None:
+        if not _warned_missing:
+            print("PROFILE_SLOW_REQUEST_MS is set but pyinstrument isn't installed, so slow requests won't be profiled.")
+            _warned_missing = True
+        return None
+    profiler = Profiler(interval=0.001, async_mode="enabled")
+    profiler.start()
+    _profiling_active = True
+    return profiler
+
+def finish_profiler(profiler, method: str, path: str, elapsed: float):
+    """Stops the profiler and saves its report if the request was slow enough. Returns the report path, if any."""
+    global _profiling_active
+    profiler.stop()
+    _profiling_active = False
+    if elapsed * 1000 < settings.PROFILE_SLOW_REQUEST_MS:
+        return None
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    route = re.sub(r"[^A-Za-z0-9]+", "_", path).strip("_") or "root"
+    report_path = os.path.join(PROFILES_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{method}-{route}-{elapsed * 1000:.0f}ms.html")
+    with open(report_path, "w") as f:
+        f.write(profiler.output_html())
+    print(f"Saved a profile of a slow request ({method} {path}, {elapsed * 1000:.0f} ms) to {report_path}.")
+    return report_path
@@ -0,0 +1,108 @@
+import copy
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+import numpy as np
+
+def normalize_question(question: str) -> str:
+    """Lowercases, collapses whitespace and drops trailing punctuation so trivial rewordings share a key."""
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip(" ?!.")
+
+class QueryResultCache:
+    """An LRU + TTL cache of full query results, tied to the corpus version they were computed on.
+
+    Each collection has its own corpus version, so a change to one collection only
+    clears the entries computed against that collection.
+    """
+    def __init__(self, max_entries: int, ttl_seconds: float, similarity_threshold: float = 0.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # Zero turns the embedding-based lookup off; only exact (normalized) matches hit.
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._corpus_versions = {}
+        self._lock = threading.Lock()
+
+    def _sync_version(self, collection: str, corpus_version: int):
+        # Any change to the corpus can change any answer, so a new version simply
+        # drops the collection's entries rather than trying to work out which survived.
+        if corpus_version != self._corpus_versions.get(collection):
+            for key in [key for key, entry in self._entries.items() if entry["collection"] == collection]:
+                del self._entries[key]
+            self._corpus_versions[collection] = corpus_version
+
+    def _expired(self, entry: dict) -> bool:
+        return time.monotonic() - entry["created_at"] > self.ttl_seconds
+
+    def get(self, question: str, corpus_version: int, embedding: Optional[List[float]] = None, namespace: str = "",
+            collection: str = "") -> Optional[dict]:
+        """Returns a cached result for the question, or None.
+
+        Without an embedding only the normalized text is matched. With one (and a
+        threshold set), the closest earlier question above the threshold also counts.
+        Results in different namespaces (e.g. pipeline modes) or collections never match each other.
+        """
+        if self.max_entries <= 0:
+            return None
+        key = f"{collection}\x00{namespace}\x00{normalize_question(question)}"
+        with self._lock:
+            # A reader that loaded the corpus before an upload landed mustn't wipe the
+            # entries already computed against the newer version.
+            if corpus_version < self._corpus_versions.get(collection, corpus_version):
+                return None
+            self._sync_version(collection, corpus_version)
+            entry = self._entries.get(key)
+            if entry is None and embedding is not None and self.similarity_threshold > 0:
+                key, entry = self._closest(np.asarray(embedding, dtype=np.float32), namespace, collection)
+            if entry is None:
+                return None
+            if self._expired(entry):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            # Callers get their own copy, so nothing they do can leak back into the cache.
+            return copy.deepcopy(entry["result"])
+
+    def _closest(self, embedding: np.ndarray, namespace: str, collection: str):
+        candidates = [
+            (key, entry) for key, entry in self._entries.items()
+            if entry["embedding"] is not None and entry["namespace"] == namespace and entry["collection"] == collection
+        ]
+        if not candidates:
+            return None, None
+        matrix = np.stack([entry["embedding"] for _, entry in candidates])
+        query = embedding / (np.linalg.norm(embedding) or 1.0)
+        scores = matrix @ query
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity_threshold:
+            return None, None
+        return candidates[best]
+
+    def put(self, question: str, corpus_version: int, result: dict, embedding: Optional[List[float]] = None, namespace: str = "",
+            collection: str = ""):
+        if self.max_entries <= 0:
+            return
+        key = f"{collection}\x00{namespace}\x00{normalize_question(question)}"
+        if embedding is not None:
+            # We store unit vectors, so cosine similarity is just a dot product later.
+            embedding = np.asarray(embedding, dtype=np.float32)
+            embedding = embedding / (np.linalg.norm(embedding) or 1.0)
+        with self._lock:
+            # A result computed against an older corpus finished after an upload landed,
+            # so it's already out of date and not worth keeping.
+            if corpus_version < self._corpus_versions.get(collection, corpus_version):
+                return
+            self._sync_version(collection, corpus_version)
+            self._entries[key] = {
+                "result": copy.deepcopy(result),
+                "embedding": embedding,
+                "namespace": namespace,
+                "collection": collection,
+                "created_at": time.monotonic()
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
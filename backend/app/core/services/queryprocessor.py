@@ -1,9 +1,82 @@
 import re
-import time
-from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
-from langchain.chains import LLMChain
+import json
+import asyncio
+from pydantic import ValidationError
+from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.prompts import PromptTemplate
-from ...core.services.in_memory_store import db_store
+from ...config import settings
+from ...core.models.batched_answer import BatchedAnswer
+from ...core.services.embeddings import get_embeddings
+from ...core.services.collection_manager import DEFAULT_COLLECTION, collection_manager
+from ...core.services.index_factory import search
+from ...core.services.metrics import (
+    LLM_CALLS, LLM_CALLS_SAVED, LLM_RETRIES, LLM_TOKENS, QUERY_CACHE_LOOKUPS, RETRIEVAL_DROPPED_CHUNKS, RETRIEVED_CHUNKS, span
+)
+from ...core.services.query_cache import QueryResultCache
+from ...core.services.retrieval import RetrievalOptions, candidate_vectors, refine
+from ...core.services.rate_limiter import TokenBucketRateLimiter, estimate_tokens, is_quota_error, backoff_delay
+
+# This prompt is highly specific. It instructs the AI to act as a research assistant
+# and, crucially, to base its answer *only* on the provided context. This prevents
+# it from using its general knowledge and helps ensure the answers are factual.
+ANSWER_PROMPT_TEMPLATE = "You are a helpful research assistant. Based *only* on the context provided below, give a detailed and comprehensive answer to the user's question. Explain the answer fully in 2-3 sentences. If the context contains direct quotes or key phrases that are highly relevant, you can include them. Do not give a short or overly summarized answer.\n\nContext:\n```\n{context}\n```\n\nQuestion: {question}"
+
+# This second prompt is where the magic happens. We're not just asking a question;
+# we're giving the AI a task with a very strict output format. This makes the
+# response predictable and easy for our code to parse later.
+THEME_PROMPT_TEMPLATE = """
+        Analyze the following extracted answers. Identify key themes.
+        For each theme, you MUST format your output EXACTLY as follows:
+
+        Theme Name: [A concise name for the theme]
+        Supporting Documents: [A comma-separated list of unique Document IDs]
+        Highlight: [A detailed paragraph of 2-4 sentences that synthesizes the insights for this theme. Explain what the theme means and why it's important based on the provided answers.]
+
+        Here are the answers to analyze:
+        {answers_context}
+        """
+
+# The "batched" pipeline mode asks for everything in one call: an answer per chunk plus
+# the themes, as JSON we can validate instead of free text we have to pick apart.
+BATCHED_PROMPT_TEMPLATE = """You are a helpful research assistant. Below are numbered context chunks retrieved for the user's question.
+
+For EVERY chunk, based *only* on that chunk's text, give a detailed and comprehensive answer to the question in 2-3 sentences. If the chunk contains direct quotes or key phrases that are highly relevant, you can include them. Do not give a short or overly summarized answer.
+
+Then analyze those answers together and identify the key themes. For each theme, give a concise name, the unique Document IDs that support it, and a detailed highlight of 2-4 sentences explaining what the theme means and why it's important.
+
+Respond with ONLY a JSON object, no markdown and no commentary, in exactly this shape:
+{{"answers": [{{"chunk_id": 1, "answer": "..."}}], "themes": [{{"theme": "...", "supporting_documents": ["..."], "highlight": "..."}}]}}
+There must be exactly one entry in "answers" for each chunk_id.
+
+{chunks}
+
+Question: {question}"""
+
+# If the batched response doesn't validate, we give the model one chance to fix it.
+BATCHED_REPAIR_PROMPT_TEMPLATE = """The JSON below was supposed to match this shape:
+{{"answers": [{{"chunk_id": <int>, "answer": "<string>"}}], "themes": [{{"theme": "<string>", "supporting_documents": ["<string>"], "highlight": "<string>"}}]}}
+with exactly one answer for each of these chunk_ids: {chunk_ids}
+
+It failed validation with this error:
+{error}
+
+Here is the output to fix:
+{output}
+
+Respond with ONLY the corrected JSON object, no markdown and no commentary."""
+
+PIPELINE_MODES = ("per_document", "batched")
+
+# The placeholder answer we show when a document's LLM call fails. Results containing it
+# are never cached, so a transient error doesn't stick around.
+ANSWER_ERROR_TEXT = "Error processing this document."
+
+# Before retrieval was refined, every query answered from a fixed top 5 chunks. We
+# report the LLM calls the refinement saves against that.
+FIXED_K_BASELINE = 5
+
+# We budget for the answer as well as the prompt when drawing from the token bucket.
+EXPECTED_OUTPUT_TOKENS = 256
 
 class QueryProcessor:
     def __init__(self):
@@ -15,101 +88,388 @@ class QueryProcessor:
             temperature=0.2, 
             
         )
-        self.embeddings = GoogleGenerativeAIEmbeddings(
-            model="models/embedding-001", 
-            
+        self.embeddings = get_embeddings()
+        self.answer_prompt = PromptTemplate(template=ANSWER_PROMPT_TEMPLATE, input_variables=["context", "question"])
+        self.theme_prompt = PromptTemplate(template=THEME_PROMPT_TEMPLATE, input_variables=["answers_context"])
+        self.batched_prompt = PromptTemplate(template=BATCHED_PROMPT_TEMPLATE, input_variables=["chunks", "question"])
+        self.batched_repair_prompt = PromptTemplate(template=BATCHED_REPAIR_PROMPT_TEMPLATE, input_variables=["chunk_ids", "error", "output"])
+        self.default_mode = settings.QUERY_PIPELINE_MODE
+        self.retrieval_options = RetrievalOptions.from_settings()
+        # One limiter is shared by every request this processor handles, so concurrent
+        # queries all draw from the same quota instead of each sleeping on its own.
+        self.rate_limiter = TokenBucketRateLimiter(
+            requests_per_second=settings.LLM_REQUESTS_PER_SECOND,
+            tokens_per_minute=settings.LLM_TOKENS_PER_MINUTE
         )
+        self.max_concurrency = max(1, settings.LLM_MAX_CONCURRENCY)
+        self.max_retries = settings.LLM_MAX_RETRIES
+        self.retry_base_delay = settings.LLM_RETRY_BASE_DELAY
+        # Repeat questions are answered from here instead of re-running six LLM calls.
+        # The cache empties itself whenever the corpus version moves on.
+        self.result_cache = QueryResultCache(
+            max_entries=settings.QUERY_CACHE_MAX_ENTRIES,
+            ttl_seconds=settings.QUERY_CACHE_TTL_SECONDS,
+            similarity_threshold=settings.QUERY_CACHE_SIMILARITY_THRESHOLD
+        )
+
+    def _record_llm_call(self, stage: str, prompt_tokens: int, output: str = None):
+        LLM_CALLS.labels(stage, "error" if output is None else "ok").inc()
+        LLM_TOKENS.labels(stage, "prompt").inc(prompt_tokens)
+        if output is not None:
+            LLM_TOKENS.labels(stage, "completion").inc(estimate_tokens(output))
+
+    def _chain(self, prompt: PromptTemplate):
+        # Every call, streamed or not, goes through the same prompt | llm runnable, so
+        # they all send the same messages and are counted the same way.
+        return prompt | self.llm
 
-    def handle_query(self, question: str):
+    async def _llm_pieces(self, prompt: PromptTemplate, inputs: dict, output_tokens: int, stage: str, stream: bool):
+        """Runs a chain through the rate limiter, yielding its output text, and retries with backoff on quota errors.
+
+        Both the plain and the streamed calls go through here. stage names the call in
+        the metrics ("answer", "themes", "batched" or "repair").
+        """
+        chain = self._chain(prompt)
+        prompt_tokens = estimate_tokens(prompt.format(**inputs))
+        tokens = prompt_tokens + output_tokens
+        # For a stream, the span includes the time the client took to read it.
+        with span("query", f"llm_{stage}"):
+            for attempt in range(self.max_retries + 1):
+                await self.rate_limiter.acquire_async(tokens)
+                emitted = []
+                try:
+                    if stream:
+                        async for chunk in chain.astream(inputs):
+                            if chunk.content:
+                                emitted.append(chunk.content)
+                                yield chunk.content
+                    else:
+                        output = (await chain.ainvoke(inputs)).content
+                        emitted.append(output)
+                        yield output
+                    self._record_llm_call(stage, prompt_tokens, "".join(emitted))
+                    return
+                except Exception as e:
+                    # Once text has gone out to the client we can't take it back, so only
+                    # a failure before the first token is worth retrying.
+                    if emitted or attempt == self.max_retries or not is_quota_error(e):
+                        self._record_llm_call(stage, prompt_tokens)
+                        raise
+                    LLM_RETRIES.labels(stage).inc()
+                    delay = backoff_delay(attempt, self.retry_base_delay)
+                    print(f"LLM quota hit, retrying in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries}): {e}")
+                    await asyncio.sleep(delay)
+
+    async def _ainvoke_chain(self, prompt: PromptTemplate, inputs: dict, output_tokens: int = EXPECTED_OUTPUT_TOKENS, stage: str = "answer") -> str:
+        """Runs a chain and returns its whole output (see _llm_pieces)."""
+        return "".join([text async for text in self._llm_pieces(prompt, inputs, output_tokens, stage, stream=False)])
+
+    def _retrieve(self, store, question_embedding, mode: str, nprobe: int = None, ef_search: int = None):
+        """Finds the chunks to answer from. Returns (documents, retrieval report)."""
         #grab the vector store that was created and saved in memory by the document processor.
-        vector_store = db_store.vector_store
+        vector_store = store.vector_store
         if not vector_store:
-            return {"individual_answers": [], "synthesized_themes": []}
+            return [], None
         # This is the core of our search. We're asking the vector store (FAISS)
-        # to find the top 5 text chunks that are most similar to the user's question.
-        relevant_docs = vector_store.similarity_search(question, k=5)
-        if not relevant_docs:
-            return {"individual_answers": [], "synthesized_themes": []}
-        # Stage 1: Generate Individual Answers for Each Relevant Document 
-        individual_answers = []
-        for doc in relevant_docs:
-            time.sleep(1) # Adding a small delay to avoid hitting API rate limits if we make requests too quickly.
-            
-            # This prompt is highly specific. It instructs the AI to act as a research assistant
-            # and, crucially, to base its answer *only* on the provided context. This prevents
-            # it from using its general knowledge and helps ensure the answers are factual.
-            prompt = PromptTemplate(
-                template="You are a helpful research assistant. Based *only* on the context provided below, give a detailed and comprehensive answer to the user's question. Explain the answer fully in 2-3 sentences. If the context contains direct quotes or key phrases that are highly relevant, you can include them. Do not give a short or overly summarized answer.\n\nContext:\n```\n{context}\n```\n\nQuestion: {question}",
-                input_variables=["context", "question"]
-            )
-            chain = LLMChain(llm=self.llm, prompt=prompt)
+        # for the text chunks that are most similar to the user's question.
+        # nprobe/efSearch only matter for IVF/HNSW indexes and only apply to this call.
+        options = self.retrieval_options
+        with span("query", "search"):
+            results = search(vector_store, question_embedding, options.fetch_k, store.index_spec, nprobe=nprobe, ef_search=ef_search)
+        # Every chunk we keep costs an LLM call in the per-document mode, so we drop the
+        # weak matches and the repeats and merge neighbours before going any further.
+        with span("query", "refine"):
+            docs = [doc for doc, _, _ in results]
+            vectors = candidate_vectors(vector_store, [position for _, _, position in results], docs)
+            docs, report = refine(docs, vectors, question_embedding, options)
+        for reason in ("below_cutoff", "near_duplicates", "not_selected", "merged"):
+            RETRIEVAL_DROPPED_CHUNKS.labels(reason).inc(report[reason])
+        # We measure against the old fixed-k pipeline: one answer call for each of the
+        # top 5 chunks. The batched mode makes one call however many chunks there are.
+        baseline = min(FIXED_K_BASELINE, vector_store.ntotal)
+        report["llm_calls_saved"] = max(0, baseline - report["chunks_used"]) if mode == "per_document" else 0
+        LLM_CALLS_SAVED.inc(report["llm_calls_saved"])
+        RETRIEVED_CHUNKS.observe(len(docs))
+        return docs, report
+
+    def _format_answer(self, doc, answer_text: str) -> dict:
+        return {
+            "Document ID": doc.metadata.get("source", "N/A"),
+            "Extracted Answer": answer_text,
+            "Citation": f"Page {doc.metadata.get('page', 'N/A')}, Para {doc.metadata.get('paragraph', 'N/A')}"
+        }
+
+    async def _answer_document_async(self, doc, question: str, semaphore: asyncio.Semaphore) -> dict:
+        async with semaphore:
             try:
-                response = chain.invoke({"context": doc.page_content, "question": question}) # We send one document's content at a time, along with the user's question.
-                answer_text = response['text'].strip()
+                answer_text = (await self._ainvoke_chain(self.answer_prompt, {"context": doc.page_content, "question": question})).strip()
             except Exception as e:
                 print(f"Error invoking LLM chain for a document: {e}")
-                answer_text = "Error processing this document."
+                answer_text = ANSWER_ERROR_TEXT
+        return self._format_answer(doc, answer_text)
 
-            individual_answers.append({
-                "Document ID": doc.metadata.get("source", "N/A"),
-                "Extracted Answer": answer_text,
-                "Citation": f"Page {doc.metadata.get('page', 'N/A')}, Para {doc.metadata.get('paragraph', 'N/A')}"
-            })
-        # Stage 2: Synthesize Themes from all the Individual Answers 
+    def _build_answers_context(self, individual_answers) -> str:
         # We'll combine all the answers we just generated into a single block of text.
         # This gives the AI the complete context it needs for the next step.
-        answers_context = "\n\n".join([f"From {ans['Document ID']} ({ans['Citation']}): {ans['Extracted Answer']}" for ans in individual_answers])
-        
-        # This second prompt is where the magic happens. We're not just asking a question;
-        # we're giving the AI a task with a very strict output format. This makes the
-        # response predictable and easy for our code to parse later.
-        theme_prompt_template = """
-        Analyze the following extracted answers. Identify key themes.
-        For each theme, you MUST format your output EXACTLY as follows:
+        return "\n\n".join([f"From {ans['Document ID']} ({ans['Citation']}): {ans['Extracted Answer']}" for ans in individual_answers])
 
-        Theme Name: [A concise name for the theme]
-        Supporting Documents: [A comma-separated list of unique Document IDs]
-        Highlight: [A detailed paragraph of 2-4 sentences that synthesizes the insights for this theme. Explain what the theme means and why it's important based on the provided answers.]
+    def _parse_themes(self, theme_response_text: str):
+        """Parses the AI's formatted theme response into a list of theme dicts."""
+        with span("query", "parse_themes"):
+            synthesized_themes = []
+            theme_chunks = theme_response_text.strip().split("Theme Name:")
+            # We're using a regular expression (regex) to reliably pull the data out of the
+            # AI's formatted text. It looks for the three labeled parts of our prompt.
+            pattern = re.compile(r"(.*?)\nSupporting Documents: (.*?)\nHighlight: (.*)", re.DOTALL)
 
-        Here are the answers to analyze:
-        {answers_context}
-        """
-        
-        theme_prompt = PromptTemplate(template=theme_prompt_template, input_variables=["answers_context"])
-        theme_chain = LLMChain(llm=self.llm, prompt=theme_prompt)
-        
+            for chunk in theme_chunks:
+                if not chunk.strip():
+                    continue
+            
+                match = pattern.search(chunk)
+                if match:
+                    theme_name, supporting_docs, highlight = match.groups()
+                    # A little cleanup to handle cases where a document is cited multiple times.
+                    doc_list = [doc.strip() for doc in supporting_docs.split(',')]
+                    unique_docs = list(dict.fromkeys(doc_list)) # A quick trick to get unique items while preserving order.
+                    cleaned_docs_str = ", ".join(unique_docs)
+
+                    synthesized_themes.append({
+                        "Theme": theme_name.strip(),
+                        "Supporting Documents": cleaned_docs_str,
+                        "Highlight": highlight.strip()
+                    })
+            return synthesized_themes
+
+    def _build_batched_inputs(self, relevant_docs, question: str) -> dict:
+        # Each chunk gets a number the model has to echo back, so we can line its
+        # answers up with our documents no matter what order it writes them in.
+        chunks = "\n\n".join(
+            f"[Chunk {i}] (Document ID: {doc.metadata.get('source', 'N/A')})\n```\n{doc.page_content}\n```"
+            for i, doc in enumerate(relevant_docs, start=1)
+        )
+        return {"chunks": chunks, "question": question}
+
+    def _parse_batched_output(self, output: str, relevant_docs) -> dict:
+        """Validates the batched JSON and turns it into our usual response shape. Raises ValueError if it doesn't fit."""
+        with span("query", "parse_batched"):
+            # Models like to wrap JSON in a markdown fence even when told not to.
+            text = re.sub(r"^```(?:json)?\s*|\s*```$", "", output.strip())
+            try:
+                parsed = BatchedAnswer.model_validate(json.loads(text))
+            except (json.JSONDecodeError, ValidationError) as e:
+                raise ValueError(str(e)) from e
+            answers_by_id = {item.chunk_id: item.answer.strip() for item in parsed.answers}
+            expected_ids = set(range(1, len(relevant_docs) + 1))
+            if set(answers_by_id) != expected_ids:
+                raise ValueError(f"Expected answers for chunk_ids {sorted(expected_ids)}, got {sorted(answers_by_id)}.")
+            return {
+                "individual_answers": [self._format_answer(doc, answers_by_id[i]) for i, doc in enumerate(relevant_docs, start=1)],
+                "synthesized_themes": [
+                    {
+                        "Theme": theme.theme.strip(),
+                        "Supporting Documents": ", ".join(dict.fromkeys(doc_id.strip() for doc_id in theme.supporting_documents)),
+                        "Highlight": theme.highlight.strip()
+                    }
+                    for theme in parsed.themes
+                ]
+            }
+
+    def _batched_output_tokens(self, relevant_docs) -> int:
+        # Roughly one normal answer per chunk plus room for the themes.
+        return EXPECTED_OUTPUT_TOKENS * (len(relevant_docs) + 2)
+
+    def _batched_failure(self, relevant_docs):
+        return {
+            "individual_answers": [self._format_answer(doc, ANSWER_ERROR_TEXT) for doc in relevant_docs],
+            "synthesized_themes": []
+        }, False
+
+    async def _run_batched_async(self, question: str, relevant_docs):
+        """One LLM call for all answers and themes, plus at most one repair call. Returns (result, cacheable)."""
+        output_tokens = self._batched_output_tokens(relevant_docs)
         try:
-            theme_response_text = theme_chain.invoke({"answers_context": answers_context})['text']
+            output = await self._ainvoke_chain(self.batched_prompt, self._build_batched_inputs(relevant_docs, question), output_tokens, stage="batched")
+            try:
+                return self._parse_batched_output(output, relevant_docs), True
+            except ValueError as e:
+                print(f"Batched answer failed validation, asking for a repair: {e}")
+                repaired = await self._ainvoke_chain(self.batched_repair_prompt, {
+                    "chunk_ids": list(range(1, len(relevant_docs) + 1)), "error": str(e), "output": output
+                }, output_tokens, stage="repair")
+                return self._parse_batched_output(repaired, relevant_docs), True
+        except Exception as e:
+            print(f"Error during batched answer generation: {e}")
+            return self._batched_failure(relevant_docs)
+
+    async def _run_per_document_async(self, question: str, relevant_docs):
+        """One LLM call per document, then a theme synthesis call. Returns (result, cacheable)."""
+        # Stage 1: every document gets its own call, at most max_concurrency in flight.
+        # gather() hands results back in the order we passed them in, so the answers
+        # keep the retrieval ranking no matter which call finishes first.
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        individual_answers = await asyncio.gather(
+            *[self._answer_document_async(doc, question, semaphore) for doc in relevant_docs]
+        )
+        individual_answers = list(individual_answers)
+        # Stage 2: Synthesize Themes from all the Individual Answers 
+        theme_failed = False
+        try:
+            theme_response_text = await self._ainvoke_chain(self.theme_prompt, {"answers_context": self._build_answers_context(individual_answers)}, stage="themes")
         except Exception as e:
             print(f"Error during theme generation: {e}")
             theme_response_text = ""
-            
+            theme_failed = True
         # Stage 3: Parse the AI's Formatted Response
-        synthesized_themes = []
-        theme_chunks = theme_response_text.strip().split("Theme Name:")
-        # We're using a regular expression (regex) to reliably pull the data out of the
-        # AI's formatted text. It looks for the three labeled parts of our prompt.
-        pattern = re.compile(r"(.*?)\nSupporting Documents: (.*?)\nHighlight: (.*)", re.DOTALL)
-
-        for chunk in theme_chunks:
-            if not chunk.strip():
-                continue
-            
-            match = pattern.search(chunk)
-            if match:
-                theme_name, supporting_docs, highlight = match.groups()
-                # A little cleanup to handle cases where a document is cited multiple times.
-                doc_list = [doc.strip() for doc in supporting_docs.split(',')]
-                unique_docs = list(dict.fromkeys(doc_list)) # A quick trick to get unique items while preserving order.
-                cleaned_docs_str = ", ".join(unique_docs)
-
-                synthesized_themes.append({
-                    "Theme": theme_name.strip(),
-                    "Supporting Documents": cleaned_docs_str,
-                    "Highlight": highlight.strip()
-                })
+        result = {
+            "individual_answers": individual_answers,
+            "synthesized_themes": self._parse_themes(theme_response_text)
+        }
+        return result, self._is_cacheable(result, theme_failed)
 
-        return {
+    def _is_cacheable(self, result: dict, theme_failed: bool) -> bool:
+        return not theme_failed and all(ans["Extracted Answer"] != ANSWER_ERROR_TEXT for ans in result["individual_answers"])
+
+    def _resolve_mode(self, mode):
+        mode = mode or self.default_mode
+        if mode not in PIPELINE_MODES:
+            raise ValueError(f"Unknown pipeline mode '{mode}'. Expected one of {', '.join(PIPELINE_MODES)}.")
+        return mode
+
+    def _cache_namespace(self, mode: str, nprobe: int, ef_search: int) -> str:
+        # Different modes and search settings can give different results, so they're cached apart.
+        return f"{mode}|nprobe={nprobe}|ef_search={ef_search}"
+
+    def _lookup_cache(self, question: str, store, corpus_version: int, namespace: str, embedding=None):
+        """Checks the result cache, counting exact hits, similar-question hits and misses."""
+        cached = self.result_cache.get(question, corpus_version, embedding=embedding, namespace=namespace, collection=store.name)
+        if cached is not None:
+            QUERY_CACHE_LOOKUPS.labels("hit" if embedding is None else "similar_hit").inc()
+        elif embedding is not None:
+            # Only the second lookup is a real miss; after the first we still have the similarity check to go.
+            QUERY_CACHE_LOOKUPS.labels("miss").inc()
+        return cached
+
+    def _embed_question(self, question: str):
+        with span("query", "embed"):
+            return self.embeddings.embed_query(question)
+
+    async def _prepare_async(self, question: str, store, corpus_version: int, namespace: str, mode: str, nprobe: int, ef_search: int):
+        """Checks the result cache and runs retrieval. Returns (cached_result, question_embedding, relevant_docs, retrieval_report)."""
+        cached = self._lookup_cache(question, store, corpus_version, namespace)
+        if cached is not None:
+            return cached, None, [], None
+        # Embedding the question may go over the network, so we push it off the event loop.
+        question_embedding = await asyncio.to_thread(self._embed_question, question)
+        cached = self._lookup_cache(question, store, corpus_version, namespace, embedding=question_embedding)
+        if cached is not None:
+            return cached, question_embedding, [], None
+        relevant_docs, retrieval_report = await asyncio.to_thread(self._retrieve, store, question_embedding, mode, nprobe, ef_search)
+        return None, question_embedding, relevant_docs, retrieval_report
+
+    async def handle_query_async(self, question: str, mode: str = None, nprobe: int = None, ef_search: int = None,
+                                 collection: str = DEFAULT_COLLECTION):
+        """Runs the full pipeline, with the per-document LLM calls sent concurrently.
+
+        mode picks "per_document" (k answer calls plus a synthesis call) or "batched"
+        (one call returning everything as JSON); it defaults to QUERY_PIPELINE_MODE.
+        nprobe and ef_search tune IVF and HNSW indexes for this query only, and
+        collection picks which knowledge base to search.
+        """
+        mode = self._resolve_mode(mode)
+        namespace = self._cache_namespace(mode, nprobe, ef_search)
+        # Looking the collection up may load it from disk, so it happens off the event loop.
+        store = await asyncio.to_thread(collection_manager.get, collection)
+        corpus_version = store.corpus_version
+        cached, question_embedding, relevant_docs, retrieval_report = await self._prepare_async(
+            question, store, corpus_version, namespace, mode, nprobe, ef_search
+        )
+        if cached is not None:
+            return cached
+        if not relevant_docs:
+            return {"individual_answers": [], "synthesized_themes": []}
+        if mode == "batched":
+            result, cacheable = await self._run_batched_async(question, relevant_docs)
+        else:
+            result, cacheable = await self._run_per_document_async(question, relevant_docs)
+        result["retrieval"] = retrieval_report
+        if cacheable:
+            self.result_cache.put(question, corpus_version, result, embedding=question_embedding, namespace=namespace, collection=store.name)
+        return result
+
+    async def _astream_chain(self, prompt: PromptTemplate, inputs: dict, stage: str = "themes"):
+        """Streams a chain's output text piece by piece (see _llm_pieces)."""
+        async for text in self._llm_pieces(prompt, inputs, EXPECTED_OUTPUT_TOKENS, stage, stream=True):
+            yield text
+
+    async def stream_query(self, question: str, mode: str = None, nprobe: int = None, ef_search: int = None,
+                           collection: str = DEFAULT_COLLECTION):
+        """Runs the pipeline as an async generator of events, so clients can render results as they arrive.
+
+        Events are dicts with an "event" key:
+          - "answer": one individual answer ("index" is its retrieval rank), sent as soon as it's ready
+          - "theme_token": the next piece of the raw theme synthesis text
+          - "result": the final structured payload, same shape as handle_query_async's return value
+        """
+        mode = self._resolve_mode(mode)
+        namespace = self._cache_namespace(mode, nprobe, ef_search)
+        # Looking the collection up may load it from disk, so it happens off the event loop.
+        store = await asyncio.to_thread(collection_manager.get, collection)
+        corpus_version = store.corpus_version
+        cached, question_embedding, relevant_docs, retrieval_report = await self._prepare_async(
+            question, store, corpus_version, namespace, mode, nprobe, ef_search
+        )
+        if cached is None and not relevant_docs:
+            cached = {"individual_answers": [], "synthesized_themes": []}
+        if cached is None and mode == "batched":
+            # The batched mode makes a single call, so there's nothing to stream before
+            # it finishes; we still send the answers one by one for a uniform protocol.
+            cached, cacheable = await self._run_batched_async(question, relevant_docs)
+            cached["retrieval"] = retrieval_report
+            if cacheable:
+                self.result_cache.put(question, corpus_version, cached, embedding=question_embedding, namespace=namespace, collection=store.name)
+        if cached is not None:
+            for index, answer in enumerate(cached["individual_answers"]):
+                yield {"event": "answer", "index": index, "answer": answer}
+            yield {"event": "result", **cached}
+            return
+
+        # Stage 1: the calls run concurrently exactly as in handle_query_async, but each
+        # answer goes out the moment its call returns. The index tells the client where
+        # it belongs in the retrieval order.
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def answer_with_index(index, doc):
+            return index, await self._answer_document_async(doc, question, semaphore)
+
+        individual_answers = [None] * len(relevant_docs)
+        tasks = [asyncio.ensure_future(answer_with_index(i, doc)) for i, doc in enumerate(relevant_docs)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                index, answer = await next_done
+                individual_answers[index] = answer
+                yield {"event": "answer", "index": index, "answer": answer}
+        finally:
+            # If the client goes away mid-stream, there's no point finishing the other calls.
+            for task in tasks:
+                task.cancel()
+
+        # Stage 2: the synthesis text is streamed token by token as the model writes it.
+        theme_failed = False
+        theme_parts = []
+        try:
+            async for text in self._astream_chain(self.theme_prompt, {"answers_context": self._build_answers_context(individual_answers)}):
+                theme_parts.append(text)
+                yield {"event": "theme_token", "text": text}
+        except Exception as e:
+            print(f"Error during theme generation: {e}")
+            theme_failed = True
+        # Stage 3: Parse the AI's Formatted Response
+        result = {
             "individual_answers": individual_answers,
-            "synthesized_themes": synthesized_themes
-        }
\ No newline at end of file
+            "synthesized_themes": [] if theme_failed else self._parse_themes("".join(theme_parts)),
+            "retrieval": retrieval_report
+        }
+        if self._is_cacheable(result, theme_failed):
+            self.result_cache.put(question, corpus_version, result, embedding=question_embedding, namespace=namespace, collection=store.name)
+        yield {"event": "result", **result}
\ No newline at end of file
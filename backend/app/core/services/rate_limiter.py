@@ -0,0 +1,72 @@
+import asyncio
+import random
+import threading
+import time
+
+
+class TokenBucketRateLimiter:
+    """A shared token bucket that caps both requests per second and tokens per minute."""
+    def __init__(self, requests_per_second: float, tokens_per_minute: int):
+        # We keep two buckets side by side. A call has to be able to pay from both of
+        # them before it's allowed through, so whichever limit is tighter wins. A rate
+        # of 0 (or less) turns that limit off.
+        self.request_limited = requests_per_second > 0
+        self.token_limited = tokens_per_minute > 0
+        self.request_rate = requests_per_second
+        self.request_capacity = max(1.0, requests_per_second)
+        self.token_rate = tokens_per_minute / 60.0
+        self.token_capacity = float(tokens_per_minute)
+
+        self._request_level = self.request_capacity
+        self._token_level = self.token_capacity
+        self._last_refill = time.monotonic()
+        # We never wait while holding this lock, so a plain threading lock can't stall
+        # the event loop.
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._request_level = min(self.request_capacity, self._request_level + elapsed * self.request_rate)
+        self._token_level = min(self.token_capacity, self._token_level + elapsed * self.token_rate)
+
+    def _try_acquire(self, tokens: int) -> float:
+        """Takes a slot if one is free and returns 0, otherwise returns how long to wait."""
+        # A single request bigger than the whole bucket would wait forever, so we clamp it.
+        tokens = min(float(tokens), self.token_capacity) if self.token_limited else 0.0
+        with self._lock:
+            self._refill()
+            request_ok = not self.request_limited or self._request_level >= 1
+            token_ok = self._token_level >= tokens
+            if request_ok and token_ok:
+                if self.request_limited:
+                    self._request_level -= 1
+                self._token_level -= tokens
+                return 0.0
+            request_wait = 0.0 if request_ok else (1 - self._request_level) / self.request_rate
+            token_wait = 0.0 if token_ok else (tokens - self._token_level) / self.token_rate
+            return max(request_wait, token_wait)
+
+    async def acquire_async(self, tokens: int = 0):
+        """Waits without blocking the event loop until the request can go out."""
+        while (wait := self._try_acquire(tokens)) > 0:
+            await asyncio.sleep(wait)
+
+
+def estimate_tokens(text: str) -> int:
+    """A rough token count (~4 characters per token), good enough for budgeting."""
+    return max(1, len(text) // 4)
+
+
+def is_quota_error(error: Exception) -> bool:
+    """Checks whether an exception looks like a rate-limit or quota rejection from the API."""
+    if type(error).__name__ in ("ResourceExhausted", "TooManyRequests", "RateLimitError"):
+        return True
+    message = str(error).lower()
+    return "429" in message or "quota" in message or "rate limit" in message or "resource exhausted" in message
+
+
+def backoff_delay(attempt: int, base_delay: float) -> float:
+    """Exponential backoff with a bit of jitter so parallel retries don't line up."""
+    return base_delay * (2 ** attempt) + random.uniform(0, base_delay)
@@ -0,0 +1,148 @@
+from typing import List, Tuple
+import numpy as np
+from langchain.schema import Document
+from ...config import settings
+
+# The splitter overlaps neighbouring chunks by up to 200 characters; we look for a bit
+# more than that when stitching two of them back together.
+MAX_STITCH_OVERLAP = 400
+
+class RetrievalOptions:
+    """How the candidates from a vector search are trimmed down to the chunks we send to the LLM."""
+    def __init__(self, max_k: int = 5, min_k: int = 1, fetch_k: int = 0, relative_cutoff: float = 0.7,
+                 duplicate_threshold: float = 0.95, mmr_lambda: float = 0.0, merge_adjacent: bool = True):
+        self.max_k = max(1, max_k)
+        self.min_k = max(1, min(min_k, self.max_k))
+        # MMR needs more candidates than it keeps to have anything to choose between.
+        self.fetch_k = max(fetch_k, self.max_k)
+        self.relative_cutoff = relative_cutoff
+        self.duplicate_threshold = duplicate_threshold
+        self.mmr_lambda = mmr_lambda
+        self.merge_adjacent = merge_adjacent
+
+    @classmethod
+    def from_settings(cls) -> "RetrievalOptions":
+        return cls(
+            max_k=settings.RETRIEVAL_MAX_K,
+            min_k=settings.RETRIEVAL_MIN_K,
+            fetch_k=settings.RETRIEVAL_FETCH_K,
+            relative_cutoff=settings.RETRIEVAL_RELATIVE_CUTOFF,
+            duplicate_threshold=settings.RETRIEVAL_DUPLICATE_THRESHOLD,
+            mmr_lambda=settings.RETRIEVAL_MMR_LAMBDA,
+            merge_adjacent=settings.RETRIEVAL_MERGE_ADJACENT
+        )
+
+def candidate_vectors(vector_store, positions: List[int], docs: List[Document]) -> np.ndarray:
+    """The stored vectors for the given positions in a SegmentedStore.
+
+    Every index we build can hand them straight back (IVF ones keep a direct map for
+    this, see ensure_direct_map), so no query has to embed its candidates again. An
+    IVF index that somehow has no map falls back to the embedding function.
+    """
+    try:
+        return vector_store.vectors(positions)
+    except RuntimeError as e:
+        print(f"Could not read candidate vectors from the index, embedding them instead: {e}")
+        return np.asarray(vector_store.embedding_function.embed_documents([doc.page_content for doc in docs]), dtype=np.float32)
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+def _stitch(first: str, second: str) -> str:
+    """Joins two neighbouring chunks, dropping the text they share at the seam."""
+    for size in range(min(len(first), len(second), MAX_STITCH_OVERLAP), 0, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return first + "\n" + second
+
+def _merge_adjacent(docs: List[Document]) -> Tuple[List[Document], int]:
+    """Merges chunks that are consecutive paragraphs of the same source and page.
+
+    The merged chunk takes the place of its best-ranked part, and its paragraph becomes
+    a range like "3-4" so the citation still points at the right place. Returns the
+    new list and how many chunks were folded into others.
+    """
+    groups = {}
+    for rank, doc in enumerate(docs):
+        paragraph = doc.metadata.get("paragraph")
+        if isinstance(paragraph, int):
+            groups.setdefault((doc.metadata.get("source"), doc.metadata.get("page")), []).append((paragraph, rank))
+
+    merged_at = {}
+    absorbed = set()
+    for members in groups.values():
+        members.sort()
+        run = [members[0]]
+        for member in members[1:] + [None]:
+            if member is not None and member[0] == run[-1][0] + 1:
+                run.append(member)
+                continue
+            if len(run) > 1:
+                text = docs[run[0][1]].page_content
+                for _, rank in run[1:]:
+                    text = _stitch(text, docs[rank].page_content)
+                head = min(rank for _, rank in run)
+                metadata = {**docs[run[0][1]].metadata, "paragraph": f"{run[0][0]}-{run[-1][0]}"}
+                merged_at[head] = Document(page_content=text, metadata=metadata)
+                absorbed.update(rank for _, rank in run if rank != head)
+            run = [member]
+    result = [merged_at.get(rank, doc) for rank, doc in enumerate(docs) if rank not in absorbed]
+    return result, len(absorbed)
+
+def refine(docs: List[Document], vectors: np.ndarray, question_embedding, options: RetrievalOptions) -> Tuple[List[Document], dict]:
+    """Cuts ranked search results down to the chunks worth an LLM call each.
+
+    In order: candidates that score well below the best one are dropped (so k adapts to
+    how many chunks actually match), then near-duplicates of better-ranked chunks, then
+    we pick up to max_k (by MMR if it's on, by rank otherwise), and finally neighbouring
+    chunks from the same page are merged. Returns (documents, report).
+    """
+    report = {"candidates": len(docs), "below_cutoff": 0, "near_duplicates": 0, "not_selected": 0, "merged": 0}
+    if not docs:
+        report["chunks_used"] = 0
+        return [], report
+    vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+    similarity = vectors @ _normalize(np.asarray(question_embedding, dtype=np.float32))
+
+    # Adaptive k: we keep whatever scores within relative_cutoff of the best match, but
+    # never fewer than min_k chunks. A cutoff only makes sense against a positive score.
+    best = float(similarity.max())
+    ranks = list(range(len(docs)))
+    if options.relative_cutoff > 0 and best > 0:
+        kept = [rank for rank in ranks if similarity[rank] >= best * options.relative_cutoff]
+        kept = sorted(set(kept) | set(ranks[:options.min_k]))
+        report["below_cutoff"] = len(ranks) - len(kept)
+        ranks = kept
+
+    # Near-duplicates: a chunk that's almost the same as one ranked above it tells the
+    # LLM nothing new, so it goes.
+    if options.duplicate_threshold < 1:
+        unique = []
+        for rank in ranks:
+            if not unique or float((vectors[unique] @ vectors[rank]).max()) < options.duplicate_threshold:
+                unique.append(rank)
+        report["near_duplicates"] = len(ranks) - len(unique)
+        ranks = unique
+
+    if options.mmr_lambda > 0:
+        selected = []
+        remaining = list(ranks)
+        while remaining and len(selected) < options.max_k:
+            def mmr_score(rank):
+                redundancy = float((vectors[selected] @ vectors[rank]).max()) if selected else 0.0
+                return options.mmr_lambda * float(similarity[rank]) - (1 - options.mmr_lambda) * redundancy
+            choice = max(remaining, key=mmr_score)
+            selected.append(choice)
+            remaining.remove(choice)
+        # MMR picks in its own order; we hand the chunks on in relevance order.
+        selected.sort()
+    else:
+        selected = ranks[:options.max_k]
+    report["not_selected"] = len(ranks) - len(selected)
+
+    refined = [docs[rank] for rank in selected]
+    if options.merge_adjacent:
+        refined, report["merged"] = _merge_adjacent(refined)
+    report["chunks_used"] = len(refined)
+    return refined, report
@@ -0,0 +1,218 @@
+from typing import Callable, Dict, List, Optional, Tuple
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from .chunk_store import ChunkStore, RowIds, concatenate
+from .index_factory import IndexSpec, all_vectors, compacted_index, index_private_bytes, search_parameters, should_rebuild
+
+class SegmentedStore:
+    """One version of a collection: a few FAISS stores ("segments") searched as if they were one.
+
+    The first segment is the base, built with the configured index type. Every upload
+    after that adds a small exact segment of its own, and deletes only record which
+    positions are gone, so a write costs about as much as the chunks it touches rather
+    than the whole corpus. New segments are merged with each other as they pile up
+    (see segments_to_merge), and once they and the deleted rows outgrow a share of the
+    base, compact() folds everything back into a single segment.
+
+    Positions are global: a segment's rows come after those of every segment before it,
+    so they stay valid as segments are appended. In each segment, docstore row i is
+    index position i. Segments are never changed once built; a write makes a new
+    SegmentedStore that shares the ones it didn't touch.
+    """
+    def __init__(self, segments: List[FAISS], deleted: Optional[np.ndarray] = None,
+                 locations: Optional[List[Optional[dict]]] = None):
+        self.segments = segments
+        # Sorted global positions of deleted rows, which searches skip.
+        self.deleted = np.unique(np.asarray(deleted, dtype=np.int64)) if deleted is not None else np.zeros(0, dtype=np.int64)
+        # Where each segment was saved in the snapshot directory (see index_snapshot),
+        # or None for segments that only exist in memory so far.
+        self.locations = locations if locations is not None else [None] * len(segments)
+        self.offsets = np.cumsum([0] + [segment.index.ntotal for segment in segments])
+
+    @property
+    def ntotal(self) -> int:
+        """How many live (not deleted) vectors the store holds."""
+        return int(self.offsets[-1]) - len(self.deleted)
+
+    @property
+    def embedding_function(self):
+        return self.segments[0].embedding_function
+
+    @property
+    def private_bytes(self) -> int:
+        """Roughly how much memory the store holds in this process alone, leaving out memory-mapped vectors and columns."""
+        return sum(index_private_bytes(segment.index) + segment.docstore.private_bytes for segment in self.segments) + self.deleted.nbytes
+
+    def _owners(self, positions: np.ndarray) -> np.ndarray:
+        return np.searchsorted(self.offsets, positions, side="right") - 1
+
+    def _live(self, positions: np.ndarray) -> np.ndarray:
+        return ~np.isin(positions, self.deleted)
+
+    def search(self, query: np.ndarray, k: int, nprobe: Optional[int] = None,
+               ef_search: Optional[int] = None) -> List[Tuple[float, int]]:
+        """The k nearest live vectors as (distance, position) pairs, closest first."""
+        found = []
+        for segment, offset in zip(self.segments, self.offsets):
+            index = segment.index
+            params = search_parameters(index, nprobe, ef_search)
+            fetch = min(k, index.ntotal)
+            while fetch > 0:
+                scores, positions = index.search(query, fetch, params=params) if params else index.search(query, fetch)
+                # FAISS pads with -1 when it finds fewer than asked for.
+                returned = positions[0] != -1
+                scores, positions = scores[0][returned], positions[0][returned] + offset
+                live = self._live(positions)
+                # Deleted rows still come back from the index, so we ask for more until
+                # there are k live ones or the segment has nothing more to give.
+                if live.sum() >= k or fetch >= index.ntotal or len(positions) < fetch:
+                    found.extend(zip(scores[live].tolist(), positions[live].tolist()))
+                    break
+                fetch = min(index.ntotal, 2 * fetch)
+        # Every index we build uses L2 distance, so smaller is closer in every segment.
+        found.sort(key=lambda hit: hit[0])
+        return [(float(score), int(position)) for score, position in found[:k]]
+
+    def document(self, position: int):
+        owner = int(self._owners(np.array([position]))[0])
+        # Docstore row i is index position i, so there's no id to look up.
+        return self.segments[owner].docstore.document(position - int(self.offsets[owner]))
+
+    def vectors(self, positions: List[int]) -> np.ndarray:
+        """The stored vectors at the given positions, in the same order."""
+        positions = np.asarray(positions, dtype=np.int64)
+        vectors = np.zeros((len(positions), self.segments[0].index.d), dtype=np.float32)
+        owners = self._owners(positions)
+        for owner in np.unique(owners):
+            mask = owners == owner
+            vectors[mask] = self.segments[owner].index.reconstruct_batch(positions[mask] - self.offsets[owner])
+        return vectors
+
+    def live_vectors(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Every live vector along with its position, in position order (decoded, for PQ and SQ)."""
+        positions, vectors = [], []
+        for segment, offset in zip(self.segments, self.offsets):
+            segment_positions = np.arange(offset, offset + segment.index.ntotal, dtype=np.int64)
+            live = self._live(segment_positions)
+            positions.append(segment_positions[live])
+            vectors.append(all_vectors(segment.index)[live])
+        return np.concatenate(positions), np.concatenate(vectors)
+
+    def positions_of(self, ids: List[str]) -> np.ndarray:
+        """The live positions holding the given chunk ids. Ids we don't have are skipped."""
+        found = []
+        for segment, offset in zip(self.segments, self.offsets):
+            rows = segment.docstore.rows(ids, missing_ok=True)
+            positions = rows[rows != -1] + offset
+            found.append(positions[self._live(positions)])
+        return np.concatenate(found).astype(np.int64)
+
+    def contains(self, ids: List[str]) -> np.ndarray:
+        """For each chunk id, whether a live row holds it."""
+        found = np.zeros(len(ids), dtype=bool)
+        for segment, offset in zip(self.segments, self.offsets):
+            rows = segment.docstore.rows(ids, missing_ok=True)
+            hit = rows != -1
+            found[hit] |= self._live(rows[hit] + offset)
+        return found
+
+    def _live_segment_rows(self, i: int) -> np.ndarray:
+        rows = np.arange(self.segments[i].index.ntotal, dtype=np.int64)
+        return rows[self._live(rows + self.offsets[i])]
+
+    def source_counts(self) -> Dict[str, int]:
+        """How many live chunks came from each source."""
+        counts = {}
+        for i, segment in enumerate(self.segments):
+            for source, count in segment.docstore.source_counts(self._live_segment_rows(i)).items():
+                counts[source] = counts.get(source, 0) + count
+        return counts
+
+    def ids_of_source(self, source: str) -> List[str]:
+        """The ids of every live chunk from the given source."""
+        ids = []
+        for segment, offset in zip(self.segments, self.offsets):
+            rows = segment.docstore.rows_of_source(source)
+            rows = rows[self._live(rows + offset)]
+            ids.extend(doc_id.decode("utf-8") for doc_id in segment.docstore.ids[rows])
+        return ids
+
+    def with_changes(self, segment: Optional[FAISS] = None, deleted: Optional[np.ndarray] = None) -> "SegmentedStore":
+        """A new store with one more segment and/or more deleted positions. This one is left as it is."""
+        segments, locations = list(self.segments), list(self.locations)
+        if segment is not None:
+            segments.append(segment)
+            locations.append(None)
+        if deleted is not None and len(deleted):
+            deleted = np.concatenate([self.deleted, deleted])
+        else:
+            deleted = self.deleted
+        return SegmentedStore(segments, deleted, locations)
+
+    def needs_compaction(self, spec: IndexSpec, compact_ratio: float) -> bool:
+        """Whether there's enough outside the base segment (or the base should be rebuilt as another type) to compact now."""
+        base = self.segments[0].index
+        outside_base = int(self.offsets[-1]) - base.ntotal + len(self.deleted)
+        return outside_base > compact_ratio * base.ntotal or should_rebuild(base, spec, self.ntotal)
+
+    def segments_to_merge(self, max_segments: int) -> int:
+        """How many of the newest segments merge_newest() should fold together (0 for none).
+
+        We keep every segment after the base at least twice the size of the ones after
+        it, like carries in a binary counter. A row is then merged again only a handful
+        of times before a compaction, and there are never more than a few segments to
+        search. Past max_segments, all of them are merged.
+        """
+        sizes = [segment.index.ntotal for segment in self.segments[1:]]
+        if len(self.segments) > max_segments:
+            return len(sizes)
+        count = 1
+        while count < len(sizes) and sizes[-count - 1] < 2 * sum(sizes[-count:]):
+            count += 1
+        return count if count > 1 else 0
+
+    def _live_rows(self, start: int) -> Tuple[np.ndarray, ChunkStore]:
+        """The live vectors and chunks of segments[start:], in position order."""
+        vectors, chunks = [], []
+        for segment, offset in zip(self.segments[start:], self.offsets[start:]):
+            rows = np.arange(segment.index.ntotal, dtype=np.int64)
+            live = self._live(rows + offset)
+            vectors.append(all_vectors(segment.index)[live])
+            chunks.append(segment.docstore.take(rows[live]))
+        return np.concatenate(vectors), concatenate(chunks)
+
+    def _segment(self, index, docstore: ChunkStore) -> FAISS:
+        return FAISS(self.embedding_function, index, docstore, RowIds(docstore.ids))
+
+    def merge_newest(self, count: int) -> "SegmentedStore":
+        """Folds the newest `count` segments (never the base) into one exact segment, dropping their deleted rows."""
+        start = len(self.segments) - count
+        vectors, docstore = self._live_rows(start)
+        index = faiss.IndexFlatL2(self.segments[0].index.d)
+        index.add(vectors)
+        first = self.offsets[start]
+        return SegmentedStore(self.segments[:start] + [self._segment(index, docstore)],
+                              self.deleted[self.deleted < first], self.locations[:start] + [None])
+
+    def compact(self, spec: IndexSpec, copy_base_index: Callable[[], object]) -> "SegmentedStore":
+        """Folds every live row into a single new base segment.
+
+        This is the one write that costs as much as the whole corpus, so it only runs
+        every so often (see needs_compaction). copy_base_index() must return a private,
+        writable copy of the base segment's index.
+        """
+        vectors, docstore = self._live_rows(0)
+        index = compacted_index(self.segments[0].index, spec, vectors, copy_base_index)
+        return SegmentedStore([self._segment(index, docstore)])
+
+def build_segment(embeddings, text_embeddings, metadatas: List[dict], ids: List[str]) -> FAISS:
+    """A new exact segment holding just the given chunks.
+
+    Same as FAISS.from_embeddings, but with our columnar docstore in place of
+    LangChain's dict of Documents.
+    """
+    dimension = len(text_embeddings[0][1])
+    segment = FAISS(embeddings, faiss.IndexFlatL2(dimension), ChunkStore(), {})
+    segment.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+    return segment
@@ -1,11 +1,43 @@
-from fastapi import FastAPI
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 
 from .api.endpoints import router as api_router
+from .core.services.metrics import HTTP_REQUEST_SECONDS, mark_worker_exited, server_timing_header, start_request_spans
+from .core.services.profiling import finish_profiler, start_profiler
 
-app = FastAPI(title="ReasearchGPT")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # A worker that's gone shouldn't keep adding its memory to the gauges in /metrics.
+    mark_worker_exited()
+
+app = FastAPI(title="ReasearchGPT", lifespan=lifespan)
 
 app.include_router(api_router)
 
+@app.middleware("http")
+async def record_request_timings(request: Request, call_next):
+    # Every stage timed while handling this request lands in `spans`, and goes back to
+    # the client as a Server-Timing header (browser dev tools show it next to the request).
+    spans = start_request_spans()
+    profiler = start_profiler()
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        elapsed = time.perf_counter() - start
+        if profiler is not None:
+            finish_profiler(profiler, request.method, request.url.path, elapsed)
+    # We label by route template rather than the raw path, so /jobs/<id> doesn't create
+    # a new time series for every job.
+    route = request.scope.get("route")
+    HTTP_REQUEST_SECONDS.labels(request.method, getattr(route, "path", "unmatched"), response.status_code).observe(elapsed)
+    # Streaming responses send their headers first, so for those this only covers the
+    # work done before the first byte.
+    response.headers["Server-Timing"] = server_timing_header(spans, elapsed)
+    return response
+
 @app.get("/", tags=["Root"])
 async def read_root():
-    return {"message": "Welcome to the API!"}
\ No newline at end of file
+    return {"message": "Welcome to the API!"}
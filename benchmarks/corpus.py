@@ -0,0 +1,86 @@
+"""Generates a synthetic corpus of text PDFs and scanned-looking images for the benchmarks.
+
+The corpus is built from a seeded random generator, so the same arguments always give
+byte-for-byte the same files. We write the PDFs by hand rather than pulling in a PDF
+library; a single font and plain text lines are all the extractor needs.
+"""
+import os
+import random
+from typing import List, Tuple
+
+WORDS = (
+    "research analysis market policy energy climate health education finance data model "
+    "system network growth risk cost revenue customer product design process quality "
+    "supply demand labour capital region sector report survey result method sample trend "
+    "forecast impact strategy investment regulation technology infrastructure transport "
+    "water agriculture industry service public private local global annual quarterly"
+).split()
+
+LINES_PER_PAGE = 50
+WORDS_PER_LINE = 14
+
+def _sentence(rng: random.Random) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(8, 18))]
+    return " ".join(words).capitalize() + "."
+
+def _page_lines(rng: random.Random) -> List[str]:
+    words = " ".join(_sentence(rng) for _ in range(LINES_PER_PAGE)).split()
+    lines = [" ".join(words[i:i + WORDS_PER_LINE]) for i in range(0, len(words), WORDS_PER_LINE)]
+    return lines[:LINES_PER_PAGE]
+
+def make_pdf(pages: List[List[str]]) -> bytes:
+    """Builds a minimal PDF with one Helvetica text block per page."""
+    page_count = len(pages)
+    font_obj = 3 + 2 * page_count
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{' '.join(f'{3 + 2 * i} 0 R' for i in range(page_count))}] /Count {page_count} >>"
+    ]
+    for i, lines in enumerate(pages):
+        # Our vocabulary has no parentheses or backslashes, so nothing needs escaping.
+        text = " T* ".join(f"({line}) Tj" for line in lines)
+        stream = f"BT /F1 10 Tf 13 TL 50 750 Td {text} ET"
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * i} 0 R "
+            f"/Resources << /Font << /F1 {font_obj} 0 R >> >> >>"
+        )
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref_offset = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    out += b"".join(f"{offset:010d} 00000 n \n".encode("latin-1") for offset in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode("latin-1")
+    return out
+
+def make_image(lines: List[str], path: str):
+    """Renders lines of text onto a white page, roughly what a phone scan looks like to OCR."""
+    from PIL import Image, ImageDraw
+    image = Image.new("RGB", (1240, 40 + 24 * len(lines)), "white")
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(lines):
+        draw.text((40, 20 + 24 * i), line, fill="black")
+    image.save(path)
+
+def generate_corpus(dest_dir: str, pdf_count: int, pages_per_pdf: int, image_count: int, seed: int = 0) -> Tuple[List[Tuple[str, str]], int]:
+    """Writes the corpus into dest_dir. Returns ([(file_path, filename)], total page count)."""
+    os.makedirs(dest_dir, exist_ok=True)
+    rng = random.Random(seed)
+    files = []
+    for i in range(pdf_count):
+        filename = f"report_{i:03d}.pdf"
+        path = os.path.join(dest_dir, filename)
+        with open(path, "wb") as f:
+            f.write(make_pdf([_page_lines(rng) for _ in range(pages_per_pdf)]))
+        files.append((path, filename))
+    for i in range(image_count):
+        filename = f"scan_{i:03d}.png"
+        path = os.path.join(dest_dir, filename)
+        make_image(_page_lines(rng)[:30], path)
+        files.append((path, filename))
+    return files, pdf_count * pages_per_pdf + image_count
@@ -0,0 +1,161 @@
+"""Measures how much memory each chunk costs in the docstore and the vector index.
+
+Run it from the repository root:
+
+    python -m benchmarks.docstore_memory --chunks 20000
+
+The docstore side compares LangChain's InMemoryDocstore (a dict of Document objects)
+with our columnar ChunkStore, using tracemalloc to count what each one keeps alive. It
+also saves the chunks as a snapshot and loads it back into an InMemoryVectorStore,
+which is what a server worker actually holds: the mapped columns and index cost
+nothing on the Python heap, so what's left is everything the store builds per chunk.
+The index side compares the flat float32 index with the sq_fp16 and sq8 ones, and
+reports how much of the exact top-k each reduced-precision index still finds.
+"""
+import argparse
+import gc
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--chunks", type=int, default=20000, help="Number of chunks to store.")
+    parser.add_argument("--chunk-chars", type=int, default=1000, help="Characters per chunk (the splitter's chunk_size).")
+    parser.add_argument("--chunks-per-source", type=int, default=200, help="Chunks that share one source name.")
+    parser.add_argument("--dimension", type=int, default=768, help="Embedding size for the index comparison.")
+    parser.add_argument("--index-vectors", type=int, default=5000, help="Vectors in the index comparison.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the generated text.")
+    return parser.parse_args(argv)
+
+def make_chunks(args):
+    """Yields (id, Document) pairs shaped like the ones ingestion produces."""
+    from langchain.schema import Document
+    from benchmarks.corpus import WORDS
+    rng = random.Random(args.seed)
+    for i in range(args.chunks):
+        words, length = [], 0
+        while length < args.chunk_chars:
+            words.append(rng.choice(WORDS))
+            length += len(words[-1]) + 1
+        text = " ".join(words)[:args.chunk_chars]
+        metadata = {"source": f"report_{i // args.chunks_per_source:05d}.pdf", "page": (i % args.chunks_per_source) // 4 + 1, "paragraph": i % 4 + 1}
+        doc_id = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        yield doc_id, Document(page_content=text, metadata=metadata)
+
+def retained_bytes(build) -> int:
+    """Bytes still allocated once build() has returned, counting only what its result keeps alive."""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current
+
+def measure_docstores(args) -> dict:
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from backend.app.core.services.chunk_store import ChunkStore
+
+    def build_legacy():
+        return InMemoryDocstore(dict(make_chunks(args)))
+
+    def build_columnar():
+        return ChunkStore.from_documents(dict(make_chunks(args)))
+
+    legacy = retained_bytes(build_legacy)
+    columnar = retained_bytes(build_columnar)
+    text_bytes = args.chunks * args.chunk_chars
+    return {
+        "chunks": args.chunks,
+        "text_bytes_per_chunk": args.chunk_chars,
+        "in_memory_docstore_bytes_per_chunk": round(legacy / args.chunks, 1),
+        "chunk_store_bytes_per_chunk": round(columnar / args.chunks, 1),
+        "overhead_bytes_per_chunk": {
+            "in_memory_docstore": round((legacy - text_bytes) / args.chunks, 1),
+            "chunk_store": round((columnar - text_bytes) / args.chunks, 1)
+        },
+        "reduction": round(1 - columnar / legacy, 3)
+    }
+
+def measure_loaded_store(args) -> dict:
+    import faiss
+    import numpy as np
+    from langchain_community.vectorstores import FAISS
+    from backend.app.core.services.chunk_store import ChunkStore
+    from backend.app.core.services.embeddings import get_embeddings
+    from backend.app.core.services.in_memory_store import InMemoryVectorStore
+    from backend.app.core.services.index_factory import IndexSpec
+    from backend.app.core.services.index_snapshot import save_snapshot
+    from backend.app.core.services.segments import SegmentedStore
+
+    embeddings = get_embeddings()
+    docstore = ChunkStore.from_documents(dict(make_chunks(args)))
+    # The vectors are mapped from the snapshot, so their values don't matter here.
+    index = faiss.IndexFlatL2(args.dimension)
+    index.add(np.random.default_rng(args.seed).random((len(docstore), args.dimension), dtype=np.float32))
+    ids = [doc_id.decode("utf-8") for doc_id in docstore.ids]
+    segment = FAISS(embeddings, index, docstore, dict(enumerate(ids)))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "index")
+        save_snapshot(path, SegmentedStore([segment]), embeddings.model_name)
+        del segment, index, docstore, ids
+
+        def load():
+            store = InMemoryVectorStore(path=path, index_spec=IndexSpec("flat"), name="benchmark")
+            # What a worker does on its first requests: load, list the sources, answer a query.
+            store.list_sources()
+            vector_store = store.vector_store
+            query = np.zeros((1, args.dimension), dtype=np.float32)
+            for _, position in vector_store.search(query, 5):
+                vector_store.document(position)
+            return store
+
+        loaded = retained_bytes(load)
+    return {"chunks": args.chunks, "heap_bytes_per_chunk": round(loaded / args.chunks, 1)}
+
+def measure_indexes(args) -> dict:
+    import faiss
+    import numpy as np
+    from backend.app.core.services.embedding_backends import HashingEmbeddings
+    from backend.app.core.services.index_factory import IndexSpec, build_index
+
+    index_args = argparse.Namespace(**{**vars(args), "chunks": args.index_vectors})
+    texts = [doc.page_content for _, doc in make_chunks(index_args)]
+    vectors = np.asarray(HashingEmbeddings(dimension=args.dimension).embed_documents(texts), dtype=np.float32)
+    rng = np.random.default_rng(args.seed)
+    queries = vectors[rng.choice(len(vectors), size=min(200, len(vectors)), replace=False)]
+    k = 10
+
+    results = {}
+    truth = None
+    for index_type in ("flat", "sq_fp16", "sq8"):
+        index = build_index(IndexSpec(index_type), vectors)
+        _, found = index.search(queries, k)
+        if truth is None:
+            truth = found
+        recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+        results[index_type] = {
+            "bytes_per_vector": round(faiss.serialize_index(index).nbytes / len(vectors), 1),
+            "recall_at_10_vs_flat": round(float(recall), 4)
+        }
+    return {"vectors": len(vectors), "dimension": args.dimension, "indexes": results}
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    report = {"docstore": measure_docstores(args), "loaded_store": measure_loaded_store(args), "index": measure_indexes(args)}
+    print(json.dumps(report, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
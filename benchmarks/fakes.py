@@ -0,0 +1,94 @@
+"""Offline stand-ins for the embedding and chat models, so benchmarks need no API key or network.
+
+Both are deterministic: the same input always produces the same output, so two runs
+do the same amount of work and their numbers can be compared. Each call sleeps for a
+configurable latency to stand in for the round trip to the real service.
+"""
+import asyncio
+import hashlib
+import json
+import re
+import time
+from typing import Any, List, Optional
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from backend.app.core.services.embedding_backends import HashingEmbeddings
+
+CHUNK_PATTERN = re.compile(r"\[Chunk (\d+)\] \(Document ID: (.*?)\)")
+ANSWER_SOURCE_PATTERN = re.compile(r"^From (.*?) \(", re.MULTILINE)
+
+SENTENCES = [
+    "The documents describe the approach in some detail and point to measurable results.",
+    "According to the context, the main constraint is the cost of the underlying process.",
+    "The source argues that the trend will continue unless the policy changes.",
+    "Several passages highlight the same risk, which suggests it is a recurring concern.",
+    "The text gives a concrete example and explains why it matters for the question."
+]
+
+class FakeEmbeddings(HashingEmbeddings):
+    """The hashing backend plus a fixed delay per call, like a remote embedding API."""
+    def __init__(self, latency: float = 0.0, dimension: int = 256, batch_size: int = 100):
+        super().__init__(dimension=dimension, batch_size=batch_size, num_threads=1)
+        self.latency = latency
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self.latency)
+        return super().embed_query(text)
+
+def _pick(prompt: str, count: int) -> List[str]:
+    seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16)
+    return [SENTENCES[(seed >> (4 * i)) % len(SENTENCES)] for i in range(count)]
+
+def fake_response(prompt: str) -> str:
+    """Answers any of the pipeline's prompts in the format the pipeline expects."""
+    if "Respond with ONLY" in prompt:
+        chunks = CHUNK_PATTERN.findall(prompt)
+        sources = list(dict.fromkeys(source for _, source in chunks))
+        return json.dumps({
+            "answers": [{"chunk_id": int(chunk_id), "answer": " ".join(_pick(prompt + chunk_id, 2))} for chunk_id, _ in chunks],
+            "themes": [
+                {"theme": f"Theme {i + 1}", "supporting_documents": sources[i::2], "highlight": " ".join(_pick(prompt, 3))}
+                for i in range(min(2, len(sources)))
+            ]
+        })
+    if "Identify key themes" in prompt:
+        sources = list(dict.fromkeys(ANSWER_SOURCE_PATTERN.findall(prompt)))
+        return "\n\n".join(
+            f"Theme Name: Theme {i + 1}\nSupporting Documents: {', '.join(sources[i::2])}\nHighlight: {' '.join(_pick(prompt, 3))}"
+            for i in range(min(2, len(sources)))
+        )
+    return " ".join(_pick(prompt, 2))
+
+class FakeChatModel(BaseChatModel):
+    """A chat model that waits `latency` seconds and then replies with canned, well-formed text."""
+    latency: float = 0.0
+    # When streaming, the reply is split into words and spaced this far apart.
+    stream_interval: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "benchmark-fake"
+
+    def _prompt_text(self, messages) -> str:
+        return "\n".join(str(message.content) for message in messages)
+
+    def _generate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=fake_response(self._prompt_text(messages))))])
+
+    async def _agenerate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=fake_response(self._prompt_text(messages))))])
+
+    async def _astream(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any):
+        await asyncio.sleep(self.latency)
+        words = fake_response(self._prompt_text(messages)).split(" ")
+        for i, word in enumerate(words):
+            if i and self.stream_interval:
+                await asyncio.sleep(self.stream_interval)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word if i == len(words) - 1 else word + " "))
@@ -0,0 +1,269 @@
+"""Benchmarks ingestion and querying end to end, with offline fakes standing in for Gemini.
+
+Run it from the repository root:
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json --fail-on-regression
+
+Ingestion goes through DocumentProcessor.process_and_store on a generated corpus.
+Queries go through the FastAPI app in-process (httpx's ASGI transport), so routing,
+validation and serialization are all part of what's measured. Everything runs in a
+scratch directory, so the real index and embedding cache are never touched.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# We change into a scratch directory before the app starts, and the ingestion workers
+# are spawned from there, so the repository has to be importable by absolute path.
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+# The real key is never used, but the app's settings refuse to load without one.
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+
+# For each metric we compare against the baseline, whether a bigger number is better.
+METRIC_DIRECTIONS = {
+    "pages_per_sec": "higher",
+    "chunks_per_sec": "higher",
+    "throughput_rps": "higher",
+    "seconds": "lower",
+    "peak_rss_mb": "lower",
+    "peak_rss_workers_mb": "lower",
+    "latency_ms_p50": "lower",
+    "latency_ms_p95": "lower",
+    "latency_ms_p99": "lower"
+}
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark ingestion and query latency with offline model stand-ins.")
+    parser.add_argument("--pdfs", type=int, default=8, help="Number of generated PDFs.")
+    parser.add_argument("--pages", type=int, default=10, help="Pages per generated PDF.")
+    parser.add_argument("--images", type=int, default=0, help="Number of generated images (needs tesseract installed).")
+    parser.add_argument("--workers", type=int, default=0, help="INGEST_MAX_WORKERS for the run (0 = one per core).")
+    parser.add_argument("--embed-latency-ms", type=float, default=50.0, help="Simulated latency per embedding call.")
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0, help="Simulated latency per LLM call.")
+    parser.add_argument("--llm-rps", type=float, default=1000.0, help="LLM_REQUESTS_PER_SECOND for the run.")
+    parser.add_argument("--dimension", type=int, default=256, help="Embedding size of the fake embedding model.")
+    parser.add_argument("--mode", choices=["per_document", "batched"], default="per_document", help="Query pipeline mode.")
+    parser.add_argument("--queries", type=int, default=40, help="Queries sent at each concurrency level.")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated concurrency levels.")
+    parser.add_argument("--query-cache", action="store_true", help="Leave the query result cache on (off by default).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the generated corpus.")
+    parser.add_argument("--output", help="Where to write the results as JSON.")
+    parser.add_argument("--baseline", help="A results file to compare this run against.")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Relative change that counts as a regression.")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 if any metric regressed.")
+    parser.add_argument("--keep-data", action="store_true", help="Keep the scratch directory instead of deleting it.")
+    return parser.parse_args(argv)
+
+def percentile(values, pct):
+    """Nearest-rank percentile, so the number reported is always a latency we actually saw."""
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, int(math.ceil(pct / 100 * len(ordered))) - 1))]
+
+def peak_rss_mb(who=resource.RUSAGE_SELF) -> float:
+    # ru_maxrss is in kilobytes on Linux but bytes on macOS.
+    peak = resource.getrusage(who).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def configure_app(args):
+    """Points the app at the offline fakes. Has to run before the API module is imported."""
+    from backend.app.config import settings
+    from backend.app.core.services.embeddings import get_embeddings
+    from benchmarks.fakes import FakeChatModel, FakeEmbeddings
+
+    settings.EMBEDDING_BACKEND = "hashing"
+    settings.EMBEDDING_DIMENSION = args.dimension
+    settings.INGEST_MAX_WORKERS = args.workers
+    settings.LLM_REQUESTS_PER_SECOND = args.llm_rps
+    settings.LLM_TOKENS_PER_MINUTE = 10 ** 12
+    if not args.query_cache:
+        settings.QUERY_CACHE_MAX_ENTRIES = 0
+    # The fake keeps the hashing backend's model id, so snapshots and the cache agree.
+    get_embeddings().base = FakeEmbeddings(latency=args.embed_latency_ms / 1000, dimension=args.dimension)
+
+    from backend.app.api import endpoints
+    from backend.app.main import app
+    endpoints.query_processor.llm = FakeChatModel(latency=args.llm_latency_ms / 1000)
+    return app, endpoints
+
+def run_ingestion(doc_processor, files, page_count) -> dict:
+    stages = {}
+    def progress(filename, stage, chunks=None, error=None):
+        stages[filename] = stage
+
+    start = time.perf_counter()
+    result = doc_processor.process_and_store(files, progress=progress) or {}
+    elapsed = time.perf_counter() - start
+    if doc_processor._executor is not None:
+        doc_processor._executor.shutdown()
+        doc_processor._executor = None
+    chunks = result.get("chunks_added", 0)
+    return {
+        "files": len(files),
+        "failed_files": sum(1 for stage in stages.values() if stage in ("failed", "skipped")),
+        "pages": page_count,
+        "chunks": chunks,
+        "seconds": round(elapsed, 3),
+        "pages_per_sec": round(page_count / elapsed, 2),
+        "chunks_per_sec": round(chunks / elapsed, 2),
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_rss_workers_mb": peak_rss_mb(resource.RUSAGE_CHILDREN)
+    }
+
+def make_questions(count: int, offset: int):
+    from benchmarks.corpus import WORDS
+    # Every question is different, so nothing is served from a cache by accident.
+    return [
+        f"What does the corpus say about {WORDS[(offset + i) % len(WORDS)]} and {WORDS[(offset + 7 * i + 3) % len(WORDS)]} (question {offset + i})?"
+        for i in range(count)
+    ]
+
+async def run_query_level(app, questions, concurrency: int, mode: str) -> dict:
+    import httpx
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark", timeout=None) as client:
+        async def one(question):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post("/query/", json={"question": question, "mode": mode})
+                latencies.append((time.perf_counter() - start) * 1000)
+                if response.status_code != 200:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(question) for question in questions))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(questions),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(questions) / elapsed, 2),
+        "latency_ms_p50": round(percentile(latencies, 50), 2),
+        "latency_ms_p95": round(percentile(latencies, 95), 2),
+        "latency_ms_p99": round(percentile(latencies, 99), 2)
+    }
+
+def flatten_metrics(results: dict) -> dict:
+    """Picks the comparable numbers out of a results file, keyed like 'query.c4.latency_ms_p95'."""
+    metrics = {f"ingestion.{name}": value for name, value in results.get("ingestion", {}).items() if name in METRIC_DIRECTIONS}
+    for level in results.get("query", []):
+        for name, value in level.items():
+            if name in METRIC_DIRECTIONS:
+                metrics[f"query.c{level['concurrency']}.{name}"] = value
+    return metrics
+
+def compare(results: dict, baseline: dict, tolerance: float):
+    """Returns one row per metric both runs have, flagging changes worse than the tolerance."""
+    current, previous = flatten_metrics(results), flatten_metrics(baseline)
+    rows = []
+    for key, value in current.items():
+        if key not in previous or not previous[key]:
+            continue
+        change = (value - previous[key]) / previous[key]
+        worse = -change if METRIC_DIRECTIONS[key.rsplit(".", 1)[1]] == "higher" else change
+        rows.append({
+            "metric": key,
+            "baseline": previous[key],
+            "current": value,
+            "change_pct": round(change * 100, 1),
+            "regression": worse > tolerance
+        })
+    return rows
+
+def print_report(results: dict, comparison=None):
+    ingestion = results["ingestion"]
+    print(f"\nIngestion: {ingestion['files']} files, {ingestion['pages']} pages, {ingestion['chunks']} chunks in {ingestion['seconds']}s")
+    print(f"  {ingestion['pages_per_sec']} pages/s, {ingestion['chunks_per_sec']} chunks/s, "
+          f"peak RSS {ingestion['peak_rss_mb']} MB (workers {ingestion['peak_rss_workers_mb']} MB)")
+    print("\nQueries:")
+    for level in results["query"]:
+        print(f"  c={level['concurrency']:<3} {level['throughput_rps']:>7} req/s  p50 {level['latency_ms_p50']:>9} ms  "
+              f"p95 {level['latency_ms_p95']:>9} ms  p99 {level['latency_ms_p99']:>9} ms  errors {level['errors']}")
+    if comparison:
+        print("\nAgainst the baseline:")
+        for row in comparison:
+            flag = "  REGRESSION" if row["regression"] else ""
+            print(f"  {row['metric']:<32} {row['baseline']:>10} -> {row['current']:>10} ({row['change_pct']:+.1f}%){flag}")
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    output = os.path.abspath(args.output) if args.output else None
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    if args.images and not shutil.which("tesseract"):
+        print("tesseract isn't installed, so the generated images would all fail OCR; skipping them.")
+        args.images = 0
+
+    # The app keeps its index and caches under a relative data directory, so running from
+    # a scratch directory gives every benchmark a clean, isolated store.
+    work_dir = tempfile.mkdtemp(prefix="researchgpt-bench-")
+    original_dir = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        from benchmarks.corpus import generate_corpus
+        files, page_count = generate_corpus(os.path.join(work_dir, "corpus"), args.pdfs, args.pages, args.images, seed=args.seed)
+        app, endpoints = configure_app(args)
+
+        print(f"Ingesting {len(files)} files ({page_count} pages)...")
+        ingestion = run_ingestion(endpoints.doc_processor, files, page_count)
+
+        query_levels = []
+        levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+        # One untimed query first, so loading the index isn't billed to the first level.
+        asyncio.run(run_query_level(app, make_questions(1, 10 ** 6), 1, args.mode))
+        for index, concurrency in enumerate(levels):
+            print(f"Running {args.queries} queries at concurrency {concurrency}...")
+            questions = make_questions(args.queries, index * args.queries)
+            query_levels.append(asyncio.run(run_query_level(app, questions, concurrency, args.mode)))
+    finally:
+        os.chdir(original_dir)
+        if not args.keep_data:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    results = {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "fail_on_regression", "keep_data")}
+        },
+        "ingestion": ingestion,
+        "query": query_levels
+    }
+
+    comparison = None
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        if baseline.get("meta", {}).get("config") != results["meta"]["config"]:
+            print("Note: the baseline was recorded with different settings, so differences may not be like for like.")
+        comparison = compare(results, baseline, args.tolerance)
+        results["comparison"] = {"baseline": baseline_path, "tolerance": args.tolerance, "metrics": comparison}
+
+    print_report(results, comparison)
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nWrote results to {output}")
+    if args.fail_on_regression and comparison and any(row["regression"] for row in comparison):
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
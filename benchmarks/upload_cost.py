@@ -0,0 +1,112 @@
+"""Measures what one small upload costs as the corpus it lands in grows.
+
+Run it from the repository root:
+
+    python -m benchmarks.upload_cost --corpus-sizes 2000,8000,32000
+
+For each corpus size we index that many chunks, then time a series of small uploads
+into it and count the bytes each one writes to the snapshot directory. An upload
+that only adds a segment should cost the same whatever the corpus size; the
+occasional compaction is the one write that grows with it, and the report shows both
+along with the cost per upload once compactions are spread over the uploads.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+
+from langchain_core.embeddings import Embeddings
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--corpus-sizes", default="2000,8000,32000", help="Comma-separated chunk counts to upload into.")
+    parser.add_argument("--uploads", type=int, default=40, help="Small uploads timed at each corpus size.")
+    parser.add_argument("--upload-chunks", type=int, default=20, help="Chunks per small upload.")
+    parser.add_argument("--chunk-chars", type=int, default=1000, help="Characters per chunk.")
+    parser.add_argument("--dimension", type=int, default=768, help="Embedding size.")
+    parser.add_argument("--index-type", default="flat", help="FAISS_INDEX_TYPE for the store.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the generated text.")
+    return parser.parse_args(argv)
+
+def make_docs(args, count, source, seed):
+    from benchmarks.docstore_memory import make_chunks
+    chunk_args = argparse.Namespace(chunks=count, chunk_chars=args.chunk_chars, chunks_per_source=count, seed=seed)
+    return [doc.copy(update={"metadata": {**doc.metadata, "source": source}}) for _, doc in make_chunks(chunk_args)]
+
+def directory_bytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+def measure(args, corpus_size: int, embeddings) -> dict:
+    from backend.app.core.services.in_memory_store import InMemoryVectorStore
+    from backend.app.core.services.index_factory import IndexSpec
+
+    scratch = tempfile.mkdtemp(prefix="upload-cost-")
+    try:
+        path = os.path.join(scratch, "index")
+        store = InMemoryVectorStore(path=path, index_spec=IndexSpec(args.index_type))
+        store.add_documents(make_docs(args, corpus_size, "corpus.pdf", args.seed), embeddings)
+        corpus_bytes = directory_bytes(path)
+
+        appends, compactions = [], []
+        for i in range(args.uploads):
+            docs = make_docs(args, args.upload_chunks, f"upload-{i}.pdf", args.seed + i + 1)
+            # Embedding isn't what we're measuring, so it happens before the clock starts.
+            vectors = embeddings.embed_documents([doc.page_content for doc in docs])
+            start = time.perf_counter()
+            store.add_documents(docs, _Precomputed(embeddings, vectors))
+            elapsed = time.perf_counter() - start
+            written = directory_bytes(os.path.join(path, f"v{store.snapshot_version:06d}"))
+            # A compaction leaves a single segment behind; any other upload leaves more.
+            (compactions if len(store.vector_store.segments) == 1 else appends).append((elapsed, written))
+        total = sum(elapsed for elapsed, _ in appends + compactions)
+        return {
+            "corpus_chunks": corpus_size,
+            "corpus_bytes": corpus_bytes,
+            "append_ms_p50": round(statistics.median(e for e, _ in appends) * 1000, 2) if appends else None,
+            "append_bytes_written_p50": int(statistics.median(w for _, w in appends)) if appends else None,
+            "compactions": len(compactions),
+            "compaction_ms_mean": round(statistics.mean(e for e, _ in compactions) * 1000, 2) if compactions else None,
+            "compaction_bytes_written_mean": int(statistics.mean(w for _, w in compactions)) if compactions else None,
+            "amortized_ms_per_upload": round(total / args.uploads * 1000, 2)
+        }
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+class _Precomputed(Embeddings):
+    """Hands back vectors we already computed, so an upload's timing leaves out the embedding."""
+    def __init__(self, embeddings, vectors):
+        self.embeddings = embeddings
+        self.vectors = vectors
+
+    def embed_documents(self, texts):
+        return self.vectors[:len(texts)]
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    os.environ["EMBEDDING_BACKEND"] = "hashing"
+    os.environ["EMBEDDING_DIMENSION"] = str(args.dimension)
+    from backend.app.core.services.embedding_backends import HashingEmbeddings
+    embeddings = HashingEmbeddings(dimension=args.dimension)
+    report = {
+        "upload_chunks": args.upload_chunks,
+        "uploads": args.uploads,
+        "index_type": args.index_type,
+        "sizes": [measure(args, int(size), embeddings) for size in args.corpus_sizes.split(",")]
+    }
+    print(json.dumps(report, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,5 @@
+import json
+import time
 import streamlit as st
 import requests
 import pandas as pd
@@ -48,9 +50,73 @@ def display_results(results_data):
         # We're reordering the columns here to ensure a consistent display format.    
         df = df[["Document ID", "Extracted Answer", "Citation"]]
         st.dataframe(df, use_container_width=True, hide_index=True)
+        # The backend drops repeated and weak chunks before answering, and tells us how much that saved.
+        retrieval = results_data.get("retrieval") or {}
+        if retrieval.get("llm_calls_saved"):
+            st.caption(f"Answered from {retrieval['chunks_used']} of {retrieval['candidates']} retrieved chunks, saving {retrieval['llm_calls_saved']} LLM call(s).")
     else:
         st.info("No specific answers could be extracted from the documents for this query.")
         
+def wait_for_job(job_id, poll_interval=1.0):
+    """Polls an ingestion job until it finishes, showing each file's progress as it goes."""
+    status_box = st.empty()
+    while True:
+        response = requests.get(f"{API_URL}/jobs/{job_id}")
+        response.raise_for_status()
+        job = response.json()
+        lines = [f"📄 {name}: {info['stage']} ({info['chunks']} chunks)" for name, info in job["files"].items()]
+        status_box.markdown("  \n".join(lines))
+        if job["status"] in ("completed", "failed"):
+            status_box.empty()
+            return job
+        time.sleep(poll_interval)
+
+def stream_results(question, collection="default"):
+    """
+    Reads the newline-delimited JSON events from /query/stream and redraws the page as
+    they arrive: answers fill in the table as each one is ready, the theme text appears
+    while it's being written, and the final event swaps in the fully formatted view.
+    """
+    results_container = st.empty()
+    answers = {}
+    theme_text = ""
+
+    def render_partial():
+        with results_container.container():
+            st.subheader("Synthesized Theme Answer")
+            if theme_text:
+                st.markdown(theme_text)
+            else:
+                st.info("Waiting for the individual answers before identifying themes...")
+            st.markdown("---")
+            st.subheader("Individual Document Answers")
+            # Answers can finish in any order, so we sort them back into retrieval order.
+            rows = [answers[index] for index in sorted(answers)]
+            df = pd.DataFrame(rows, columns=["Document ID", "Extracted Answer", "Citation"])
+            st.dataframe(df, use_container_width=True, hide_index=True)
+
+    with st.spinner("Thinking..."):
+        response = requests.post(f"{API_URL}/query/stream", json={"question": question, "collection": collection}, stream=True)
+        response.raise_for_status()
+        for line in response.iter_lines(decode_unicode=True):
+            if not line:
+                continue
+            event = json.loads(line)
+            if event["event"] == "answer":
+                answers[event["index"]] = event["answer"]
+                render_partial()
+            elif event["event"] == "theme_token":
+                theme_text += event["text"]
+                render_partial()
+            elif event["event"] == "result":
+                results = {key: value for key, value in event.items() if key != "event"}
+                with results_container.container():
+                    display_results(results)
+                return results
+            elif event["event"] == "error":
+                raise RuntimeError(event["detail"])
+    raise RuntimeError("The response ended before the final result arrived.")
+
 # Main App Logic
 
 load_css("style.css")
@@ -70,6 +136,8 @@ chat_col, knowledge_col = st.columns([2, 1])
 
 with knowledge_col:
     st.subheader("Knowledge Base")
+    # Each team can keep its documents in its own collection; uploads and questions both use this one.
+    collection = st.text_input("Collection", value="default")
     uploaded_files = st.file_uploader(
         "Upload documents", 
         accept_multiple_files=True,
@@ -84,13 +152,21 @@ with knowledge_col:
                 files_for_api = [("files", (file.name, file.getvalue(), file.type)) for file in uploaded_files]
                 try:
                     # This is where we make the actual call to our backend's /upload/ endpoint.
-                    response = requests.post(f"{API_URL}/upload/", files=files_for_api)
+                    # The backend answers right away with a job ID and does the processing in the background.
+                    response = requests.post(f"{API_URL}/upload/", files=files_for_api, params={"collection": collection})
                     response.raise_for_status()
-                    # To avoid duplicates, we'll keep a unique, sorted list of file names.
-                    current_files = [file.name for file in uploaded_files]
-                    st.session_state.uploaded_files_list.extend(current_files)
-                    st.session_state.uploaded_files_list = sorted(list(set(st.session_state.uploaded_files_list)))
-                    st.success(response.json().get("message", "Success!"))
+                    job = wait_for_job(response.json()["job_id"])
+                    if job["status"] == "completed":
+                        # To avoid duplicates, we'll keep a unique, sorted list of file names.
+                        current_files = [name for name, info in job["files"].items() if info["stage"] == "indexed"]
+                        st.session_state.uploaded_files_list.extend(current_files)
+                        st.session_state.uploaded_files_list = sorted(list(set(st.session_state.uploaded_files_list)))
+                        st.success(f"Successfully processed {len(current_files)} documents.")
+                    else:
+                        st.error(f"Processing failed: {job.get('error') or 'Unknown error.'}")
+                    for name, info in job["files"].items():
+                        if info["error"]:
+                            st.warning(f"{name}: {info['error']}")
                 except requests.exceptions.RequestException as e:
                     st.error(f"Error connecting to backend: {e}")
         else:
@@ -124,17 +200,14 @@ with chat_col:
         
         # Now, display the assistant's response.
         with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                try:
-                    # Make the call to our backend's /query/ endpoint with the user's question.
-                    response = requests.post(f"{API_URL}/query/", json={"question": prompt})
-                    response.raise_for_status()
-                    results = response.json()
-                    
-                    # Save the AI's full JSON response to the chat history and display it.
-                    st.session_state.messages.append({"role": "assistant", "content": results})
-                    display_results(results)
-                except requests.exceptions.RequestException as e:
-                    st.error(f"Error connecting to backend: {e}")
-                except Exception as e:
-                    st.error(f"An error occurred: {e}")
\ No newline at end of file
+            try:
+                # We call the streaming variant of the /query/ endpoint, so the answers show
+                # up one by one instead of all at once after the whole pipeline is done.
+                results = stream_results(prompt, collection)
+                
+                # Save the AI's full JSON response to the chat history.
+                st.session_state.messages.append({"role": "assistant", "content": results})
+            except requests.exceptions.RequestException as e:
+                st.error(f"Error connecting to backend: {e}")
+            except Exception as e:
+                st.error(f"An error occurred: {e}")
\ No newline at end of file
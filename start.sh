@@ -1,5 +1,11 @@
 echo "Starting FastAPI backend server..."
-uvicorn backend.app.main:app --host 0.0.0.0 --port 8000 &
+# The app reads WEB_CONCURRENCY too, to split its per-worker pools and budgets.
+export WEB_CONCURRENCY=${WEB_CONCURRENCY:-2}
+# The workers write their metrics here so /metrics can add them up. Values left from
+# the last run would be counted again, so we clear them first.
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/researchgpt-metrics}
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR" && rm -f "$PROMETHEUS_MULTIPROC_DIR"/*.db
+uvicorn backend.app.main:app --host 0.0.0.0 --port 8000 --workers $WEB_CONCURRENCY &
 
 # Start the Streamlit frontend server in the foreground
 echo "Starting Streamlit frontend..."
@@ -0,0 +1,37 @@
+"""Shared setup for the test suite.
+
+Run it from the repository root with `python -m pytest tests`. Everything runs offline:
+the hashing embedding backend stands in for Gemini, and each test gets a scratch
+working directory, so the real index and caches under backend/data are never touched.
+"""
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+# The settings are read once, on first import, so these have to be in place before
+# anything under backend/ is imported. The key is never used.
+os.environ["GOOGLE_API_KEY"] = "test"
+os.environ["EMBEDDING_BACKEND"] = "hashing"
+os.environ["EMBEDDING_DIMENSION"] = "64"
+os.environ["WEB_CONCURRENCY"] = "1"
+
+import pytest
+
+@pytest.fixture(autouse=True)
+def scratch_dir(tmp_path, monkeypatch):
+    """Runs each test from its own empty directory, since the app's data paths are relative."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+@pytest.fixture
+def embeddings(tmp_path):
+    """The shared embedding model, with its disk cache moved into this test's directory."""
+    from backend.app.core.services.embedding_cache import EmbeddingCache
+    from backend.app.core.services.embeddings import get_embeddings
+    model = get_embeddings()
+    original = model.cache
+    model.cache = EmbeddingCache(str(tmp_path / "embedding_cache.sqlite3"), 64 * 1024 * 1024)
+    yield model
+    model.cache = original
@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+from langchain.schema import Document
+from backend.app.core.services.chunk_store import ChunkStore, RowIds, load_chunk_store, save_chunk_store
+
+def make_docs(count, source="report.pdf", start=0):
+    return {
+        f"id-{i}": Document(page_content=f"chunk {i} text ü", metadata={"source": source, "page": i // 2 + 1, "paragraph": i % 2 + 1})
+        for i in range(start, start + count)
+    }
+
+def test_search_rebuilds_documents_with_their_metadata():
+    store = ChunkStore.from_documents(make_docs(3))
+    doc = store.search("id-2")
+    assert doc.page_content == "chunk 2 text ü"
+    assert doc.metadata == {"source": "report.pdf", "page": 2, "paragraph": 1}
+    assert store.search("nope") == "ID nope not found."
+
+def test_unusual_metadata_goes_in_the_side_table():
+    store = ChunkStore.from_documents({
+        "a": Document(page_content="x", metadata={"source": "s.pdf", "page": "iv", "language": "fr"}),
+        "b": Document(page_content="y", metadata={"page": True})
+    })
+    assert store.search("a").metadata == {"source": "s.pdf", "page": "iv", "language": "fr"}
+    assert store.search("b").metadata == {"page": True}
+    assert store.ids_by_source() == {"s.pdf": ["a"], "N/A": ["b"]}
+
+def test_sources_are_grouped_from_the_columns():
+    store = ChunkStore.from_documents({
+        **make_docs(3, source="a.pdf"),
+        "odd": Document(page_content="z", metadata={"source": 7}),
+        "none": Document(page_content="w", metadata={}),
+        **make_docs(2, source="b.pdf", start=3)
+    })
+    assert store.source_counts(np.arange(len(store))) == {"a.pdf": 3, "b.pdf": 2, 7: 1, "N/A": 1}
+    assert store.source_counts(np.array([0, 4, 5])) == {"a.pdf": 1, "N/A": 1, "b.pdf": 1}
+    assert store.rows_of_source("b.pdf").tolist() == [5, 6]
+    assert store.rows_of_source("N/A").tolist() == [4]
+    assert store.rows_of_source("missing.pdf").tolist() == []
+
+def test_row_ids_decode_on_demand():
+    store = ChunkStore.from_documents(make_docs(3))
+    ids = RowIds(store.ids)
+    assert ids[2] == "id-2" and len(ids) == 3 and list(ids.values()) == ["id-0", "id-1", "id-2"]
+    with pytest.raises(KeyError):
+        ids[-1]
+
+def test_add_rejects_ids_it_already_has():
+    store = ChunkStore.from_documents(make_docs(2))
+    with pytest.raises(ValueError):
+        store.add(make_docs(1))
+
+def test_rows_raises_for_missing_ids():
+    store = ChunkStore.from_documents(make_docs(3))
+    assert store.rows(["id-2", "id-0"]).tolist() == [2, 0]
+    with pytest.raises(KeyError):
+        store.rows(["id-1", "missing"])
+
+def test_take_and_delete_keep_the_right_rows():
+    store = ChunkStore.from_documents(make_docs(4))
+    reordered = store.take(np.array([3, 1]))
+    assert [reordered.search(doc_id).page_content for doc_id in ("id-3", "id-1")] == ["chunk 3 text ü", "chunk 1 text ü"]
+    assert len(reordered) == 2
+
+    copy = store.copy()
+    store.delete(["id-1", "id-2"])
+    assert len(store) == 2
+    assert store.search("id-3").page_content == "chunk 3 text ü"
+    assert store.search("id-1") == "ID id-1 not found."
+    # The copy shares arrays with the original, but deleting never changes them in place.
+    assert len(copy) == 4 and copy.search("id-1").page_content == "chunk 1 text ü"
+    with pytest.raises(ValueError):
+        store.delete(["id-1"])
+
+def test_save_and_load_round_trip(tmp_path):
+    store = ChunkStore.from_documents(make_docs(3))
+    store.add({"odd": Document(page_content="other", metadata={"source": "b.pdf", "tag": 1})})
+    save_chunk_store(store, str(tmp_path))
+    loaded = load_chunk_store(str(tmp_path))
+    assert isinstance(loaded.text, np.memmap)
+    assert len(loaded) == 4
+    for doc_id in ("id-0", "id-2", "odd"):
+        assert loaded.search(doc_id) == store.search(doc_id)
+    # A mapped store can still be changed; the change builds new arrays in memory.
+    loaded.add(make_docs(1, start=10))
+    assert loaded.search("id-10").page_content == "chunk 10 text ü"
+
+def test_works_as_the_faiss_docstore(embeddings):
+    import faiss
+    from langchain_community.vectorstores import FAISS
+    docs = make_docs(4)
+    texts = [doc.page_content for doc in docs.values()]
+    store = FAISS(embeddings, faiss.IndexFlatL2(64), ChunkStore(), {})
+    store.add_embeddings(list(zip(texts, embeddings.embed_documents(texts))), metadatas=[doc.metadata for doc in docs.values()], ids=list(docs))
+    assert store.similarity_search("chunk 2 text", k=1)[0].page_content == "chunk 2 text ü"
+
+    store.delete(["id-0", "id-2"])
+    assert store.index.ntotal == 2
+    assert sorted(store.index_to_docstore_id.values()) == ["id-1", "id-3"]
+    found = store.similarity_search("chunk 3 text", k=2)
+    assert {doc.page_content for doc in found} == {"chunk 1 text ü", "chunk 3 text ü"}
+
+def test_snapshot_refuses_ids_missing_from_the_docstore(embeddings, tmp_path):
+    import faiss
+    from langchain_community.vectorstores import FAISS
+    from backend.app.core.services.index_snapshot import read_current_version, save_snapshot
+    from backend.app.core.services.segments import SegmentedStore
+    docs = make_docs(2)
+    texts = [doc.page_content for doc in docs.values()]
+    store = FAISS(embeddings, faiss.IndexFlatL2(64), ChunkStore(), {})
+    store.add_embeddings(list(zip(texts, embeddings.embed_documents(texts))), metadatas=[doc.metadata for doc in docs.values()], ids=list(docs))
+    store.index_to_docstore_id[1] = "not-in-the-docstore"
+    with pytest.raises(KeyError):
+        save_snapshot(str(tmp_path / "index"), SegmentedStore([store]), "test")
+    assert read_current_version(str(tmp_path / "index")) == 0
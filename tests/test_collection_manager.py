@@ -0,0 +1,40 @@
+import pytest
+from langchain.schema import Document
+from backend.app.core.services.collection_manager import CollectionManager, CollectionNotFound
+
+def make_docs(source, count):
+    return [Document(page_content=f"{source} paragraph {i}", metadata={"source": source, "page": 1, "paragraph": i}) for i in range(count)]
+
+@pytest.fixture
+def manager(tmp_path):
+    return CollectionManager(base_path=str(tmp_path / "collections"), default_path=str(tmp_path / "index"))
+
+def test_least_recently_used_collections_are_unloaded(manager, embeddings):
+    for name in ("a", "b"):
+        manager.get(name, create=True).add_documents(make_docs(f"{name}.pdf", 50), embeddings)
+    a, b = manager.get("a"), manager.get("b")
+    # Room for either collection, but not both.
+    manager.memory_budget_bytes = max(a.resident_bytes, b.resident_bytes) + 1
+    assert manager.enforce_budget(keep="b") == ["a"]
+    assert not a.is_resident and b.is_resident
+
+    # Using "a" again loads it back from its snapshot and pushes "b" out instead.
+    assert manager.get("a").list_sources() == [{"source": "a.pdf", "chunks": 50}]
+    assert a.is_resident and not b.is_resident
+    report = manager.memory_report()
+    assert report["bytes_resident"] <= manager.memory_budget_bytes
+    assert {entry["collection"]: entry["vectors"] for entry in report["collections"]} == {"a": 50, "b": 50, "default": 0}
+
+def test_the_collection_in_use_is_never_evicted(manager, embeddings):
+    store = manager.get("big", create=True)
+    store.add_documents(make_docs("big.pdf", 20), embeddings)
+    manager.memory_budget_bytes = 1
+    assert manager.enforce_budget(keep="big") == []
+    assert store.is_resident
+
+def test_unknown_collections_are_not_created_by_reads(manager):
+    with pytest.raises(CollectionNotFound):
+        manager.get("typo")
+    with pytest.raises(ValueError):
+        manager.get("../escape", create=True)
+    assert manager.list_names() == ["default"]
@@ -0,0 +1,34 @@
+import sqlite3
+from backend.app.core.services.embedding_cache import EmbeddingCache
+
+def summed_bytes(path):
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+def test_the_running_total_follows_inserts_replacements_and_evictions(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    # Each vector is 4 floats, 16 bytes.
+    cache = EmbeddingCache(path, max_bytes=100)
+    cache.put_many("m", {"a": [1.0] * 4, "b": [2.0] * 4})
+    assert cache.total_bytes() == 32
+    # Replacing a key swaps its size rather than adding to it.
+    cache.put_many("m", {"a": [3.0] * 8})
+    assert cache.total_bytes() == 48 == summed_bytes(path)
+    assert cache.get_many("m", ["a"]) == {"a": [3.0] * 8}
+
+    # A second worker's connection sees and updates the same total, and going over
+    # the budget evicts the least recently used entries down to 90% of it.
+    other = EmbeddingCache(path, max_bytes=100)
+    other.put_many("m", {"c": [4.0] * 8, "d": [5.0] * 8})
+    assert cache.total_bytes() == other.total_bytes() == summed_bytes(path) == 64
+    assert sorted(cache.get_many("m", ["a", "b", "c", "d"])) == ["c", "d"]
+
+def test_a_cache_from_before_the_total_is_summed_once(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE embeddings (model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL,"
+            " last_access REAL NOT NULL, PRIMARY KEY (model, text_hash))"
+        )
+        conn.execute("INSERT INTO embeddings VALUES ('m', 'a', ?, 0)", (b"\0" * 40,))
+    assert EmbeddingCache(path, max_bytes=1000).total_bytes() == 40
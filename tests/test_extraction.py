@@ -0,0 +1,31 @@
+import pytesseract
+from backend.app.core.services import extraction, ocr
+from backend.app.core.services.extraction import extract_text_from_pdf_pages
+from backend.app.core.services.ocr import OcrOptions
+from benchmarks.corpus import make_pdf
+
+TEXT_PAGE = ["The quarterly report covers revenue, costs and the outlook for next year."]
+
+def write_pdf(tmp_path, pages):
+    path = tmp_path / "doc.pdf"
+    path.write_bytes(make_pdf(pages))
+    return str(path)
+
+def test_blank_pages_without_tesseract_keep_their_text(tmp_path, monkeypatch):
+    monkeypatch.setattr(ocr, "_tesseract_available", {})
+    path = write_pdf(tmp_path, [TEXT_PAGE, []])
+    options = OcrOptions(tesseract_cmd=str(tmp_path / "no-such-tesseract"))
+    docs = extract_text_from_pdf_pages(path, "doc.pdf", 0, 2, options)
+    assert [doc.metadata["page"] for doc in docs] == [1]
+    assert "quarterly report" in docs[0].page_content
+    # The binary is only looked for once per process.
+    assert ocr._tesseract_available == {options.tesseract_cmd: False}
+
+def test_an_ocr_failure_on_one_page_keeps_the_rest_of_the_pdf(tmp_path, monkeypatch):
+    def fail(*args):
+        raise pytesseract.TesseractError(1, "bad image")
+    monkeypatch.setattr(extraction, "tesseract_available", lambda options: True)
+    monkeypatch.setattr(extraction, "ocr_image", fail)
+    path = write_pdf(tmp_path, [[], TEXT_PAGE, ["short"]])
+    docs = extract_text_from_pdf_pages(path, "doc.pdf", 0, 3, OcrOptions())
+    assert [(doc.metadata["page"], doc.page_content) for doc in docs] == [(2, TEXT_PAGE[0]), (3, "short")]
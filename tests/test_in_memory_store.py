@@ -0,0 +1,147 @@
+import json
+import multiprocessing
+import os
+import faiss
+import numpy as np
+import pytest
+from langchain.schema import Document
+from backend.app.core.services import index_snapshot
+from backend.app.core.services.embeddings import get_embeddings
+from backend.app.core.services.chunk_store import RowIds
+from backend.app.core.services.in_memory_store import InMemoryVectorStore, chunk_id
+from backend.app.core.services.index_factory import IndexSpec, index_type_of
+from backend.app.core.services.index_snapshot import read_current_version
+
+def make_docs(source, texts):
+    return [Document(page_content=text, metadata={"source": source, "page": 1, "paragraph": i}) for i, text in enumerate(texts)]
+
+def new_store(path):
+    return InMemoryVectorStore(path=str(path), index_spec=IndexSpec("flat"))
+
+def upload_in_another_process(path, source, texts):
+    # Runs in a spawned child, so it has its own store, embeddings and snapshot mapping.
+    InMemoryVectorStore(path=path, index_spec=IndexSpec("flat")).add_documents(make_docs(source, texts), get_embeddings())
+
+@pytest.fixture
+def store(tmp_path):
+    return new_store(tmp_path / "index")
+
+def test_repeated_chunks_are_skipped(store, embeddings):
+    # Ids hash the metadata as well as the text, so the repeat has to be the same paragraph.
+    docs = make_docs("a.pdf", ["alpha one", "alpha two"])
+    docs.append(Document(page_content="alpha one", metadata=dict(docs[0].metadata)))
+    assert store.add_documents(docs, embeddings) == (2, 1, 0)
+    # Nothing new, so nothing is published and the version stays put.
+    version = store.snapshot_version
+    assert store.add_documents(make_docs("a.pdf", ["alpha one", "alpha two"]), embeddings) == (0, 2, 0)
+    assert store.snapshot_version == version
+    assert store.list_sources() == [{"source": "a.pdf", "chunks": 2}]
+
+def test_replacing_a_source_keeps_unchanged_chunks(store, embeddings):
+    store.add_documents(make_docs("a.pdf", ["kept", "dropped one", "dropped two"]), embeddings)
+    store.add_documents(make_docs("b.pdf", ["other"]), embeddings)
+    revised = make_docs("a.pdf", ["kept", "brand new"])
+    # The first chunk is identical in both versions, so only the second is embedded.
+    assert store.add_documents(revised, embeddings, replace_sources=["a.pdf"]) == (1, 1, 2)
+    assert store.list_sources() == [{"source": "a.pdf", "chunks": 2}, {"source": "b.pdf", "chunks": 1}]
+    vector_store = store.vector_store
+    texts = {vector_store.document(int(position)).page_content for position in vector_store.live_vectors()[0]}
+    assert texts == {"kept", "brand new", "other"}
+
+def test_a_loaded_store_keeps_no_python_objects_per_chunk(store, embeddings, tmp_path):
+    store.add_documents(make_docs("a.pdf", ["one", "two"]) + make_docs("b.pdf", ["three"]), embeddings)
+    reloaded = new_store(tmp_path / "index")
+    segment = reloaded.vector_store.segments[0]
+    assert isinstance(segment.index_to_docstore_id, RowIds)
+    assert reloaded.list_sources() == [{"source": "a.pdf", "chunks": 2}, {"source": "b.pdf", "chunks": 1}]
+    # Dedupe and replace work from the mapped id column too.
+    assert reloaded.add_documents(make_docs("a.pdf", ["one", "new"]), embeddings, replace_sources=["a.pdf"]) == (1, 1, 1)
+    assert sorted(reloaded.vector_store.ids_of_source("a.pdf")) == sorted(chunk_id(doc) for doc in make_docs("a.pdf", ["one", "new"]))
+
+def test_deleting_a_source(store, embeddings, tmp_path):
+    store.add_documents(make_docs("a.pdf", ["one", "two"]) + make_docs("b.pdf", ["three"]), embeddings)
+    assert store.delete_source("a.pdf") == 2
+    assert store.delete_source("a.pdf") == 0
+    assert store.list_sources() == [{"source": "b.pdf", "chunks": 1}]
+    # Deleting the last document publishes an empty snapshot rather than reviving an old one.
+    assert store.delete_source("b.pdf") == 1
+    assert store.vector_store is None
+    reloaded = new_store(tmp_path / "index")
+    assert reloaded.vector_store is None and reloaded.corpus_version == store.snapshot_version
+
+def test_a_failed_save_leaves_the_published_snapshot_alone(store, embeddings, tmp_path, monkeypatch):
+    store.add_documents(make_docs("a.pdf", ["one", "two"]), embeddings)
+    version = store.snapshot_version
+
+    def broken_write(segment, directory):
+        os.makedirs(directory)
+        raise OSError("disk full")
+    monkeypatch.setattr(index_snapshot, "_write_segment", broken_write)
+    with pytest.raises(OSError):
+        store.add_documents(make_docs("b.pdf", ["three"]), embeddings)
+    assert read_current_version(str(tmp_path / "index")) == version
+    assert not [name for name in os.listdir(tmp_path / "index") if name.startswith(".tmp")]
+    # We keep serving what's on disk.
+    assert store.snapshot_version == version
+    assert store.list_sources() == [{"source": "a.pdf", "chunks": 2}]
+
+def test_loading_skips_a_snapshot_without_a_manifest(store, embeddings, tmp_path):
+    store.add_documents(make_docs("a.pdf", ["one", "two"]), embeddings)
+    # A version directory whose manifest never made it to disk, with CURRENT pointing at it.
+    os.makedirs(tmp_path / "index" / "v000099")
+    with open(tmp_path / "index" / "CURRENT", "w") as f:
+        json.dump({"version": 99}, f)
+    reloaded = new_store(tmp_path / "index")
+    assert reloaded.corpus_version == store.snapshot_version
+    assert reloaded.list_sources() == [{"source": "a.pdf", "chunks": 2}]
+
+@pytest.mark.parametrize("spec, flag", [
+    (IndexSpec("flat"), faiss.IO_FLAG_MMAP_IFC),
+    (IndexSpec("sq8", train_min_vectors=50), faiss.IO_FLAG_MMAP_IFC),
+    (IndexSpec("hnsw", hnsw_m=8), faiss.IO_FLAG_MMAP_IFC),
+    (IndexSpec("ivf_flat", nlist=2, train_min_vectors=50), faiss.IO_FLAG_MMAP)
+])
+def test_snapshots_are_mapped_rather_than_read(spec, flag, embeddings, tmp_path, monkeypatch):
+    writer = InMemoryVectorStore(path=str(tmp_path / "index"), index_spec=spec)
+    writer.add_documents(make_docs("a.pdf", [f"alpha {i}" for i in range(60)]) + make_docs("b.pdf", [f"beta {i}" for i in range(30)]), embeddings)
+    flags = []
+    read_index = faiss.read_index
+
+    def recording_read_index(path, *args):
+        flags.append(args[0] if args else 0)
+        return read_index(path, *args)
+    monkeypatch.setattr(faiss, "read_index", recording_read_index)
+    # IO_FLAG_MMAP still copies flat, SQ and HNSW codes into each process's memory.
+    reader = InMemoryVectorStore(path=str(tmp_path / "index"), index_spec=spec)
+    assert index_type_of(reader.vector_store.segments[0].index) == spec.index_type
+    assert flags == [flag]
+    # The memory budget only charges what this worker holds beyond the shared mapping.
+    assert 0 < reader.resident_bytes < reader.vector_store.ntotal * 64 * 4 // 10
+    query = np.asarray([embeddings.embed_query("alpha 7")], dtype=np.float32)
+    assert len(reader.vector_store.search(query, 3)) == 3
+
+    # Compacting a mapped base works from a private copy and never touches the mapping.
+    assert reader.delete_source("b.pdf") == 30
+    assert len(reader.vector_store.segments) == 1 and reader.vector_store.ntotal == 60
+    assert index_type_of(reader.vector_store.segments[0].index) == spec.index_type
+
+def test_a_store_without_a_snapshot_counts_its_vectors(embeddings):
+    store = InMemoryVectorStore(path=None, index_spec=IndexSpec("flat"))
+    store.add_documents(make_docs("a.pdf", ["one", "two", "three"]), embeddings)
+    assert store.resident_bytes >= 3 * 64 * 4
+
+def test_an_upload_from_another_process_shows_up_here(store, embeddings, tmp_path):
+    store.add_documents(make_docs("a.pdf", ["one", "two"]), embeddings)
+    version = store.snapshot_version
+    child = multiprocessing.get_context("spawn").Process(
+        target=upload_in_another_process, args=(str(tmp_path / "index"), "b.pdf", ["three", "four"])
+    )
+    child.start()
+    child.join(120)
+    assert child.exitcode == 0
+    # The next access notices CURRENT moved on and maps the child's snapshot.
+    assert store.corpus_version > version
+    assert store.list_sources() == [{"source": "a.pdf", "chunks": 2}, {"source": "b.pdf", "chunks": 2}]
+    # And a write here builds on it instead of publishing over it.
+    store.add_documents(make_docs("c.pdf", ["five"]), embeddings)
+    assert [entry["source"] for entry in new_store(tmp_path / "index").list_sources()] == ["a.pdf", "b.pdf", "c.pdf"]
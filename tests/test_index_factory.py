@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+from langchain.schema import Document
+from backend.app.core.services.chunk_store import ChunkStore
+from backend.app.core.services.embedding_cache import EmbeddingCache
+from backend.app.core.services.index_factory import INDEX_TYPES, IndexSpec, build_index, recall_report
+from backend.app.core.services.segments import SegmentedStore
+
+def make_store(embeddings, index_type, count=400):
+    from langchain_community.vectorstores import FAISS
+    texts = [f"chunk {i} about topic {i % 13} and area {i % 5}" for i in range(count)]
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    index = build_index(IndexSpec(index_type, nlist=8, pq_m=8, pq_nbits=4, hnsw_m=8), vectors)
+    docs = {str(i): Document(page_content=text) for i, text in enumerate(texts)}
+    return SegmentedStore([FAISS(embeddings, index, ChunkStore.from_documents(docs), {i: str(i) for i in range(count)})])
+
+@pytest.mark.parametrize("index_type", INDEX_TYPES)
+def test_recall_report_never_re_embeds_the_corpus(embeddings, index_type):
+    store = make_store(embeddings, index_type)
+    before = embeddings.stats()
+    report = recall_report(store, IndexSpec(index_type, nlist=8), k=5, sample_size=20)
+    assert embeddings.stats() == before
+    assert report["index_type"] == index_type and report["queries"] == 20
+    assert all(0 <= setting["recall_at_k"] <= 1 for setting in report["settings"])
+    if index_type in ("flat", "ivf_flat"):
+        # The widest setting searches everything; only ties in distance can differ.
+        assert report["settings"][-1]["recall_at_k"] >= 0.95
+
+@pytest.mark.parametrize("index_type", ["ivf_pq", "sq8", "sq_fp16"])
+def test_lossy_indexes_query_with_the_original_embeddings(embeddings, index_type, tmp_path):
+    store = make_store(embeddings, index_type)
+    # Building the store cached every chunk's embedding, so every sampled query is an original.
+    report = recall_report(store, IndexSpec(index_type, nlist=8), k=5, sample_size=20)
+    assert report["query_vectors"] == {"original": 20, "decoded": 0}
+
+    # With a cold cache we fall back to what the index decodes, still without embedding anything.
+    embeddings.cache = EmbeddingCache(str(tmp_path / "cold.sqlite3"), 64 * 1024 * 1024)
+    before = embeddings.stats()
+    report = recall_report(store, IndexSpec(index_type, nlist=8), k=5, sample_size=20)
+    assert report["query_vectors"] == {"original": 0, "decoded": 20}
+    assert embeddings.stats() == before
@@ -0,0 +1,33 @@
+import os
+import subprocess
+import sys
+from prometheus_client.parser import text_string_to_metric_families
+from tests.conftest import REPO_ROOT
+
+def run_worker(metrics_dir, code):
+    # prometheus_client picks its storage when it's first imported, so each "worker" has to be a fresh process.
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(metrics_dir))
+    result = subprocess.run(
+        [sys.executable, "-c", "from backend.app.core.services import metrics\n" + code],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True, timeout=120
+    )
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+def samples(text):
+    return {(sample.name, tuple(sorted(sample.labels.items()))): sample.value
+            for family in text_string_to_metric_families(text) for sample in family.samples}
+
+def test_a_scrape_covers_every_worker(tmp_path):
+    run_worker(tmp_path, "metrics.LLM_CALLS.labels('answer', 'ok').inc(3)\n"
+                         "metrics.COLLECTION_RESIDENT_BYTES.labels('default').set(100)\n"
+                         "metrics.INDEX_VECTORS.labels('default').set(10)\n"
+                         "metrics.mark_worker_exited()")
+    run_worker(tmp_path, "metrics.LLM_CALLS.labels('answer', 'ok').inc(2)\n"
+                         "metrics.COLLECTION_RESIDENT_BYTES.labels('default').set(40)\n"
+                         "metrics.INDEX_VECTORS.labels('default').set(12)")
+    scraped = samples(run_worker(tmp_path, "print(metrics.render_metrics()[0].decode())"))
+    assert scraped[("researchgpt_llm_calls_total", (("outcome", "ok"), ("stage", "answer")))] == 5
+    # The first worker has exited, so its memory no longer counts, but the newest index size does.
+    assert scraped[("researchgpt_collection_resident_bytes", (("collection", "default"),))] == 40
+    assert scraped[("researchgpt_index_vectors", (("collection", "default"),))] == 12
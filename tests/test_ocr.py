@@ -0,0 +1,66 @@
+from contextlib import nullcontext
+import pytesseract
+import pytest
+from PIL import Image
+from backend.app.core.services import ocr
+from backend.app.core.services.ocr import OcrCache, OcrOptions, image_content_key, ocr_image
+
+def no_timer(stage):
+    return nullcontext()
+
+@pytest.fixture
+def tesseract_calls(monkeypatch):
+    # There's no Tesseract binary in the test environment, and we only care how often it's run.
+    calls = []
+
+    def fake_image_to_string(image):
+        calls.append(image.size)
+        return f"text from a {image.width}x{image.height} image"
+    monkeypatch.setattr(pytesseract, "image_to_string", fake_image_to_string)
+    monkeypatch.setattr(ocr, "_caches", {})
+    return calls
+
+def test_seen_images_skip_tesseract(tmp_path, tesseract_calls):
+    image = Image.new("RGB", (400, 300), "white")
+    options = OcrOptions(cache_path=str(tmp_path / "ocr.sqlite3"))
+    loads = []
+
+    def load():
+        loads.append(1)
+        return image
+    key = image_content_key(image)
+    first = ocr_image(load, options, key, no_timer)
+    assert first == ("text from a 400x300 image", False)
+    assert ocr_image(load, options, key, no_timer) == (first[0], True)
+    assert len(tesseract_calls) == 1 and len(loads) == 1
+
+    # A different resolution cap can read differently, so it doesn't share entries.
+    assert ocr_image(load, OcrOptions(max_dpi=10, cache_path=options.cache_path), key, no_timer)[1] is False
+    assert len(tesseract_calls) == 2
+
+def test_without_a_cache_path_every_image_is_read(tesseract_calls):
+    image = Image.new("L", (100, 100))
+    for _ in range(2):
+        assert ocr_image(lambda: image, OcrOptions(), "same", no_timer)[1] is False
+    assert len(tesseract_calls) == 2
+
+def test_the_cache_evicts_the_least_recently_used_text(tmp_path):
+    cache = OcrCache(str(tmp_path / "ocr.sqlite3"), max_bytes=250)
+    cache.put("a", "x" * 100)
+    cache.put("b", "y" * 100)
+    assert cache.get("a") == "x" * 100
+    cache.put("c", "z" * 100)
+    # "b" was used longest ago; "a" was just read.
+    assert cache.get("b") is None
+    assert cache.get("a") == "x" * 100 and cache.get("c") == "z" * 100
+
+def test_the_cache_size_is_shared_between_workers(tmp_path):
+    path = str(tmp_path / "ocr.sqlite3")
+    cache, other = OcrCache(path, max_bytes=250), OcrCache(path, max_bytes=250)
+    cache.put("a", "x" * 100)
+    # Replacing text swaps its size rather than adding to it.
+    other.put("a", "x" * 50)
+    other.put("b", "y" * 100)
+    assert cache.total_bytes() == other.total_bytes() == 150
+    cache.put("c", "z" * 120)
+    assert other.total_bytes() == 220 and other.get("a") is None
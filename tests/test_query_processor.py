@@ -0,0 +1,215 @@
+import asyncio
+import json
+import re
+import pytest
+from google.api_core.exceptions import ResourceExhausted
+from langchain.schema import Document
+from backend.app.core.services import queryprocessor
+from backend.app.core.services.collection_manager import CollectionManager
+from backend.app.core.services.query_cache import QueryResultCache
+from backend.app.core.services.queryprocessor import ANSWER_ERROR_TEXT, QueryProcessor
+from backend.app.core.services.rate_limiter import TokenBucketRateLimiter
+from benchmarks.fakes import FakeChatModel
+
+DOCS = [Document(page_content=f"Chunk {i} about solar panel costs.", metadata={"source": f"doc{i}.pdf", "page": 1, "paragraph": 1})
+        for i in (1, 2)]
+
+class CountingChatModel(FakeChatModel):
+    """The benchmark fake, counting how many calls reach it."""
+    calls: int = 0
+
+    async def _agenerate(self, *args, **kwargs):
+        self.calls += 1
+        return await super()._agenerate(*args, **kwargs)
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    manager = CollectionManager(base_path=str(tmp_path / "collections"), default_path=str(tmp_path / "index"))
+    monkeypatch.setattr(queryprocessor, "collection_manager", manager)
+    return manager
+
+@pytest.fixture
+def processor(embeddings):
+    processor = QueryProcessor()
+    processor.llm = CountingChatModel()
+    processor.rate_limiter = TokenBucketRateLimiter(requests_per_second=1000, tokens_per_minute=10_000_000)
+    return processor
+
+def batched_json(chunk_ids):
+    return json.dumps({
+        "answers": [{"chunk_id": i, "answer": f" answer {i} "} for i in chunk_ids],
+        "themes": [{"theme": "Cost", "supporting_documents": ["doc1.pdf", "doc1.pdf", "doc2.pdf"], "highlight": "Costs fell."}]
+    })
+
+def test_the_cache_is_dropped_when_the_corpus_changes():
+    cache = QueryResultCache(max_entries=10, ttl_seconds=60)
+    cache.put("What changed?", 1, {"answer": "a"}, collection="one")
+    cache.put("What changed?", 1, {"answer": "b"}, collection="two")
+    assert cache.get("  what CHANGED ", 1, collection="one") == {"answer": "a"}
+    assert cache.get("What changed?", 2, collection="one") is None
+    # Only the collection that changed loses its entries.
+    assert cache.get("What changed?", 1, collection="two") == {"answer": "b"}
+    # A result computed before the change landed isn't stored.
+    cache.put("What changed?", 1, {"answer": "stale"}, collection="one")
+    assert cache.get("What changed?", 2, collection="one") is None
+
+def test_a_lookup_with_an_older_version_leaves_newer_entries_alone():
+    cache = QueryResultCache(max_entries=10, ttl_seconds=60)
+    cache.put("What changed?", 2, {"answer": "new"}, collection="one")
+    # A worker still on version 1 misses, rather than clearing what version 2 cached.
+    assert cache.get("What changed?", 1, collection="one") is None
+    assert cache.get("What changed?", 2, collection="one") == {"answer": "new"}
+
+def test_repeat_queries_are_answered_from_the_cache_until_an_upload(processor, manager, embeddings):
+    store = manager.get("default", create=True)
+    store.add_documents(DOCS, embeddings)
+    first = asyncio.run(processor.handle_query_async("How much do solar panels cost?", mode="batched"))
+    calls = processor.llm.calls
+    assert calls == 1 and first["individual_answers"]
+    assert asyncio.run(processor.handle_query_async("how much do solar panels cost", mode="batched")) == first
+    assert processor.llm.calls == calls
+
+    store.add_documents([Document(page_content="Panel prices dropped again.", metadata={"source": "doc3.pdf"})], embeddings)
+    asyncio.run(processor.handle_query_async("How much do solar panels cost?", mode="batched"))
+    assert processor.llm.calls == calls + 1
+
+def test_batched_output_is_parsed_and_checked(processor):
+    result = processor._parse_batched_output(f"```json\n{batched_json([2, 1])}\n```", DOCS)
+    assert [answer["Extracted Answer"] for answer in result["individual_answers"]] == ["answer 1", "answer 2"]
+    assert result["synthesized_themes"] == [{"Theme": "Cost", "Supporting Documents": "doc1.pdf, doc2.pdf", "Highlight": "Costs fell."}]
+    for bad in ("not json", batched_json([1]), batched_json([1, 2, 3])):
+        with pytest.raises(ValueError):
+            processor._parse_batched_output(bad, DOCS)
+
+def test_invalid_batched_output_gets_one_repair(processor, monkeypatch):
+    stages = []
+
+    async def scripted(prompt, inputs, output_tokens=0, stage="answer"):
+        stages.append(stage)
+        return batched_json([1]) if stage == "batched" else batched_json([1, 2])
+    monkeypatch.setattr(processor, "_ainvoke_chain", scripted)
+    result, cacheable = asyncio.run(processor._run_batched_async("cost?", DOCS))
+    assert stages == ["batched", "repair"] and cacheable
+    assert len(result["individual_answers"]) == 2
+
+    async def always_broken(prompt, inputs, output_tokens=0, stage="answer"):
+        return "{}"
+    monkeypatch.setattr(processor, "_ainvoke_chain", always_broken)
+    result, cacheable = asyncio.run(processor._run_batched_async("cost?", DOCS))
+    # A failed repair is an error answer, and never cached.
+    assert not cacheable
+    assert [answer["Extracted Answer"] for answer in result["individual_answers"]] == [ANSWER_ERROR_TEXT] * 2
+
+class ShuffledChatModel(FakeChatModel):
+    """Answers later documents first, and records how many calls were in flight at once."""
+    in_flight: int = 0
+    peak: int = 0
+
+    async def _agenerate(self, messages, *args, **kwargs):
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        match = re.search(r"Chunk (\d+) about", self._prompt_text(messages))
+        await asyncio.sleep(0.01 * (10 - int(match.group(1))) if match else 0)
+        self.in_flight -= 1
+        return await super()._agenerate(messages, *args, **kwargs)
+
+class QuotaChatModel(FakeChatModel):
+    """Rejects the first `failures` calls with the error Gemini sends when a quota runs out."""
+    failures: int = 0
+    calls: int = 0
+
+    def _check_quota(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ResourceExhausted("Quota exceeded for generate_content requests")
+
+    async def _agenerate(self, *args, **kwargs):
+        self._check_quota()
+        return await super()._agenerate(*args, **kwargs)
+
+    async def _astream(self, *args, **kwargs):
+        self._check_quota()
+        async for chunk in super()._astream(*args, **kwargs):
+            yield chunk
+
+def test_answers_keep_the_retrieval_order_and_the_concurrency_cap(processor):
+    docs = [Document(page_content=f"Chunk {i} about solar panel costs.", metadata={"source": f"doc{i}.pdf"}) for i in range(1, 8)]
+    processor.llm = ShuffledChatModel()
+    processor.max_concurrency = 3
+    result, cacheable = asyncio.run(processor._run_per_document_async("cost?", docs))
+    assert cacheable
+    assert [answer["Document ID"] for answer in result["individual_answers"]] == [doc.metadata["source"] for doc in docs]
+    # The theme call runs on its own after the answers, so the cap is what bounds the peak.
+    assert processor.llm.peak == 3
+
+def test_quota_errors_are_retried_with_backoff(processor):
+    processor.retry_base_delay = 0
+    processor.llm = QuotaChatModel(failures=2)
+    assert asyncio.run(processor._ainvoke_chain(processor.answer_prompt, {"context": "c", "question": "q"}))
+    assert processor.llm.calls == 3
+
+    async def stream():
+        return [text async for text in processor._astream_chain(processor.theme_prompt, {"answers_context": "\nFrom a.pdf (Page 1, Para 1): x"})]
+    processor.llm = QuotaChatModel(failures=1)
+    assert "".join(asyncio.run(stream()))
+    assert processor.llm.calls == 2
+
+    # Past max_retries, the quota error reaches the caller.
+    processor.max_retries = 1
+    processor.llm = QuotaChatModel(failures=5)
+    with pytest.raises(ResourceExhausted):
+        asyncio.run(processor._ainvoke_chain(processor.answer_prompt, {"context": "c", "question": "q"}))
+    assert processor.llm.calls == 2
+
+def test_other_errors_are_not_retried(processor, monkeypatch):
+    processor.retry_base_delay = 0
+    processor.llm = QuotaChatModel(failures=1)
+    monkeypatch.setattr(queryprocessor, "is_quota_error", lambda error: False)
+    with pytest.raises(ResourceExhausted):
+        asyncio.run(processor._ainvoke_chain(processor.answer_prompt, {"context": "c", "question": "q"}))
+    assert processor.llm.calls == 1
+
+def stream_events(processor, question, mode):
+    async def collect():
+        return [event async for event in processor.stream_query(question, mode=mode)]
+    events = asyncio.run(collect())
+    # The endpoint sends each event as one line of JSON.
+    assert all("\n" not in json.dumps(event) for event in events)
+    return events
+
+def test_streamed_answers_carry_their_retrieval_rank(processor, manager, embeddings):
+    docs = [Document(page_content=f"Chunk {i} about solar panel costs.", metadata={"source": f"doc{i}.pdf", "page": 1, "paragraph": 1})
+            for i in range(1, 6)]
+    manager.get("default", create=True).add_documents(docs, embeddings)
+    processor.llm = ShuffledChatModel()
+    events = stream_events(processor, "How much do solar panels cost?", "per_document")
+    kinds = [event["event"] for event in events]
+    assert kinds[-1] == "result" and kinds.count("result") == 1
+    # Every answer comes before the theme text, and the theme text before the result.
+    assert kinds == sorted(kinds, key=["answer", "theme_token", "result"].index) and "theme_token" in kinds
+    result = events[-1]
+    answers = [event for event in events if event["event"] == "answer"]
+    assert sorted(event["index"] for event in answers) == list(range(len(result["individual_answers"])))
+    for event in answers:
+        assert result["individual_answers"][event["index"]] == event["answer"]
+    assert result["synthesized_themes"]
+
+    # The repeat comes from the cache: the same answers in order, then the result, with no model calls.
+    processor.llm = CountingChatModel()
+    repeat = stream_events(processor, "How much do solar panels cost?", "per_document")
+    assert processor.llm.calls == 0
+    assert [(event["event"], event.get("index")) for event in repeat] == (
+        [("answer", i) for i in range(len(answers))] + [("result", None)])
+    assert repeat[-1] == result
+
+def test_the_batched_stream_still_sends_each_answer(processor, manager, embeddings):
+    manager.get("default", create=True).add_documents(DOCS, embeddings)
+    for _ in range(2):
+        events = stream_events(processor, "How much do solar panels cost?", "batched")
+        result = events[-1]
+        assert result["event"] == "result" and result["individual_answers"]
+        assert [event["event"] for event in events[:-1]] == ["answer"] * len(result["individual_answers"])
+        assert [event["answer"] for event in events[:-1]] == result["individual_answers"]
+        assert [event["index"] for event in events[:-1]] == list(range(len(result["individual_answers"])))
+    # The second stream was served from the cache.
+    assert processor.llm.calls == 1
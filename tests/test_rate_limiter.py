@@ -0,0 +1,36 @@
+import asyncio
+import time
+from backend.app.core.services.rate_limiter import TokenBucketRateLimiter, is_quota_error
+from google.api_core.exceptions import InvalidArgument, ResourceExhausted
+
+async def acquire_all(limiter, count, tokens):
+    for _ in range(count):
+        await limiter.acquire_async(tokens)
+
+def timed_acquire(limiter, count, tokens=0):
+    start = time.monotonic()
+    asyncio.run(acquire_all(limiter, count, tokens))
+    return time.monotonic() - start
+
+def test_a_zero_limit_means_unlimited():
+    assert timed_acquire(TokenBucketRateLimiter(requests_per_second=0, tokens_per_minute=0), 1000, tokens=10_000) < 0.5
+    # Either limit can be off on its own.
+    assert timed_acquire(TokenBucketRateLimiter(requests_per_second=0, tokens_per_minute=6000), 10, tokens=10) < 0.5
+    assert timed_acquire(TokenBucketRateLimiter(requests_per_second=1000, tokens_per_minute=0), 10, tokens=10_000) < 0.5
+
+def test_the_tighter_limit_wins():
+    # 20 requests a second: a burst of 20 goes straight through, the next 5 take about a quarter second.
+    assert timed_acquire(TokenBucketRateLimiter(requests_per_second=20, tokens_per_minute=0), 20) < 0.1
+    limiter = TokenBucketRateLimiter(requests_per_second=20, tokens_per_minute=0)
+    assert 0.2 < timed_acquire(limiter, 25) < 0.6
+    # 600 tokens a minute is 10 a second, so 5 more tokens past the bucket take about half a second.
+    limiter = TokenBucketRateLimiter(requests_per_second=1000, tokens_per_minute=600)
+    assert 0.4 < timed_acquire(limiter, 121, tokens=5) < 0.9
+
+def test_a_request_bigger_than_the_bucket_still_goes_out():
+    assert timed_acquire(TokenBucketRateLimiter(requests_per_second=1000, tokens_per_minute=60), 1, tokens=1_000_000) < 0.1
+
+def test_quota_errors_are_recognised():
+    assert is_quota_error(ResourceExhausted("Quota exceeded"))
+    assert is_quota_error(RuntimeError("HTTP 429 Too Many Requests"))
+    assert not is_quota_error(InvalidArgument("bad request"))
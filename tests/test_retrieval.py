@@ -0,0 +1,108 @@
+import numpy as np
+from langchain.schema import Document
+from backend.app.core.services.retrieval import RetrievalOptions, _merge_adjacent, _stitch, candidate_vectors, refine
+
+QUESTION = np.array([1.0, 0.0, 0.0, 0.0])
+
+def doc(text, page=1, paragraph=1, source="a.pdf"):
+    return Document(page_content=text, metadata={"source": source, "page": page, "paragraph": paragraph})
+
+def options(**overrides):
+    values = dict(max_k=5, min_k=1, relative_cutoff=0.0, duplicate_threshold=1.0, mmr_lambda=0.0, merge_adjacent=False)
+    values.update(overrides)
+    return RetrievalOptions(**values)
+
+def test_relative_cutoff_drops_weak_matches_but_keeps_min_k():
+    docs = [doc("best", paragraph=1), doc("close", paragraph=3), doc("weak", paragraph=5)]
+    vectors = np.array([[1.0, 0.0, 0, 0], [0.9, 0.3, 0, 0], [0.2, 1.0, 0, 0]])
+    kept, report = refine(docs, vectors, QUESTION, options(relative_cutoff=0.7))
+    assert [d.page_content for d in kept] == ["best", "close"]
+    assert report["below_cutoff"] == 1
+
+    kept, _ = refine(docs, vectors, QUESTION, options(relative_cutoff=0.99, min_k=2))
+    assert [d.page_content for d in kept] == ["best", "close"]
+
+def test_near_duplicates_of_better_ranked_chunks_are_dropped():
+    docs = [doc("first", paragraph=1), doc("copy", paragraph=3), doc("other", paragraph=5)]
+    vectors = np.array([[1.0, 0.1, 0, 0], [1.0, 0.11, 0, 0], [0.7, 0.7, 0, 0]])
+    kept, report = refine(docs, vectors, QUESTION, options(duplicate_threshold=0.95))
+    assert [d.page_content for d in kept] == ["first", "other"]
+    assert report["near_duplicates"] == 1
+
+def test_max_k_keeps_the_best_ranked():
+    docs = [doc(str(i), paragraph=2 * i) for i in range(4)]
+    vectors = np.eye(4)[[0, 0, 0, 0]] + np.eye(4)[[1, 2, 3, 1]] * 0.1
+    kept, report = refine(docs, vectors, QUESTION, options(max_k=2))
+    assert [d.page_content for d in kept] == ["0", "1"]
+    assert report["not_selected"] == 2 and report["chunks_used"] == 2
+
+def test_mmr_prefers_diverse_chunks_and_keeps_relevance_order():
+    docs = [doc("top", paragraph=1), doc("top again", paragraph=3), doc("different", paragraph=5)]
+    vectors = np.array([[1.0, 0.2, 0, 0], [1.0, 0.25, 0, 0], [0.8, 0, 0.6, 0]])
+    kept, _ = refine(docs, vectors, QUESTION, options(max_k=2))
+    assert [d.page_content for d in kept] == ["top", "top again"]
+    kept, _ = refine(docs, vectors, QUESTION, options(max_k=2, mmr_lambda=0.5))
+    # MMR picks "different" over the near-copy, and the result stays in rank order.
+    assert [d.page_content for d in kept] == ["top", "different"]
+
+def test_adjacent_paragraphs_are_merged_into_a_range():
+    docs = [
+        doc("para two ends with shared words", paragraph=2),
+        doc("other page", page=2, paragraph=3),
+        doc("para one leads into para two", paragraph=1),
+        doc("shared words and para three goes on", paragraph=3),
+        doc("para one of another file", paragraph=2, source="b.pdf")
+    ]
+    merged, absorbed = _merge_adjacent(docs)
+    assert absorbed == 2
+    assert [d.metadata["paragraph"] for d in merged] == ["1-3", 3, 2]
+    assert merged[0].metadata["page"] == 1 and merged[0].metadata["source"] == "a.pdf"
+    assert merged[0].page_content.startswith("para one leads into para two")
+    assert "shared words and para three" in merged[0].page_content
+    assert merged[0].page_content.count("shared words") == 1
+
+def test_stitch_drops_the_overlap_between_chunks():
+    assert _stitch("alpha beta gamma", "beta gamma delta") == "alpha beta gamma delta"
+    assert _stitch("no overlap", "here") == "no overlap\nhere"
+
+def test_empty_results():
+    kept, report = refine([], np.zeros((0, 4)), QUESTION, options())
+    assert kept == [] and report["chunks_used"] == 0
+
+def test_ivf_candidates_come_from_the_index_not_the_embedding_model(embeddings):
+    import faiss
+    from langchain_community.vectorstores import FAISS
+    from backend.app.core.services.chunk_store import ChunkStore
+    from backend.app.core.services.index_factory import IndexSpec, build_index
+    from backend.app.core.services.segments import SegmentedStore
+
+    texts = [f"chunk number {i} about topic {i % 7}" for i in range(200)]
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    index = build_index(IndexSpec("ivf_flat", nlist=4), vectors)
+    docs = {str(i): Document(page_content=text) for i, text in enumerate(texts)}
+    store = SegmentedStore([FAISS(embeddings, index, ChunkStore.from_documents(docs), {i: str(i) for i in range(len(texts))})])
+
+    before = embeddings.stats()
+    found = candidate_vectors(store, [3, 150], [docs["3"], docs["150"]])
+    assert embeddings.stats() == before
+    np.testing.assert_allclose(found, vectors[[3, 150]], atol=1e-6)
+
+def test_ivf_snapshots_without_a_direct_map_get_one_on_load(embeddings, tmp_path):
+    import faiss
+    from langchain_community.vectorstores import FAISS
+    from backend.app.core.services.chunk_store import ChunkStore
+    from backend.app.core.services.index_snapshot import load_snapshot, save_snapshot
+    from backend.app.core.services.segments import SegmentedStore
+
+    texts = [f"chunk number {i} about topic {i % 7}" for i in range(200)]
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    # Built the way older releases did it, with no direct map.
+    index = faiss.index_factory(vectors.shape[1], "IVF4,Flat")
+    index.train(vectors)
+    index.add(vectors)
+    docs = {str(i): Document(page_content=text) for i, text in enumerate(texts)}
+    store = SegmentedStore([FAISS(embeddings, index, ChunkStore.from_documents(docs), {i: str(i) for i in range(len(texts))})])
+    save_snapshot(str(tmp_path / "index"), store, embeddings.model_name)
+
+    loaded, _ = load_snapshot(str(tmp_path / "index"), embeddings)
+    np.testing.assert_allclose(loaded.segments[0].index.reconstruct(42), vectors[42], atol=1e-6)
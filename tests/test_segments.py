@@ -0,0 +1,112 @@
+import os
+import faiss
+import numpy as np
+import pytest
+from langchain.schema import Document
+from backend.app.core.services.in_memory_store import InMemoryVectorStore
+from backend.app.core.services.index_factory import IndexSpec, index_type_of
+
+def make_docs(source, count, words="about"):
+    return [Document(page_content=f"{source} paragraph {i} {words} item {i * 7919 % 1000}", metadata={"source": source, "page": 1, "paragraph": i})
+            for i in range(count)]
+
+def directory_bytes(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+def exact_top_k(store, query, k):
+    positions, vectors = store.live_vectors()
+    distances = ((vectors - query) ** 2).sum(axis=1)
+    return set(positions[np.argsort(distances, kind="stable")[:k]].tolist())
+
+@pytest.fixture
+def store(tmp_path):
+    return InMemoryVectorStore(path=str(tmp_path / "index"), index_spec=IndexSpec("flat"), max_segments=8, compact_ratio=0.25)
+
+def test_an_upload_writes_only_its_own_chunks(store, embeddings, tmp_path, monkeypatch):
+    store.add_documents(make_docs("big.pdf", 2000), embeddings)
+    base_bytes = directory_bytes(tmp_path / "index")
+
+    def no_clone(index):
+        raise AssertionError("an upload shouldn't copy the existing index")
+    monkeypatch.setattr(faiss, "clone_index", no_clone)
+    for i in range(3):
+        store.add_documents(make_docs(f"small-{i}.pdf", 10), embeddings)
+        written = directory_bytes(tmp_path / "index" / f"v{store.snapshot_version:06d}")
+        assert written < base_bytes / 50
+    # The first two small segments were merged into one twice the size of the third.
+    assert [segment.index.ntotal for segment in store.vector_store.segments] == [2000, 20, 10]
+    assert store.vector_store.ntotal == 2030
+
+def test_deletes_only_record_positions_until_compaction(store, embeddings, tmp_path):
+    store.add_documents(make_docs("big.pdf", 400) + make_docs("a.pdf", 20) + make_docs("b.pdf", 120), embeddings)
+    assert store.delete_source("a.pdf") == 20
+    assert len(store.vector_store.deleted) == 20 and len(store.vector_store.segments) == 1
+    assert not os.path.exists(tmp_path / "index" / f"v{store.snapshot_version:06d}" / "segment-0")
+
+    # 20 + 120 deleted rows pass a quarter of the 540 in the base, so this one compacts.
+    assert store.delete_source("b.pdf") == 120
+    assert len(store.vector_store.deleted) == 0 and store.vector_store.ntotal == 400
+    assert [entry["source"] for entry in store.list_sources()] == ["big.pdf"]
+
+def test_search_across_segments_skips_deleted_rows(embeddings, tmp_path):
+    store = InMemoryVectorStore(path=str(tmp_path / "index"), index_spec=IndexSpec("flat"), compact_ratio=2.0)
+    store.add_documents(make_docs("big.pdf", 300), embeddings)
+    store.add_documents(make_docs("new.pdf", 20), embeddings)
+    # The ten revised chunks go in a segment of their own, and big.pdf's old ones are all marked deleted.
+    store.add_documents(make_docs("big.pdf", 10, words="revised"), embeddings, replace_sources=["big.pdf"])
+    store.delete_source("new.pdf")
+    vector_store = store.vector_store
+    assert len(vector_store.segments) == 3 and len(vector_store.deleted) == 320 and vector_store.ntotal == 10
+
+    for text in ("new.pdf paragraph 3 about item", "big.pdf paragraph 4 revised item", "big.pdf paragraph 250 about"):
+        query = np.asarray([embeddings.embed_query(text)], dtype=np.float32)
+        hits = vector_store.search(query, 5)
+        assert {position for _, position in hits} == exact_top_k(vector_store, query[0], 5)
+        assert all("revised" in vector_store.document(position).page_content for _, position in hits)
+
+def test_another_instance_picks_up_only_the_new_segment(store, embeddings, tmp_path):
+    store.add_documents(make_docs("big.pdf", 200), embeddings)
+    other = InMemoryVectorStore(path=str(tmp_path / "index"), index_spec=IndexSpec("flat"))
+    base = other.vector_store.segments[0]
+
+    store.add_documents(make_docs("new.pdf", 5), embeddings)
+    store.delete_source("new.pdf")
+    refreshed = other.vector_store
+    assert refreshed.segments[0] is base
+    assert refreshed.ntotal == 200 and other.list_sources() == store.list_sources()
+    # Superseded versions go, but not the one the base segment lives in.
+    assert os.path.isdir(tmp_path / "index" / "v000001")
+
+def test_compaction_upgrades_to_the_configured_index(embeddings, tmp_path):
+    store = InMemoryVectorStore(path=str(tmp_path / "index"), index_spec=IndexSpec("ivf_flat", nlist=4, train_min_vectors=150))
+    store.add_documents(make_docs("a.pdf", 100), embeddings)
+    assert index_type_of(store.vector_store.segments[0].index) == "flat"
+    store.add_documents(make_docs("b.pdf", 100), embeddings)
+    assert index_type_of(store.vector_store.segments[0].index) == "ivf_flat"
+    assert len(store.vector_store.segments) == 1
+
+    # A delete big enough to compact keeps the trained IVF index, read back from its mapped snapshot.
+    store.delete_source("a.pdf")
+    vector_store = store.vector_store
+    assert index_type_of(vector_store.segments[0].index) == "ivf_flat" and vector_store.ntotal == 100
+    reloaded = InMemoryVectorStore(path=str(tmp_path / "index"), index_spec=store.index_spec)
+    assert reloaded.list_sources() == [{"source": "b.pdf", "chunks": 100}]
+
+def test_compaction_switches_to_a_newly_configured_index_type(embeddings, tmp_path):
+    store = InMemoryVectorStore(path=str(tmp_path / "index"), index_spec=IndexSpec("hnsw", hnsw_m=8))
+    store.add_documents(make_docs("a.pdf", 60), embeddings)
+    assert index_type_of(store.vector_store.segments[0].index) == "hnsw"
+
+    # Restarted with a different index type, the next write rebuilds the base as that type.
+    store = InMemoryVectorStore(path=str(tmp_path / "index"), index_spec=IndexSpec("sq_fp16"))
+    store.add_documents(make_docs("b.pdf", 5), embeddings)
+    vector_store = store.vector_store
+    assert index_type_of(vector_store.segments[0].index) == "sq_fp16"
+    assert len(vector_store.segments) == 1 and vector_store.ntotal == 65
+
+    # A trained type waits until there are enough vectors to train it on.
+    store = InMemoryVectorStore(path=str(tmp_path / "index"), index_spec=IndexSpec("sq8", train_min_vectors=100))
+    store.add_documents(make_docs("c.pdf", 5), embeddings)
+    assert index_type_of(store.vector_store.segments[0].index) == "sq_fp16"
+    store.add_documents(make_docs("d.pdf", 40), embeddings)
+    assert index_type_of(store.vector_store.segments[0].index) == "sq8" and store.vector_store.ntotal == 110